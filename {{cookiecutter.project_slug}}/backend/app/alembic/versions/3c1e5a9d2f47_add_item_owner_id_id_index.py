@@ -0,0 +1,25 @@
+"""Add item owner_id id index
+
+Revision ID: 3c1e5a9d2f47
+Revises: 7bbdf7bd4fb2
+Create Date: 2026-10-17 09:12:41.518203
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "3c1e5a9d2f47"
+down_revision = "7bbdf7bd4fb2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_item_owner_id_id", "item", ["owner_id", "id"], unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_item_owner_id_id", table_name="item")
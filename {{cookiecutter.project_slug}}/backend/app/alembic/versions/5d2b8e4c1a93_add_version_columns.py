@@ -0,0 +1,32 @@
+"""Add version columns
+
+Revision ID: 5d2b8e4c1a93
+Revises: 3c1e5a9d2f47
+Create Date: 2026-10-17 15:04:27.730512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5d2b8e4c1a93"
+down_revision = "3c1e5a9d2f47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "user",
+        sa.Column("version", sa.Integer(), server_default="1", nullable=False),
+    )
+    op.add_column(
+        "item",
+        sa.Column("version", sa.Integer(), server_default="1", nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_column("item", "version")
+    op.drop_column("user", "version")
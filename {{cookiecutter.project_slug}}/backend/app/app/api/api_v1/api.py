@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Depends
 
 from app.api import deps
-from app.api.api_v1.endpoints import admin, items, login, users, utils
+from app.api.api_v1.endpoints import admin, batch, items, login, users, utils
 
 api_router = APIRouter()
 api_router.include_router(login.router, tags=["login"])
 api_router.include_router(users.router, prefix="/user", tags=["users"])
 api_router.include_router(utils.router, prefix="/utils", tags=["utils"])
 api_router.include_router(items.router, prefix="/items", tags=["items"])
+api_router.include_router(batch.router, tags=["batch"])
 api_router.include_router(
     admin.router,
     prefix="/admin",
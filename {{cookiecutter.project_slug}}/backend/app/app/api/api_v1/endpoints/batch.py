@@ -0,0 +1,147 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request
+from loguru import logger
+
+from app import schemas
+from app.api import deps
+from app.api.responses import ORJSONResponse
+from app.core.config import settings
+
+router = APIRouter()
+
+# Calls that only read, cancelled when the batch times out
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Calls that may write, left to finish after their batch timed out
+unfinished: Set[asyncio.Future] = set()
+
+
+def finish_unanswered(task: asyncio.Future) -> None:
+    unfinished.add(task)
+    task.add_done_callback(unfinished.discard)
+    task.add_done_callback(log_failure)
+
+
+def log_failure(task: asyncio.Future) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.opt(exception=task.exception()).error(
+            "Batched call failed after its batch timed out"
+        )
+
+
+async def call(
+    request: Request, batch_request: schemas.BatchRequest, user: schemas.UserInDB
+) -> Dict[str, Any]:
+    """
+    Run `batch_request` through the whole application, as if sent alone with
+    the headers of `request`, and return its answer.
+    """
+    url = urlsplit(batch_request.path)
+    headers = {key.lower(): value for key, value in batch_request.headers.items()}
+    # Calls can't take another identity than the batch
+    headers.update(
+        (key, value)
+        for key, value in request.headers.items()
+        if key in ("authorization", "user-agent", "x-forwarded-for")
+    )
+    body = b""
+    if batch_request.body is not None:
+        body = orjson.dumps(batch_request.body)
+        headers["content-type"] = "application/json"
+    headers["content-length"] = str(len(body))
+    scope = {
+        **request.scope,
+        "method": batch_request.method.upper(),
+        "path": settings.API_V1_STR + url.path,
+        "raw_path": (settings.API_V1_STR + url.path).encode(),
+        "query_string": url.query.encode(),
+        "headers": [(key.encode(), value.encode()) for key, value in headers.items()],
+        "batch": {"user": user},
+    }
+    for key in ("endpoint", "path_params", "route", "state"):
+        scope.pop(key, None)
+
+    async def receive() -> Dict[str, Any]:
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    answer: Dict[str, Any] = {"status": 500, "headers": {}, "body": None}
+    chunks: List[bytes] = []
+
+    async def send(message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            answer["status"] = message["status"]
+            answer["headers"] = {
+                key.decode("latin-1"): value.decode("latin-1")
+                for key, value in message["headers"]
+            }
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await request.app(scope, receive, send)
+    content = b"".join(chunks)
+    if content:
+        if answer["headers"].get("content-type", "").startswith("application/json"):
+            answer["body"] = orjson.loads(content)
+        else:
+            answer["body"] = content.decode(errors="replace")
+    answer["headers"].pop("content-length", None)
+    return answer
+
+
+@router.post("/batch", response_model=List[schemas.BatchResponse])
+async def batch(
+    batch_requests: List[schemas.BatchRequest],
+    request: Request,
+    current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Run several API calls at once, concurrently, as the current user.
+
+    Paths are relative to the API root, e.g. `/items/?limit=10`. Answers come
+    in the order of the calls; calls unanswered after the batch timeout get a
+    504. Reads are cancelled then, while calls that may write are left to
+    finish, so their 504 does not tell whether they took effect.
+    """
+    if len(batch_requests) > settings.BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.BATCH_MAX_REQUESTS} calls per batch",
+        )
+    for batch_request in batch_requests:
+        path = urlsplit(batch_request.path).path
+        # Batches don't nest
+        if not path.startswith("/") or path.rstrip("/") == "/batch":
+            raise HTTPException(
+                status_code=400, detail=f"Invalid batch path {batch_request.path}"
+            )
+    tasks = [
+        asyncio.ensure_future(call(request, batch_request, current_user))
+        for batch_request in batch_requests
+    ]
+    if tasks:
+        await asyncio.wait(tasks, timeout=settings.BATCH_TIMEOUT)
+    answers: List[Optional[Dict[str, Any]]] = []
+    cancelled = []
+    for batch_request, task in zip(batch_requests, tasks):
+        if not task.done():
+            if batch_request.method.upper() in SAFE_METHODS:
+                task.cancel()
+                cancelled.append(task)
+                detail = "Timed out"
+            else:
+                finish_unanswered(task)
+                detail = "Timed out, the call may still complete"
+            answers.append({"status": 504, "headers": {}, "body": {"detail": detail}})
+        elif task.exception() is not None:
+            answers.append(
+                {"status": 500, "headers": {}, "body": {"detail": "Internal error"}}
+            )
+        else:
+            answers.append(task.result())
+    # Let the cancelled calls unwind, releasing their sessions
+    await asyncio.gather(*cancelled, return_exceptions=True)
+    return ORJSONResponse(answers)
@@ -1,60 +1,183 @@
 from typing import Any, List, Optional
 
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+import aioredlock
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
 
-from app import crud, models, schemas
+from app import crud, schemas
 from app.api import deps
+from app.api.responses import (
+    if_match_version,
+    model_response,
+    not_modified,
+    record_response,
+)
+from app.db.cache import Cache
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[schemas.Item])
-def read_items(
+async def read_items(
     skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     owner: Optional[schemas.UserInDB] = Depends(deps.get_owner_by_id),
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
 ) -> Any:
     """
     Retrieve items.
+
+    Pass the `X-Next-Cursor` response header back as `cursor` to get the next page.
     """
-    if owner is None:
-        items = crud.item.get_multi(db, skip=skip, limit=limit)
-    else:
-        items = crud.item.get_multi_by_owner(
-            db, owner_id=owner.id, skip=skip, limit=limit
+    if owner is None and cursor is None and skip:
+        items = await crud.item_cachedb.get_multi(db, cache, skip=skip, limit=limit)
+        return model_response(items, schemas.Item)
+    try:
+        if owner is None:
+            items, next_cursor = await crud.item_cachedb.get_multi_keyset(
+                db, cache, cursor=cursor, limit=limit
+            )
+        else:
+            items, next_cursor = await crud.item_cachedb.get_multi_by_owner(
+                db,
+                cache,
+                owner_id=owner.id,
+                skip=skip if cursor is None else 0,
+                cursor=cursor,
+                limit=limit,
+            )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    headers = None if next_cursor is None else {"X-Next-Cursor": next_cursor}
+    return model_response(items, schemas.Item, headers=headers)
+
+
+@router.post("/batch", response_model=List[schemas.Item])
+async def create_items(
+    items_in: List[schemas.ItemBatchCreate],
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+) -> Any:
+    """
+    Create items in a single transaction.
+    """
+    deps.check_batch_size(items_in)
+    try:
+        return await crud.item_cachedb.create_many(db, cache, objs_in=items_in)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=400, detail="An item of the batch has an unknown owner.",
         )
-    return items
+
+
+@router.put("/batch", response_model=List[schemas.Item])
+async def update_items(
+    items_in: List[schemas.ItemBatchUpdate],
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+) -> Any:
+    """
+    Update items in a single transaction.
+
+    Ids without an item are skipped, and versions are not checked.
+    """
+    deps.check_batch_size(items_in)
+    return await crud.item_cachedb.update_many(
+        db,
+        cache,
+        objs_in={
+            item_in.id: item_in.dict(exclude_unset=True, exclude={"id"})
+            for item_in in items_in
+        },
+    )
+
+
+@router.delete("/batch", response_model=List[schemas.Item])
+async def delete_items(
+    ids: List[int] = Query(...),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+) -> Any:
+    """
+    Delete items in a single transaction.
+    """
+    deps.check_batch_size(ids)
+    return await crud.item_cachedb.remove_many(db, cache, ids=ids)
 
 
 @router.put("/{id}", response_model=schemas.Item)
-def update_item(
+async def update_item(
     item_in: schemas.ItemUpdate,
-    db: Session = Depends(deps.get_db),
-    item: models.Item = Depends(deps.get_item_by_id),
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+    lock: aioredlock.Aioredlock = Depends(deps.get_lock),
+    item: schemas.ItemInDB = Depends(deps.get_item_by_id),
 ) -> Any:
     """
     Update an item.
+
+    With `If-Match`, only if it is still at the version of that ETag.
     """
-    item = crud.item.update(db=db, db_obj=item, obj_in=item_in)
-    return item
+    version = if_match_version(if_match, schemas.Item)
+    try:
+        item = await crud.item_cachedb.update(
+            db,
+            cache,
+            cache_obj=item,
+            obj_in=item_in,
+            version=version,
+            lock_manager=lock,
+        )
+    except StaleDataError:
+        if version is not None:
+            raise HTTPException(status_code=412, detail="ETag does not match")
+        raise HTTPException(
+            status_code=409, detail="The item was modified concurrently"
+        )
+    except aioredlock.LockError:
+        raise HTTPException(
+            status_code=503, detail="The item is being updated, try again later"
+        )
+    return record_response(item, schemas.Item)
 
 
 @router.get("/{id}", response_model=schemas.Item)
-def read_item(item: models.Item = Depends(deps.get_item_by_id)) -> Any:
+async def read_item(
+    id: int,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+    lock: aioredlock.Aioredlock = Depends(deps.get_lock),
+) -> Any:
     """
     Get item by ID.
+
+    A matching `If-None-Match` is answered from the cached version alone.
     """
-    return item
+    if if_none_match:
+        version = await crud.item_cache.get_version(cache, id=id)
+        response = not_modified(if_none_match, version, schemas.Item)
+        if response is not None:
+            return response
+    item = await deps.get_item_by_id(id, db=db, cache=cache, lock=lock)
+    return record_response(item, schemas.Item)
 
 
 @router.delete("/{id}", response_model=schemas.Item)
-def delete_item(
-    db: Session = Depends(deps.get_db), item: models.Item = Depends(deps.get_item_by_id)
+async def delete_item(
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+    item: schemas.ItemInDB = Depends(deps.get_item_by_id),
 ) -> Any:
     """
     Delete an item.
     """
-    item = crud.item.remove(db=db, id=item.id)
+    item = await crud.item_cachedb.remove(db, cache, id=item.id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
     return item
@@ -1,77 +1,124 @@
-from typing import Any, List
+from typing import Any, List, Optional
 
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+import aioredlock
+from fastapi import APIRouter, Depends, Header, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
 
-from app import crud, models, schemas
+from app import crud, schemas
 from app.api import deps
+from app.api.responses import if_match_version, model_response, record_response
+from app.db.cache import Cache
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[schemas.Item])
-def read_items(
+async def read_items(
     skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
     current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
 ) -> Any:
     """
     Retrieve user items.
+
+    Pass the `X-Next-Cursor` response header back as `cursor` to get the next page.
     """
-    items = crud.item.get_multi_by_owner(
-        db=db, owner_id=current_user.id, skip=skip, limit=limit
-    )
-    return items
+    try:
+        items, next_cursor = await crud.item_cachedb.get_multi_by_owner(
+            db,
+            cache,
+            owner_id=current_user.id,
+            skip=skip if cursor is None else 0,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    headers = None if next_cursor is None else {"X-Next-Cursor": next_cursor}
+    return model_response(items, schemas.Item, headers=headers)
 
 
 @router.post("/", response_model=schemas.Item)
-def create_item(
+async def create_item(
     item_in: schemas.ItemCreate,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
     current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
 ) -> Any:
     """
     Create new item.
     """
-    item = crud.item.create_with_owner(db=db, obj_in=item_in, owner_id=current_user.id)
+    item = await crud.item_cachedb.create_with_owner(
+        db, cache, obj_in=item_in, owner_id=current_user.id
+    )
     return item
 
 
 @router.put("/{id}", response_model=schemas.Item)
-def update_item(
+async def update_item(
     item_in: schemas.ItemUpdate,
-    db: Session = Depends(deps.get_db),
-    item: models.Item = Depends(deps.get_owned_item_by_id),
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+    lock: aioredlock.Aioredlock = Depends(deps.get_lock),
+    item: schemas.ItemInDB = Depends(deps.get_owned_item_by_id),
     current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
 ) -> Any:
     """
     Update an item.
+
+    With `If-Match`, only if it is still at the version of that ETag.
     """
-    item = crud.item.update(db=db, db_obj=item, obj_in=item_in)
-    return item
+    version = if_match_version(if_match, schemas.Item)
+    try:
+        item = await crud.item_cachedb.update(
+            db,
+            cache,
+            cache_obj=item,
+            obj_in=item_in,
+            version=version,
+            lock_manager=lock,
+        )
+    except StaleDataError:
+        if version is not None:
+            raise HTTPException(status_code=412, detail="ETag does not match")
+        raise HTTPException(
+            status_code=409, detail="The item was modified concurrently"
+        )
+    except aioredlock.LockError:
+        raise HTTPException(
+            status_code=503, detail="The item is being updated, try again later"
+        )
+    return record_response(item, schemas.Item)
 
 
 @router.get("/{id}", response_model=schemas.Item)
-def read_item(
-    db: Session = Depends(deps.get_db),
-    item: models.Item = Depends(deps.get_owned_item_by_id),
+async def read_item(
+    if_none_match: Optional[str] = Header(None),
+    item: schemas.ItemInDB = Depends(deps.get_owned_item_by_id),
     current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
 ) -> Any:
     """
     Get item by ID.
     """
-    return item
+    return record_response(item, schemas.Item, if_none_match=if_none_match)
 
 
 @router.delete("/{id}", response_model=schemas.Item)
-def delete_item(
-    db: Session = Depends(deps.get_db),
-    item: models.Item = Depends(deps.get_owned_item_by_id),
+async def delete_item(
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+    item: schemas.ItemInDB = Depends(deps.get_owned_item_by_id),
     current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
 ) -> Any:
     """
     Delete an item.
     """
-    item = crud.item.remove(db=db, id=item.id)
+    item = await crud.item_cachedb.remove(db, cache, id=item.id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
     return item
@@ -1,15 +1,17 @@
 from datetime import timedelta
 from typing import Any
 
-import aioredis
 from fastapi import APIRouter, Body, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 
 from app import crud, schemas
 from app.api import deps
 from app.core import security
 from app.core.config import settings
+from app.db.cache import Cache
 from app.utils import (
     generate_password_reset_token,
     send_reset_password_email,
@@ -20,13 +22,14 @@ router = APIRouter()
 
 
 @router.post("/login/access-token", response_model=schemas.Token)
-def login_access_token(
-    db: Session = Depends(deps.get_db), form_data: OAuth2PasswordRequestForm = Depends()
+async def login_access_token(
+    db: AsyncSession = Depends(deps.get_async_db),
+    form_data: OAuth2PasswordRequestForm = Depends(),
 ) -> Any:
     """
     OAuth2 compatible token login, get an access token for future requests
     """
-    user = crud.user.authenticate(
+    user = await crud.user.aauthenticate(
         db, username=form_data.username, password=form_data.password
     )
     if user is None:
@@ -87,8 +90,8 @@ def recover_password(email: str, db: Session = Depends(deps.get_db)) -> Any:
 async def reset_password(
     token: str = Body(...),
     new_password: str = Body(...),
-    db: Session = Depends(deps.get_db),
-    redis: aioredis.Redis = Depends(deps.get_redis),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
 ) -> Any:
     """
     Reset password
@@ -96,7 +99,7 @@ async def reset_password(
     email = verify_password_reset_token(token)
     if not email:
         raise HTTPException(status_code=400, detail="Invalid token")
-    user = await crud.user_cachedb.get_by_email(db, redis, email=email)
+    user = await crud.user_cachedb.get_by_email(db, cache, email=email)
     if user is None:
         raise HTTPException(
             status_code=404,
@@ -104,7 +107,21 @@ async def reset_password(
         )
     elif not user.is_active:
         raise HTTPException(status_code=401, detail="Inactive user")
-    user = await crud.user_cachedb.update(
-        db, redis, cache_obj=user, obj_in={"password": new_password}
-    )
+    try:
+        await crud.user_cachedb.update(
+            db, cache, cache_obj=user, obj_in={"password": new_password}
+        )
+    except StaleDataError:
+        # The new password applies whatever changed since the user was cached
+        user = await crud.user_cachedb.load_from_db(db, cache, id=user.id)
+        if user is None:
+            raise HTTPException(status_code=404, detail="The user was removed")
+        try:
+            await crud.user_cachedb.update(
+                db, cache, cache_obj=user, obj_in={"password": new_password}
+            )
+        except StaleDataError:
+            raise HTTPException(
+                status_code=409, detail="The user was modified concurrently"
+            )
     return {"msg": "Password updated successfully"}
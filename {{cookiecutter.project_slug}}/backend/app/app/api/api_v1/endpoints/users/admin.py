@@ -1,44 +1,74 @@
-from typing import Any, List
+from typing import Any, List, Optional
 
-import aioredis
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import aioredlock
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
 
 from app import crud, schemas
 from app.api import deps
+from app.api.responses import (
+    if_match_version,
+    model_response,
+    not_modified,
+    record_response,
+)
 from app.core.config import settings
+from app.db.cache import Cache
 from app.utils import send_new_account_email
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[schemas.User])
-def read_users(
-    skip: int = 0, limit: int = 100, db: Session = Depends(deps.get_db),
+async def read_users(
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    ids: Optional[List[int]] = Query(None),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
 ) -> Any:
     """
-    Retrieve users.
+    Retrieve users, or the users with the given `ids` when they are passed.
+
+    Pass the `X-Next-Cursor` response header back as `cursor` to get the next page.
     """
-    return crud.user.get_multi(db, skip=skip, limit=limit)
+    if ids is not None:
+        deps.check_batch_size(ids)
+        users = await crud.user_cachedb.get_many(db, cache, ids=ids)
+        return model_response(users, schemas.User)
+    if cursor is None and skip:
+        users = await crud.user_cachedb.get_multi(db, cache, skip=skip, limit=limit)
+        return model_response(users, schemas.User)
+    try:
+        users, next_cursor = await crud.user_cachedb.get_multi_keyset(
+            db, cache, cursor=cursor, limit=limit
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    headers = None if next_cursor is None else {"X-Next-Cursor": next_cursor}
+    return model_response(users, schemas.User, headers=headers)
 
 
 @router.post("/", response_model=schemas.User)
 async def create_user(
     *,
     user_in: schemas.UserCreate,
-    db: Session = Depends(deps.get_db),
-    redis: aioredis.Redis = Depends(deps.get_redis),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
 ) -> Any:
     """
     Create new user.
     """
-    user = crud.user.get_by_email(db, email=user_in.email)
+    user = await crud.user.aget_by_email(db, email=user_in.email)
     if user:
         raise HTTPException(
             status_code=400,
             detail="The user with this username already exists in the system.",
         )
-    user = await crud.user_cachedb.create(db, redis, obj_in=user_in)
+    user = await crud.user_cachedb.create(db, cache, obj_in=user_in)
     if settings.EMAILS_ENABLED:
         send_new_account_email(
             email_to=user.email, username=user.username, password=user_in.password
@@ -46,14 +76,108 @@ async def create_user(
     return user
 
 
+@router.post("/batch", response_model=List[schemas.User])
+async def create_users(
+    *,
+    users_in: List[schemas.UserCreate],
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+) -> Any:
+    """
+    Create users in a single transaction.
+    """
+    deps.check_batch_size(users_in)
+    emails = [user_in.email for user_in in users_in]
+    if len(set(emails)) != len(emails):
+        raise HTTPException(
+            status_code=400, detail="The batch contains the same email more than once.",
+        )
+    if await crud.user.aget_multi_by_email(db, emails=emails):
+        raise HTTPException(
+            status_code=400,
+            detail="A user with one of these emails already exists in the system.",
+        )
+    try:
+        users = await crud.user_cachedb.create_many(db, cache, objs_in=users_in)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=400,
+            detail="A user of the batch has the email or username of another user.",
+        )
+    if settings.EMAILS_ENABLED:
+        passwords = {user_in.email: user_in.password for user_in in users_in}
+        for user in users:
+            send_new_account_email(
+                email_to=user.email,
+                username=user.username,
+                password=passwords[user.email],
+            )
+    return users
+
+
+@router.put("/batch", response_model=List[schemas.User])
+async def update_users(
+    *,
+    users_in: List[schemas.UserBatchUpdate],
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+) -> Any:
+    """
+    Update users in a single transaction.
+
+    Ids without a user are skipped, and versions are not checked.
+    """
+    deps.check_batch_size(users_in)
+    try:
+        return await crud.user_cachedb.update_many(
+            db,
+            cache,
+            objs_in={
+                user_in.id: user_in.dict(exclude_unset=True, exclude={"id"})
+                for user_in in users_in
+            },
+        )
+    except IntegrityError:
+        raise HTTPException(
+            status_code=400,
+            detail="A user of the batch has the email or username of another user.",
+        )
+
+
+@router.delete("/batch", response_model=List[schemas.User])
+async def delete_users(
+    *,
+    ids: List[int] = Query(...),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+) -> Any:
+    """
+    Delete users in a single transaction.
+    """
+    deps.check_batch_size(ids)
+    return await crud.user_cachedb.remove_many(db, cache, ids=ids)
+
+
 @router.get("/{id}", response_model=schemas.User)
 async def read_user_by_id(
-    user: schemas.UserInDB = Depends(deps.get_user_by_id),
+    id: int,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+    lock: aioredlock.Aioredlock = Depends(deps.get_lock),
 ) -> Any:
     """
     Get a specific user by id.
+
+    A matching `If-None-Match` is answered from the cached version alone.
     """
-    return user
+    if if_none_match:
+        version = await crud.user_cache.get_version(cache, id=id)
+        response = not_modified(if_none_match, version, schemas.User)
+        if response is not None:
+            return response
+    user = await deps.get_user_by_id(id, db=db, cache=cache, lock=lock)
+    return record_response(user, schemas.User)
 
 
 @router.put("/{id}", response_model=schemas.User)
@@ -61,13 +185,34 @@ async def update_user(
     *,
     user: schemas.UserInDB = Depends(deps.get_user_by_id),
     user_in: schemas.UserUpdate,
-    db: Session = Depends(deps.get_db),
-    redis: aioredis.Redis = Depends(deps.get_redis),
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+    lock: aioredlock.Aioredlock = Depends(deps.get_lock),
 ) -> Any:
     """
     Update a user.
+
+    With `If-Match`, only if it is still at the version of that ETag.
     """
-    updated_user = await crud.user_cachedb.update(
-        db, redis, cache_obj=user, obj_in=user_in
-    )
-    return updated_user
+    version = if_match_version(if_match, schemas.User)
+    try:
+        updated_user = await crud.user_cachedb.update(
+            db,
+            cache,
+            cache_obj=user,
+            obj_in=user_in,
+            version=version,
+            lock_manager=lock,
+        )
+    except StaleDataError:
+        if version is not None:
+            raise HTTPException(status_code=412, detail="ETag does not match")
+        raise HTTPException(
+            status_code=409, detail="The user was modified concurrently"
+        )
+    except aioredlock.LockError:
+        raise HTTPException(
+            status_code=503, detail="The user is being updated, try again later"
+        )
+    return record_response(updated_user, schemas.User)
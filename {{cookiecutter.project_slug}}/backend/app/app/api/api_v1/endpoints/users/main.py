@@ -1,12 +1,15 @@
-from typing import Any
+from typing import Any, Optional
 
-import aioredis
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import aioredlock
+from fastapi import APIRouter, Depends, Header, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
 
 from app import crud, schemas
 from app.api import deps
+from app.api.responses import if_match_version, record_response
 from app.core.config import settings
+from app.db.cache import Cache
 from app.utils import send_new_account_email
 
 router = APIRouter()
@@ -16,36 +19,58 @@ router = APIRouter()
 async def update_user_me(
     *,
     user_in: schemas.UnprivilegedUserUpdate,
-    db: Session = Depends(deps.get_db),
-    redis: aioredis.Redis = Depends(deps.get_redis),
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
+    lock: aioredlock.Aioredlock = Depends(deps.get_lock),
     current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
 ) -> Any:
     """
     Update own user.
+
+    With `If-Match`, only if it is still at the version of that ETag.
     """
     user_in = schemas.UserUpdate(**user_in.dict(exclude_unset=True))
-    return await crud.user_cachedb.update(
-        db, redis, cache_obj=current_user, obj_in=user_in
-    )
+    version = if_match_version(if_match, schemas.User)
+    try:
+        user = await crud.user_cachedb.update(
+            db,
+            cache,
+            cache_obj=current_user,
+            obj_in=user_in,
+            version=version,
+            lock_manager=lock,
+        )
+    except StaleDataError:
+        if version is not None:
+            raise HTTPException(status_code=412, detail="ETag does not match")
+        raise HTTPException(
+            status_code=409, detail="The user was modified concurrently"
+        )
+    except aioredlock.LockError:
+        raise HTTPException(
+            status_code=503, detail="The user is being updated, try again later"
+        )
+    return record_response(user, schemas.User)
 
 
 @router.get("", response_model=schemas.User)
-def read_user_me(
-    db: Session = Depends(deps.get_db),
+async def read_user_me(
+    if_none_match: Optional[str] = Header(None),
     current_user: schemas.UserInDB = Depends(deps.get_current_active_user),
 ) -> Any:
     """
     Get current user.
     """
-    return current_user
+    return record_response(current_user, schemas.User, if_none_match=if_none_match)
 
 
 @router.post("", response_model=schemas.User)
 async def create_user_open(
     *,
     user_in: schemas.UnprivilegedUserCreate,
-    db: Session = Depends(deps.get_db),
-    redis: aioredis.Redis = Depends(deps.get_redis),
+    db: AsyncSession = Depends(deps.get_async_db),
+    cache: Cache = Depends(deps.get_cache),
 ) -> Any:
     """
     Create new user without the need to be logged in.
@@ -55,14 +80,14 @@ async def create_user_open(
             status_code=403,
             detail="Open user registration is forbidden on this server",
         )
-    user = crud.user.get_by_email(db, email=user_in.email)
+    user = await crud.user.aget_by_email(db, email=user_in.email)
     if user is not None:
         raise HTTPException(
             status_code=400,
             detail="The user with this username already exists in the system",
         )
     user_in = schemas.UserCreate(user_in.dict(exclude_unset=True))
-    user = await crud.user_cachedb.create(db, redis, obj_in=user_in)
+    user = await crud.user_cachedb.create(db, cache, obj_in=user_in)
     if settings.EMAILS_ENABLED and user_in.email:
         send_new_account_email(
             email_to=user_in.email, username=user_in.email, password=user_in.password
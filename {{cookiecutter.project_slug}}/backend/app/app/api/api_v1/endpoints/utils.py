@@ -1,11 +1,12 @@
-from typing import Any
+from typing import Any, Dict
 
 from fastapi import APIRouter, Depends
 from pydantic.networks import EmailStr
 
-from app import schemas
+from app import crud, schemas
 from app.api import deps
 from app.core.celery_app import celery_app
+from app.core.security import password_pool
 from app.core.socket import external_sio
 from app.pusher.namespaces import user_namespace
 from app.utils import send_test_email
@@ -47,3 +48,28 @@ async def test_socket(
     """
     await user_namespace.emit_private(external_sio, current_user.id, msg.msg)
     return {"msg": "Sent"}
+
+
+@router.get("/cache-stats/", response_model=Dict[str, Dict[str, int]])
+def read_cache_stats(
+    current_user: schemas.UserInDB = Depends(deps.get_current_active_superuser),
+) -> Any:
+    """
+    Read the in-process cache counters of this worker.
+    """
+    caches = [crud.user_cache]
+    return {
+        cache.tablename: cache.local_cache.stats()
+        for cache in caches
+        if cache.local_cache is not None
+    }
+
+
+@router.get("/password-pool-stats/", response_model=Dict[str, float])
+def read_password_pool_stats(
+    current_user: schemas.UserInDB = Depends(deps.get_current_active_superuser),
+) -> Any:
+    """
+    Read the password hashing counters of this worker.
+    """
+    return password_pool.stats()
@@ -1,4 +1,7 @@
-from typing import Generator, Optional
+import hashlib
+import hmac
+import time
+from typing import AsyncGenerator, Generator, Optional, Sized
 
 import aioredis
 import aioredlock
@@ -7,15 +10,22 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import crud, models, schemas
+from app import crud, schemas
 from app.core import security
 from app.core.config import settings
-from app.db.session import SessionLocal
+from app.crud.local_cache import LocalCache
+from app.db.cache import Cache
+from app.db.session import LazySession, SessionLocal
 
 reusable_oauth2 = OAuth2PasswordBearer(tokenUrl=settings.ACCESS_TOKEN_URL)
 
+# Payloads of verified access tokens, keyed by token digest
+token_cache = LocalCache(
+    maxsize=settings.TOKEN_CACHE_MAXSIZE, ttl=settings.TOKEN_CACHE_TTL
+)
+
 
 def get_db() -> Generator:
     try:
@@ -25,19 +35,51 @@ def get_db() -> Generator:
         db.close()
 
 
+async def get_async_db() -> AsyncGenerator:
+    # Shared by the dependencies of a request, touches the pool only if queried
+    db = LazySession()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
 def get_redis(request: starlette.requests.Request) -> aioredis.Redis:
     return request.app.state.redis
 
 
+def get_cache(request: starlette.requests.Request) -> Cache:
+    return request.app.state.cache
+
+
 def get_lock(request: starlette.requests.Request) -> aioredlock.Aioredlock:
     return request.app.state.lock
 
 
-async def get_current_user(
-    db: Session = Depends(get_db),
-    redis: aioredis.Redis = Depends(get_redis),
-    token: str = Depends(reusable_oauth2),
-) -> schemas.UserInDB:
+def check_batch_size(records: Sized) -> None:
+    if len(records) > settings.BATCH_MAX_RECORDS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.BATCH_MAX_RECORDS} records per batch",
+        )
+
+
+def check_metrics_token(token: str = Depends(reusable_oauth2)) -> None:
+    if not hmac.compare_digest(token, settings.METRICS_TOKEN or ""):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Could not validate credentials",
+        )
+
+
+def decode_token(token: str) -> schemas.TokenPayload:
+    """
+    Verify `token` and parse its claims, once per token until it expires.
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()
+    token_data = token_cache.get(key)
+    if token_data is not None:
+        return token_data
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
@@ -48,7 +90,23 @@ async def get_current_user(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = await crud.user_cachedb.get(db, redis, id=token_data.sub)
+    if "exp" in payload:
+        token_cache.set(key, token_data, ttl=payload["exp"] - time.time())
+    return token_data
+
+
+async def get_current_user(
+    db: AsyncSession = Depends(get_async_db),
+    cache: Cache = Depends(get_cache),
+    lock: aioredlock.Aioredlock = Depends(get_lock),
+    token: str = Depends(reusable_oauth2),
+    request: starlette.requests.Request = None,
+) -> schemas.UserInDB:
+    if request is not None and "user" in request.scope.get("batch", ()):
+        # Batched call, authenticated once by the batch with the same token
+        return request.scope["batch"]["user"]
+    token_data = decode_token(token)
+    user = await crud.user_cachedb.get(db, cache, id=token_data.sub, lock_manager=lock)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -73,9 +131,12 @@ def get_current_active_superuser(
 
 
 async def get_user_by_id(
-    id: int, db: Session = Depends(get_db), redis: aioredis.Redis = Depends(get_redis),
+    id: int,
+    db: AsyncSession = Depends(get_async_db),
+    cache: Cache = Depends(get_cache),
+    lock: aioredlock.Aioredlock = Depends(get_lock),
 ) -> schemas.UserInDB:
-    user = await crud.user_cachedb.get(db, redis, id=id)
+    user = await crud.user_cachedb.get(db, cache, id=id, lock_manager=lock)
     if user is None:
         raise HTTPException(
             status_code=404,
@@ -86,12 +147,13 @@ async def get_user_by_id(
 
 async def get_owner_by_id(
     owner_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    redis: aioredis.Redis = Depends(get_redis),
+    db: AsyncSession = Depends(get_async_db),
+    cache: Cache = Depends(get_cache),
+    lock: aioredlock.Aioredlock = Depends(get_lock),
 ) -> Optional[schemas.UserInDB]:
     if owner_id is None:
         return None
-    user = await crud.user_cachedb.get(db, redis, id=owner_id)
+    user = await crud.user_cachedb.get(db, cache, id=owner_id, lock_manager=lock)
     if user is None:
         raise HTTPException(
             status_code=404,
@@ -100,17 +162,22 @@ async def get_owner_by_id(
     return user
 
 
-def get_item_by_id(id: int, db: Session = Depends(get_db),) -> models.Item:
-    item = crud.item.get(db=db, id=id)
+async def get_item_by_id(
+    id: int,
+    db: AsyncSession = Depends(get_async_db),
+    cache: Cache = Depends(get_cache),
+    lock: aioredlock.Aioredlock = Depends(get_lock),
+) -> schemas.ItemInDB:
+    item = await crud.item_cachedb.get(db, cache, id=id, lock_manager=lock)
     if item is None:
         raise HTTPException(status_code=404, detail="Item not found")
     return item
 
 
 def get_owned_item_by_id(
-    item: models.Item = Depends(get_item_by_id),
+    item: schemas.ItemInDB = Depends(get_item_by_id),
     current_user: schemas.UserInDB = Depends(get_current_active_user),
-) -> models.Item:
+) -> schemas.ItemInDB:
     if item.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Item not found")
     return item
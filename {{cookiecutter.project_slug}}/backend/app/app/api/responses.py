@@ -0,0 +1,120 @@
+from functools import lru_cache
+from typing import Any, Dict, Optional, Sequence, Tuple, Type, Union
+
+import orjson
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette.responses import JSONResponse, Response
+
+from app.crud.codecs import schema_version
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered by orjson, several times faster than json.dumps.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=jsonable_encoder)
+
+
+@lru_cache(maxsize=None)
+def response_fields(
+    record_class: Type[BaseModel], schema: Type[BaseModel]
+) -> Tuple[str, ...]:
+    fields = tuple(schema.__fields__)
+    missing = set(fields) - set(record_class.__fields__)
+    if missing:
+        raise TypeError(
+            f"{record_class.__name__} lacks fields of {schema.__name__}: "
+            f"{', '.join(sorted(missing))}"
+        )
+    return fields
+
+
+def pick(record: BaseModel, schema: Type[BaseModel]) -> Dict[str, Any]:
+    # Several times faster than record.dict(include=...). Nested models are
+    # left to orjson, which encodes them through jsonable_encoder
+    values = record.__dict__
+    return {field: values[field] for field in response_fields(type(record), schema)}
+
+
+def model_response(
+    content: Union[BaseModel, Sequence[BaseModel]],
+    schema: Type[BaseModel],
+    *,
+    status_code: int = 200,
+    headers: Optional[Dict[str, str]] = None,
+) -> ORJSONResponse:
+    """
+    Respond with the `schema` fields of records, or of a list of records,
+    that are already validated, e.g. read from the cache.
+
+    Returning the records themselves makes `response_model` copy, validate and
+    encode them again. `schema` must only pick fields of the records as they
+    are, like `User` of `UserInDB`.
+    """
+    if isinstance(content, BaseModel):
+        data: Any = pick(content, schema)
+    else:
+        data = [pick(record, schema) for record in content]
+    return ORJSONResponse(data, status_code=status_code, headers=headers)
+
+
+@lru_cache(maxsize=None)
+def schema_tag(schema: Type[BaseModel]) -> str:
+    return f"{schema_version(schema):08x}"
+
+
+def etag(version: int, schema: Type[BaseModel]) -> str:
+    """
+    Return the ETag of a record at `version` sent as `schema`, which changes
+    when either does.
+    """
+    return f'"{version}.{schema_tag(schema)}"'
+
+
+def not_modified(
+    if_none_match: Optional[str], version: Optional[int], schema: Type[BaseModel]
+) -> Optional[Response]:
+    """
+    Return a 304 response if `if_none_match` holds the ETag of `version`.
+    """
+    if not if_none_match or version is None:
+        return None
+    current = etag(version, schema)
+    # Weak comparison, as GET requires
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in tags or any(tag.replace("W/", "", 1) == current for tag in tags):
+        return Response(status_code=304, headers={"ETag": current})
+    return None
+
+
+def record_response(
+    record: BaseModel, schema: Type[BaseModel], *, if_none_match: Optional[str] = None
+) -> Response:
+    """
+    Respond with `record` and its ETag, or a 304 if the client has it already.
+    """
+    version = record.version  # type: ignore
+    response = not_modified(if_none_match, version, schema)
+    if response is not None:
+        return response
+    return model_response(record, schema, headers={"ETag": etag(version, schema)})
+
+
+def if_match_version(if_match: Optional[str], schema: Type[BaseModel]) -> Optional[int]:
+    """
+    Return the version an `If-Match` header requires the record to be at, or
+    None if there is no such header or it accepts any version.
+
+    Raise a 412 for ETags of no version of records sent as `schema`.
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    # Strong comparison, as the version must be exact
+    version, _, tag = if_match.strip().strip('"').partition(".")
+    if tag != schema_tag(schema) or not version.isdigit():
+        raise HTTPException(status_code=412, detail="ETag does not match")
+    return int(version)
@@ -0,0 +1,43 @@
+"""
+Measure the per-request cost of authenticating a bearer token: verifying and
+parsing it every time, as before, and through the verified-token cache.
+
+Needs no running services:
+
+    python -m app.benchmarks.auth_tokens [iterations]
+"""
+import sys
+
+from jose import jwt
+
+from app import schemas
+from app.api import deps
+from app.benchmarks.cache_codecs import time_per_call
+from app.core import security
+from app.core.config import settings
+
+TOKEN = security.create_access_token(123456)
+
+
+def verify() -> schemas.TokenPayload:
+    payload = jwt.decode(TOKEN, settings.SECRET_KEY, algorithms=[security.ALGORITHM])
+    return schemas.TokenPayload(**payload)
+
+
+def miss() -> schemas.TokenPayload:
+    deps.token_cache.clear()
+    return deps.decode_token(TOKEN)
+
+
+def main(iterations: int) -> None:
+    verify_us = time_per_call(verify, iterations)
+    miss_us = time_per_call(miss, iterations)
+    cached_us = time_per_call(lambda: deps.decode_token(TOKEN), iterations)
+    print(f"{'path':<16}{'us per request':>16}")
+    print(f"{'verify':<16}{verify_us:>16.2f}")
+    print(f"{'cache miss':<16}{miss_us:>16.2f}")
+    print(f"{'cache hit':<16}{cached_us:>16.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
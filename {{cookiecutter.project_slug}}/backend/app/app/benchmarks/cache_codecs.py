@@ -0,0 +1,66 @@
+"""
+Compare payload size and encode/decode time of the cache codecs on user
+records, as whole values and as Redis hash fields.
+
+Needs no running services:
+
+    python -m app.benchmarks.cache_codecs [iterations]
+"""
+import sys
+import time
+from typing import Any, Callable, Dict
+
+from app.crud.codecs import codecs
+from app.schemas.user import UserInDB
+
+RECORD = UserInDB(
+    id=123456,
+    version=1,
+    username="benchmark_user",
+    email="benchmark.user@example.com",
+    full_name="Benchmark User",
+    is_active=True,
+    is_superuser=False,
+    hashed_password="$2b$12$5Ue3Ah2tnN6YG0zJ5o6lxOqW5nD1lCw0V0yqj1V3pGx8c9KXh4P2m",
+)
+
+
+def time_per_call(function: Callable[[], Any], iterations: int) -> float:
+    """
+    Return microseconds per call.
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) * 1e6 / iterations
+
+
+def main(iterations: int) -> None:
+    print(f"{'codec':<8}{'storage':<8}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for name, codec_class in codecs.items():
+        codec = codec_class(UserInDB)
+        data = codec.encode(RECORD)
+        fields: Dict[bytes, bytes] = {
+            key.encode(): value for key, value in codec.encode_fields(RECORD).items()
+        }
+        for storage, size, encode, decode in (
+            (
+                "string",
+                len(data),
+                lambda: codec.encode(RECORD),
+                lambda: codec.decode(data),
+            ),
+            (
+                "hash",
+                sum(len(key) + len(value) for key, value in fields.items()),
+                lambda: codec.encode_fields(RECORD),
+                lambda: codec.decode_fields(fields),
+            ),
+        ):
+            encode_us = time_per_call(encode, iterations)
+            decode_us = time_per_call(decode, iterations)
+            print(f"{name:<8}{storage:<8}{size:>8}{encode_us:>12.2f}{decode_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,79 @@
+"""
+Measure what compressing cached values saves and costs, per codec, on a user,
+items with short and long descriptions, and a page of items as a list cache
+would store it.
+
+Needs no running services:
+
+    python -m app.benchmarks.cache_compression [iterations]
+"""
+import random
+import sys
+from typing import List
+
+from pydantic import BaseModel
+
+from app.benchmarks.cache_codecs import RECORD as USER
+from app.benchmarks.cache_codecs import time_per_call
+from app.crud.codecs import codecs
+from app.schemas.item import ItemInDB
+
+WORDS = (
+    "the of and to in is for on with as by at from that this be are was it an "
+    "order delivery invoice customer account status shipping warehouse payment "
+    "product quantity price discount refund support request update schedule"
+).split()
+
+
+def text(words: int, seed: int) -> str:
+    generator = random.Random(seed)
+    return " ".join(generator.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def item(id: int, words: int) -> ItemInDB:
+    return ItemInDB(
+        id=id, version=1, title=text(6, id), description=text(words, id), owner_id=42,
+    )
+
+
+class ItemPage(BaseModel):
+    items: List[ItemInDB]
+
+
+PAYLOADS = [
+    ("user", USER),
+    ("item", item(1, 30)),
+    ("item long", item(2, 400)),
+    ("item page", ItemPage(items=[item(id, 30) for id in range(100)])),
+]
+
+
+def main(iterations: int) -> None:
+    print(
+        f"{'payload':<11}{'codec':<8}{'bytes':>8}{'zlib':>8}{'ratio':>7}"
+        f"{'encode us':>11}{'+zlib':>9}{'decode us':>11}{'+zlib':>9}"
+    )
+    for payload_name, payload in PAYLOADS:
+        schema = type(payload)
+        for codec_name, codec_class in codecs.items():
+            plain = codec_class(schema)
+            compressing = codec_class(schema, compress_threshold=1)
+            data = plain.encode(payload)
+            compressed = compressing.encode(payload)
+            timings = [
+                time_per_call(lambda: codec.encode(payload), iterations)
+                for codec in (plain, compressing)
+            ] + [
+                time_per_call(lambda: codec.decode(value), iterations)
+                for codec, value in ((plain, data), (compressing, compressed))
+            ]
+            print(
+                f"{payload_name:<11}{codec_name:<8}{len(data):>8}"
+                f"{len(compressed):>8}{len(data) / len(compressed):>7.2f}"
+                f"{timings[0]:>11.2f}{timings[1] - timings[0]:>9.2f}"
+                f"{timings[2]:>11.2f}{timings[3] - timings[2]:>9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,124 @@
+"""
+Compare database round trips and latency of the RETURNING-based async item
+writes with the ORM add/commit/refresh pattern they replaced.
+
+Run against a migrated database:
+
+    python -m app.benchmarks.crud_writes [iterations]
+"""
+import asyncio
+import sys
+import time
+from typing import Any, Awaitable, Callable, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud, models, schemas
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal, async_engine
+
+
+class RoundTripCounter:
+    """
+    Count BEGIN, statements and COMMIT sent on the async engine.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        for name in ("begin", "before_cursor_execute", "commit"):
+            event.listen(async_engine.sync_engine, name, self.increment)
+
+    def increment(self, *args: Any, **kwargs: Any) -> None:
+        self.count += 1
+
+
+async def orm_create(db: AsyncSession, owner_id: int) -> models.Item:
+    db_obj = models.Item(title="benchmark", owner_id=owner_id)
+    db.add(db_obj)
+    await db.commit()
+    await db.refresh(db_obj)
+    return db_obj
+
+
+async def orm_update(db: AsyncSession, db_obj: models.Item) -> models.Item:
+    db_obj.description = "updated"
+    db.add(db_obj)
+    await db.commit()
+    await db.refresh(db_obj)
+    return db_obj
+
+
+async def orm_remove(db: AsyncSession, id: int) -> models.Item:
+    db_obj = await db.get(models.Item, id)
+    await db.delete(db_obj)
+    await db.commit()
+    return db_obj
+
+
+async def measure(
+    counter: RoundTripCounter,
+    operation: Callable[[AsyncSession, Any], Awaitable[Any]],
+    arguments: List[Any],
+    *,
+    load: bool = False,
+) -> Tuple[float, float, List[Any]]:
+    """
+    Return round trips per call, milliseconds per call and the call results.
+
+    With `load`, each argument is an item id loaded before the clock starts.
+    """
+    round_trips = 0
+    elapsed = 0.0
+    results = []
+    for argument in arguments:
+        # A fresh session per call, as each request gets its own
+        async with AsyncSessionLocal() as db:
+            if load:
+                argument = await db.get(models.Item, argument)
+            start_count, start = counter.count, time.perf_counter()
+            results.append(await operation(db, argument))
+            elapsed += time.perf_counter() - start
+            round_trips += counter.count - start_count
+    return round_trips / len(arguments), elapsed * 1000 / len(arguments), results
+
+
+async def returning_create(db: AsyncSession, owner_id: int) -> models.Item:
+    return await crud.item.acreate_with_owner(
+        db, obj_in=schemas.ItemCreate(title="benchmark"), owner_id=owner_id
+    )
+
+
+async def returning_update(db: AsyncSession, db_obj: models.Item) -> models.Item:
+    return await crud.item.aupdate(db, db_obj=db_obj, obj_in={"description": "new"})
+
+
+async def returning_remove(db: AsyncSession, id: int) -> models.Item:
+    return await crud.item.aremove(db, id=id)
+
+
+async def main(iterations: int) -> None:
+    counter = RoundTripCounter()
+    async with AsyncSessionLocal() as db:
+        owner = await crud.user.aget_by_email(db, email=settings.FIRST_SUPERUSER_EMAIL)
+    assert owner is not None, "Run app/initial_data.py first"
+    print(f"{'operation':<10}{'path':<12}{'round trips':>14}{'ms/op':>10}")
+    for path, create, update, remove in (
+        ("orm", orm_create, orm_update, orm_remove),
+        ("returning", returning_create, returning_update, returning_remove),
+    ):
+        create_stats = await measure(counter, create, [owner.id] * iterations)
+        ids = [item.id for item in create_stats[2]]
+        update_stats = await measure(counter, update, ids, load=True)
+        remove_stats = await measure(counter, remove, ids)
+        for operation, (round_trips, ms, _) in (
+            ("create", create_stats),
+            ("update", update_stats),
+            ("remove", remove_stats),
+        ):
+            print(f"{operation:<10}{path:<12}{round_trips:>14.1f}{ms:>10.2f}")
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
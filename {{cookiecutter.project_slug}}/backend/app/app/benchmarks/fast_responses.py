@@ -0,0 +1,109 @@
+"""
+Measure the time to answer `/users/me` and `/items/` with records already read
+from the cache: through `response_model`, with its stock JSON response and with
+the orjson one, and through `model_response`.
+
+The endpoints are replicated without authentication nor storage, so only
+routing and serialization are timed. Needs no running services:
+
+    python -m app.benchmarks.fast_responses [iterations]
+"""
+import asyncio
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from fastapi import FastAPI
+from starlette.responses import JSONResponse
+
+from app import schemas
+from app.api.responses import ORJSONResponse, model_response
+from app.benchmarks.cache_codecs import RECORD as USER
+from app.benchmarks.cache_compression import item
+
+ITEMS = [item(id, 30) for id in range(100)]
+
+# Path, records, and the schema of the response
+ENDPOINTS = [
+    ("/users/me", USER, schemas.User),
+    ("/items/", ITEMS, schemas.Item),
+]
+MODES = ["response_model", "orjson", "model_response"]
+
+
+def records_endpoint(content: Any) -> Callable:
+    async def read_records() -> Any:
+        return content
+
+    return read_records
+
+
+def model_response_endpoint(content: Any, schema: Any) -> Callable:
+    async def read_records() -> Any:
+        return model_response(content, schema)
+
+    return read_records
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+    for path, content, schema in ENDPOINTS:
+        response_model = schema if content is USER else List[schema]  # type: ignore
+        for mode, response_class in (
+            ("response_model", JSONResponse),
+            ("orjson", ORJSONResponse),
+        ):
+            app.get(
+                f"/{mode}{path}",
+                response_model=response_model,
+                response_class=response_class,
+            )(records_endpoint(content))
+        app.get(f"/model_response{path}")(model_response_endpoint(content, schema))
+    return app
+
+
+async def time_per_request(app: FastAPI, path: str, iterations: int) -> float:
+    """
+    Return microseconds per request, and check the answer.
+    """
+    scope: Dict[str, Any] = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+    }
+    body = []
+
+    async def receive() -> Dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.body":
+            body.append(message["body"])
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await app(dict(scope), receive, send)
+    elapsed = time.perf_counter() - start
+    assert b'"id"' in body[-1] and b"hashed_password" not in body[-1]
+    return elapsed * 1e6 / iterations
+
+
+async def run(iterations: int) -> None:
+    app = create_app()
+    print(f"{'path':<12}" + "".join(f"{mode:>18}" for mode in MODES))
+    for path, _, _ in ENDPOINTS:
+        timings = [
+            await time_per_request(app, f"/{mode}{path}", iterations) for mode in MODES
+        ]
+        print(f"{path:<12}" + "".join(f"{us:>16.2f}us" for us in timings))
+
+
+def main(iterations: int) -> None:
+    asyncio.get_event_loop().run_until_complete(run(iterations))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -59,6 +59,22 @@ class Settings(BaseSettings):
             path=f"/{values.get('POSTGRES_DB') or ''}",
         )
 
+    ASYNC_SQLALCHEMY_DATABASE_URI: Optional[PostgresDsn] = None
+
+    @validator("ASYNC_SQLALCHEMY_DATABASE_URI", pre=True)
+    def assemble_async_db_connection(
+        cls, v: Optional[str], values: Dict[str, Any]
+    ) -> Any:
+        if isinstance(v, str):
+            return v
+        return PostgresDsn.build(
+            scheme="postgresql+asyncpg",
+            user=values.get("POSTGRES_USER"),
+            password=values.get("POSTGRES_PASSWORD"),
+            host=values.get("POSTGRES_SERVER"),
+            path=f"/{values.get('POSTGRES_DB') or ''}",
+        )
+
     SMTP_TLS: bool = True
     SMTP_PORT: Optional[int] = None
     SMTP_HOST: Optional[str] = None
@@ -93,6 +109,15 @@ class Settings(BaseSettings):
 
     LOG_LEVEL: str = "info"
 
+    # Worker processes hashing passwords, None for one per CPU
+    PASSWORD_HASH_WORKERS: Optional[int] = None
+    # Password hashing calls waiting or running per API process beyond which
+    # requests get a 503 instead of queueing
+    PASSWORD_HASH_MAX_PENDING: int = 64
+    # Records per batch create, update or delete call. Batch creates hash all
+    # their passwords at once, so keep it within PASSWORD_HASH_MAX_PENDING
+    BATCH_MAX_RECORDS: int = 50
+
     REDIS_HOST: str
     REDIS_PORT: Optional[str] = None
     REDIS_USER: Optional[str] = None
@@ -155,8 +180,67 @@ class Settings(BaseSettings):
     def set_access_token_url(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
         return v or (values["API_V1_STR"] + "/login/access-token")
 
+    # Verified access tokens remembered per process, until they expire or for
+    # at most TOKEN_CACHE_TTL seconds. 0 disables it
+    TOKEN_CACHE_MAXSIZE: int = 10000
+    TOKEN_CACHE_TTL: float = 300.0
+
+    # Serve Prometheus metrics at /metrics. Set the prometheus_multiproc_dir
+    # environment variable to aggregate them across gunicorn workers
+    METRICS_ENABLED: bool = True
+    # Bearer token scrapers send to /metrics. Unset, it takes the access token
+    # of a superuser
+    METRICS_TOKEN: Optional[str] = None
+    # Seconds between samples of the connection and thread pool gauges
+    METRICS_SAMPLE_INTERVAL: float = 5.0
+
+    # API calls per /batch request, and seconds to answer all of them
+    BATCH_MAX_REQUESTS: int = 20
+    BATCH_TIMEOUT: float = 10.0
+
     PUSHER_USER_NAMESPACE: str = "/user"
 
+    CACHE_WARMUP_ENABLED: bool = True
+    # Warm the cache after startup instead of delaying it
+    CACHE_WARMUP_IN_BACKGROUND: bool = False
+    CACHE_WARMUP_CHUNK_SIZE: int = 1000
+    CACHE_WARMUP_CONCURRENCY: int = 4
+    # Per-process cache in front of Redis, kept coherent through pub/sub
+    CACHE_LOCAL_ENABLED: bool = False
+    CACHE_LOCAL_MAXSIZE: int = 10000
+    CACHE_LOCAL_TTL: float = 5.0
+    # Seconds a process may hold the lease for loading a missed record, or None
+    # to let every process load its own misses
+    CACHE_LOAD_LEASE_TIMEOUT: Optional[float] = 2.0
+    # "json" or "packed" (MessagePack, field-positional)
+    CACHE_CODEC: str = "json"
+    # Store cached records as Redis hashes, one entry per field
+    CACHE_HASH_STORAGE: bool = False
+    # zlib-compress cached values of at least this many bytes, 0 to disable.
+    # Values written before enabling it still read, not the other way round
+    CACHE_COMPRESS_THRESHOLD: int = 0
+    # Seconds to remember ids missing from the database, 0 to disable
+    CACHE_MISSING_EXPIRE: int = 30
+    # Approximate number of entries kept in each table change feed
+    CACHE_FEED_MAX_LEN: int = 100000
+    # Shorten each record expire by a random fraction up to this
+    CACHE_EXPIRE_JITTER: float = 0.1
+    # XFetch beta of the early background refresh, 0 to disable
+    CACHE_REFRESH_AHEAD: float = 1.0
+    # Reset the expire of cached records on every read
+    CACHE_SLIDING_EXPIRE: bool = False
+    # Seconds to cache the ids of list endpoint results, 0 to disable. Writes
+    # through the cache layer invalidate them, writes that bypass it (the sync
+    # CRUD of Celery tasks and init_db) only show once the results expire
+    CACHE_QUERY_EXPIRE: int = 30
+    # JSON list of Redis DSNs the cached records are sharded over by consistent
+    # hashing, e.g. '["redis://cache-1:6379/0", "redis://cache-2:6379/0"]'.
+    # Tables with indexes, like users, stay whole on one node. Empty keeps them
+    # on APP_REDIS_DSN
+    CACHE_REDIS_NODES: List[RedisDsn] = []
+    # Points of each node on the hash ring, more spread keys more evenly
+    CACHE_RING_REPLICAS: int = 100
+
     class Config:
         case_sensitive = True
 
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from aioredis import Redis
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.db.session import async_engine, engine
+
+# Workers write their samples to files in this directory, and the scrape
+# endpoint sums them up. Unset, metrics are those of the serving process
+MULTIPROC_DIR = os.environ.get("prometheus_multiproc_dir")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to answer HTTP requests, by route template",
+    ["method", "route"],
+)
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests answered", ["method", "route", "status"]
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests being answered",
+    multiprocess_mode="livesum",
+)
+REDIS_COMMAND_LATENCY = Histogram(
+    "redis_command_duration_seconds",
+    "Time from sending Redis commands, or queueing them in a pipeline, to their"
+    " replies",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "SQLAlchemy pool connections, by engine and state",
+    ["engine", "state"],
+    multiprocess_mode="livesum",
+)
+REDIS_POOL_CONNECTIONS = Gauge(
+    "redis_pool_connections",
+    "Connections of the application Redis pool, by state",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+THREADPOOL_QUEUE_DEPTH = Gauge(
+    "threadpool_queue_depth",
+    "Calls of sync endpoints and dependencies waiting for a thread",
+    multiprocess_mode="livesum",
+)
+THREADPOOL_THREADS = Gauge(
+    "threadpool_threads",
+    "Threads started for sync endpoints and dependencies",
+    multiprocess_mode="livesum",
+)
+
+
+class TimedRedis(Redis):
+    """
+    Redis commands interface observing the latency of each command.
+    """
+
+    def execute(self, command: Any, *args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        future = super().execute(command, *args, **kwargs)
+        name = command.decode() if isinstance(command, bytes) else str(command)
+        future.add_done_callback(
+            lambda _: REDIS_COMMAND_LATENCY.labels(name.upper()).observe(
+                time.perf_counter() - started
+            )
+        )
+        return future
+
+
+class MetricsMiddleware:
+    """
+    Count and time HTTP requests, labelled by the path template of the route
+    that answered them so ids in paths don't multiply the series.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.routes: Dict[Callable, str] = {}
+
+    def route_of(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self.routes:
+            self.routes.update(
+                (route.endpoint, route.path)
+                for route in scope["app"].routes
+                if hasattr(route, "endpoint")
+            )
+        return self.routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            method, route = scope["method"], self.route_of(scope)
+            REQUEST_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+            REQUESTS.labels(method, route, str(status)).inc()
+
+
+def sample(redis: Optional[Redis]) -> None:
+    """
+    Set the pool gauges of this process.
+    """
+    for name, pool in (("async", async_engine.pool), ("sync", engine.pool)):
+        checked_out = pool.checkedout()  # type: ignore
+        DB_POOL_CONNECTIONS.labels(name, "checked_out").set(checked_out)
+        DB_POOL_CONNECTIONS.labels(name, "idle").set(pool.checkedin())  # type: ignore
+        DB_POOL_CONNECTIONS.labels(name, "overflow").set(
+            max(0, pool.overflow())  # type: ignore
+        )
+    if redis is not None:
+        connections = redis.connection
+        REDIS_POOL_CONNECTIONS.labels("open").set(connections.size)
+        REDIS_POOL_CONNECTIONS.labels("free").set(connections.freesize)
+    # Where run_in_threadpool sends sync endpoints, created on first use
+    executor = getattr(asyncio.get_event_loop(), "_default_executor", None)
+    # Private attributes of ThreadPoolExecutor, skipped if they ever change
+    work_queue = getattr(executor, "_work_queue", None)
+    if work_queue is not None:
+        THREADPOOL_QUEUE_DEPTH.set(work_queue.qsize())
+    threads = getattr(executor, "_threads", None)
+    if threads is not None:
+        THREADPOOL_THREADS.set(len(threads))
+
+
+async def sample_forever(redis: Redis, interval: float) -> None:
+    while True:
+        sample(redis)
+        await asyncio.sleep(interval)
+
+
+def render() -> Tuple[bytes, str]:
+    """
+    Return the metrics in the Prometheus text format, with its content type.
+    """
+    registry = REGISTRY
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
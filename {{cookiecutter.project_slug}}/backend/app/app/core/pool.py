@@ -0,0 +1,96 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class PoolBusy(Exception):
+    """
+    Raised instead of queueing more work on a saturated `ProcessPool`.
+    """
+
+
+def timed_call(function: Callable, *args: Any) -> Tuple[Any, float, float]:
+    started = time.time()
+    result = function(*args)
+    return result, started, time.time() - started
+
+
+class ProcessPool:
+    """
+    Run CPU-bound functions in worker processes from coroutines, so they
+    neither block the event loop nor hold threadpool slots.
+
+    At most `max_pending` calls wait or run at once in this process; further
+    calls raise `PoolBusy` at once rather than queue behind them. The workers
+    start on first use, or on `start`.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: int = 64):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+        self.calls = 0
+        self.rejected = 0
+        # Seconds calls spent waiting for a worker, and running in one
+        self.queue_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def start(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.max_workers)
+        return self.executor
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    async def run(self, function: Callable, *args: Any) -> Any:
+        (result,) = await self.run_many(function, [args])
+        return result
+
+    async def run_many(
+        self, function: Callable, args_list: Sequence[Sequence[Any]]
+    ) -> List[Any]:
+        """
+        Call `function` with each of `args_list` across the workers, each call
+        counting against `max_pending`: the whole batch is rejected unless all
+        of it fits.
+        """
+        if self.pending + len(args_list) > self.max_pending:
+            self.rejected += 1
+            raise PoolBusy(f"{self.pending} calls pending")
+        self.pending += len(args_list)
+        loop = asyncio.get_event_loop()
+        executor = self.start()
+        submitted = time.time()
+        try:
+            results = await asyncio.gather(
+                *(
+                    loop.run_in_executor(executor, timed_call, function, *args)
+                    for args in args_list
+                )
+            )
+        except BrokenProcessPool:
+            # A worker died, the next call starts a new pool
+            self.executor = None
+            raise
+        finally:
+            self.pending -= len(args_list)
+        for _, started, elapsed in results:
+            self.calls += 1
+            self.queue_seconds += max(0.0, started - submitted)
+            self.run_seconds += elapsed
+        return [result for result, _, _ in results]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "pending": self.pending,
+            "queue_seconds": self.queue_seconds,
+            "run_seconds": self.run_seconds,
+        }
@@ -1,13 +1,20 @@
 from datetime import datetime, timedelta
-from typing import Any, Union
+from typing import Any, List, Sequence, Union
 
 from jose import jwt
 from passlib.context import CryptContext
 
 from app.core.config import settings
+from app.core.pool import ProcessPool
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Runs bcrypt for coroutines, see the a-prefixed functions below
+password_pool = ProcessPool(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+)
+
 
 ALGORITHM = "HS256"
 
@@ -32,3 +39,19 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def aget_password_hash(password: str) -> str:
+    return await password_pool.run(get_password_hash, password)
+
+
+async def aget_password_hashes(passwords: Sequence[str]) -> List[str]:
+    if not passwords:
+        return []
+    return await password_pool.run_many(
+        get_password_hash, [(password,) for password in passwords]
+    )
@@ -1,4 +1,4 @@
-from .crud_item import item
+from .crud_item import item, item_cache, item_cachedb
 from .crud_user import user, user_cache, user_cachedb
 
 # For a new basic set of CRUD operations you could just do
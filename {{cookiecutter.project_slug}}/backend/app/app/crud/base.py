@@ -1,19 +1,91 @@
 import asyncio
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+import base64
+import hashlib
+import json
+import math
+import random
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
-from aioredis import Redis
-from aioredlock import Aioredlock, Lock
-from fastapi.encoders import jsonable_encoder
+from aioredis import ReplyError
+from aioredlock import Aioredlock, Lock, LockError
 from pydantic import BaseModel
+from sqlalchemy import (
+    Column,
+    cast,
+    column,
+    delete,
+    insert,
+    inspect,
+    select,
+    tuple_,
+    update,
+    values,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.sql import Select
 
+from app.core.log import logger
+from app.crud.codecs import VERSION_FIELD, Codec, JSONCodec
+from app.crud.local_cache import LocalCache
 from app.db.base_class import Base
+from app.db.cache import Cache, Commands, node_of
 
 ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
 
+def chunked(records: Sequence[Any], size: int) -> Iterator[Sequence[Any]]:
+    for start in range(0, len(records), size):
+        end = start + size
+        yield records[start:end]
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Pack the sort key of the last row of a page into an opaque cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> List[Any]:
+    """
+    Unpack a cursor made by `encode_cursor` for values of `types`, raising
+    `ValueError` if it is invalid.
+    """
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if (
+        not isinstance(values, list)
+        or len(values) != len(types)
+        or not all(
+            # bool is an int for isinstance, not for the database
+            isinstance(value, type_) and not isinstance(value, bool)
+            for value, type_ in zip(values, types)
+        )
+    ):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def __init__(self, model: Type[ModelType]):
         """
@@ -25,6 +97,9 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         * `schema`: A Pydantic model (schema) class
         """
         self.model = model
+        self.table = model.__table__
+        self.fields = [attr.key for attr in inspect(model).column_attrs]
+        self.versioned = "version" in self.table.c
 
     def get(self, db: Session, id: Any) -> Optional[ModelType]:
         return db.query(self.model).filter(self.model.id == id).first()
@@ -62,8 +137,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def update_dict(
         self, db: Session, *, db_obj: ModelType, update_data: Dict[str, Any],
     ) -> ModelType:
-        obj_data = jsonable_encoder(db_obj)
-        for field in obj_data:
+        for field in self.fields:
             if field in update_data:
                 setattr(db_obj, field, update_data[field])
         db.add(db_obj)
@@ -77,6 +151,297 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         db.commit()
         return obj
 
+    async def aget(self, db: AsyncSession, id: Any) -> Optional[ModelType]:
+        result = await db.execute(select(self.model).where(self.model.id == id))
+        return result.scalars().first()
+
+    async def aget_many(self, db: AsyncSession, *, ids: List[Any]) -> List[ModelType]:
+        result = await db.execute(select(self.model).where(self.model.id.in_(ids)))
+        return result.scalars().all()
+
+    async def aget_multi(
+        self, db: AsyncSession, *, skip: int = 0, limit: int = 100
+    ) -> List[ModelType]:
+        result = await db.execute(select(self.model).offset(skip).limit(limit))
+        return result.scalars().all()
+
+    async def aget_multi_keyset(
+        self, db: AsyncSession, *, cursor: Optional[str] = None, limit: int = 100
+    ) -> Tuple[List[ModelType], Optional[str]]:
+        return await self.aget_keyset_page(
+            db, select(self.model), columns=[self.model.id], cursor=cursor, limit=limit
+        )
+
+    async def aget_keyset_page(
+        self,
+        db: AsyncSession,
+        query: Select,
+        *,
+        columns: Sequence[Column],
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[ModelType], Optional[str]]:
+        """
+        Return one page of `query` ordered by `columns` and the cursor of the next.
+
+        Rows are sought with `(columns) > (cursor)` so deep pages cost the same
+        as the first one, provided an index exists on `columns`.
+        """
+        if cursor is not None:
+            after = decode_cursor(
+                cursor, [column.type.python_type for column in columns]
+            )
+            query = query.where(tuple_(*columns) > tuple_(*after))
+        result = await db.execute(query.order_by(*columns).limit(limit))
+        records = result.scalars().all()
+        next_cursor = None
+        if records and len(records) == limit:
+            next_cursor = encode_cursor(
+                [getattr(records[-1], column.key) for column in columns]
+            )
+        return records, next_cursor
+
+    async def acreate(self, db: AsyncSession, *, obj_in: CreateSchemaType) -> ModelType:
+        return await self.acreate_dict(db, create_data=obj_in.dict())
+
+    async def acreate_dict(
+        self, db: AsyncSession, *, create_data: Dict[str, Any]
+    ) -> ModelType:
+        statement = (
+            insert(self.table).values(create_data).returning(*self.table.columns)
+        )
+        result = await db.execute(select(self.model).from_statement(statement))
+        db_obj = result.scalars().one()
+        await db.commit()
+        return db_obj
+
+    async def aupdate(
+        self,
+        db: AsyncSession,
+        *,
+        db_obj: ModelType,
+        obj_in: Union[UpdateSchemaType, Dict[str, Any]],
+        version: Optional[int] = None,
+    ) -> ModelType:
+        if isinstance(obj_in, dict):
+            update_data = obj_in
+        else:
+            update_data = obj_in.dict(exclude_unset=True)
+        return await self.aupdate_dict(
+            db, db_obj=db_obj, update_data=update_data, version=version
+        )
+
+    async def aupdate_dict(
+        self,
+        db: AsyncSession,
+        *,
+        db_obj: ModelType,
+        update_data: Dict[str, Any],
+        version: Optional[int] = None,
+    ) -> ModelType:
+        """
+        Update the record with UPDATE ... RETURNING.
+
+        On versioned models the version is incremented and, given `version`,
+        the update only applies if the record is still at that version: a
+        `StaleDataError` reports that it changed since it was read.
+        """
+        data = {
+            field: update_data[field]
+            for field in self.fields
+            if field in update_data and field != "version"
+        }
+        id = db_obj.id
+        if not data:
+            if self.versioned and version is not None:
+                # Nothing to write, but a stale version must still be reported
+                result = await db.execute(
+                    select(self.table.c.id).where(
+                        self.table.c.id == id, self.table.c.version == version
+                    )
+                )
+                if result.first() is None:
+                    raise StaleDataError(
+                        f"{self.model.__name__} {id} changed since version {version}"
+                    )
+            return db_obj
+        statement = update(self.table).where(self.table.c.id == id)
+        if self.versioned:
+            data["version"] = self.table.c.version + 1
+            if version is not None:
+                statement = statement.where(self.table.c.version == version)
+        result = await db.execute(
+            select(self.model)
+            .from_statement(statement.values(data).returning(*self.table.columns))
+            .execution_options(populate_existing=True)
+        )
+        updated_obj = result.scalars().first()
+        if updated_obj is None:
+            await db.rollback()
+            raise StaleDataError(
+                f"{self.model.__name__} {id} changed since version {version}"
+            )
+        await db.commit()
+        return updated_obj
+
+    async def aremove(self, db: AsyncSession, *, id: int) -> Optional[ModelType]:
+        statement = (
+            delete(self.table)
+            .where(self.table.c.id == id)
+            .returning(*self.table.columns)
+        )
+        result = await db.execute(select(self.model).from_statement(statement))
+        obj = result.scalars().first()
+        if obj is not None:
+            db.expunge(obj)
+        await db.commit()
+        return obj
+
+    def create_many_statements(
+        self, create_data: List[Dict[str, Any]], *, batch_size: int
+    ) -> Iterator[Select]:
+        for batch in chunked(create_data, batch_size):
+            statement = (
+                insert(self.table).values(list(batch)).returning(*self.table.columns)
+            )
+            yield select(self.model).from_statement(statement)
+
+    def update_many_statements(
+        self, update_data: Dict[Any, Dict[str, Any]], *, batch_size: int
+    ) -> Iterator[Select]:
+        # Records updating the same set of fields share one UPDATE ... FROM VALUES
+        groups: Dict[Tuple[str, ...], List[Tuple[Any, ...]]] = {}
+        for id, data in update_data.items():
+            fields = tuple(
+                sorted(
+                    field for field in data if field in self.fields and field != "id"
+                )
+            )
+            fields = tuple(field for field in fields if field != "version")
+            groups.setdefault(fields, []).append(
+                (id, *(data[field] for field in fields))
+            )
+        for fields, rows in groups.items():
+            if not fields:
+                continue
+            for batch in chunked(rows, batch_size):
+                data_values = values(
+                    *(
+                        column(name, self.table.c[name].type)
+                        for name in ("id", *fields)
+                    ),
+                    name="data",
+                ).data(list(batch))
+                data: Dict[str, Any] = {
+                    field: cast(data_values.c[field], self.table.c[field].type)
+                    for field in fields
+                }
+                if self.versioned:
+                    data["version"] = self.table.c.version + 1
+                statement = (
+                    update(self.table)
+                    .where(self.table.c.id == data_values.c.id)
+                    .values(data)
+                    .returning(*self.table.columns)
+                )
+                yield select(self.model).from_statement(statement).execution_options(
+                    populate_existing=True
+                )
+
+    def remove_many_statements(
+        self, ids: List[Any], *, batch_size: int
+    ) -> Iterator[Select]:
+        for batch in chunked(ids, batch_size):
+            statement = (
+                delete(self.table)
+                .where(self.table.c.id.in_(batch))
+                .returning(*self.table.columns)
+            )
+            yield select(self.model).from_statement(statement)
+
+    async def aexecute_many(
+        self, db: AsyncSession, statements: Iterator[Select]
+    ) -> List[ModelType]:
+        db_objs: List[ModelType] = []
+        try:
+            for statement in statements:
+                result = await db.execute(statement)
+                db_objs.extend(result.scalars().all())
+        except Exception:
+            # e.g. an IntegrityError: none of the batch applies
+            await db.rollback()
+            raise
+        await db.commit()
+        return db_objs
+
+    async def acreate_many(
+        self,
+        db: AsyncSession,
+        *,
+        objs_in: List[CreateSchemaType],
+        batch_size: int = 1000,
+    ) -> List[ModelType]:
+        return await self.acreate_many_dict(
+            db, create_data=[obj_in.dict() for obj_in in objs_in], batch_size=batch_size
+        )
+
+    async def acreate_many_dict(
+        self,
+        db: AsyncSession,
+        *,
+        create_data: List[Dict[str, Any]],
+        batch_size: int = 1000,
+    ) -> List[ModelType]:
+        """
+        Insert all records in one transaction with multi-row INSERT ... RETURNING.
+        """
+        return await self.aexecute_many(
+            db, self.create_many_statements(create_data, batch_size=batch_size)
+        )
+
+    async def aupdate_many(
+        self,
+        db: AsyncSession,
+        *,
+        objs_in: Dict[Any, Union[UpdateSchemaType, Dict[str, Any]]],
+        batch_size: int = 1000,
+    ) -> List[ModelType]:
+        update_data = {
+            id: obj_in if isinstance(obj_in, dict) else obj_in.dict(exclude_unset=True)
+            for id, obj_in in objs_in.items()
+        }
+        return await self.aupdate_many_dict(
+            db, update_data=update_data, batch_size=batch_size
+        )
+
+    async def aupdate_many_dict(
+        self,
+        db: AsyncSession,
+        *,
+        update_data: Dict[Any, Dict[str, Any]],
+        batch_size: int = 1000,
+    ) -> List[ModelType]:
+        """
+        Update the records keyed by id in one transaction with
+        UPDATE ... FROM (VALUES ...) RETURNING, returning the updated records.
+
+        Ids without a record are skipped, so they are missing from the result,
+        and versions are not checked: the last batch to write wins.
+        """
+        return await self.aexecute_many(
+            db, self.update_many_statements(update_data, batch_size=batch_size)
+        )
+
+    async def aremove_many(
+        self, db: AsyncSession, *, ids: List[Any], batch_size: int = 1000
+    ) -> List[ModelType]:
+        """
+        Delete the records in one transaction with DELETE ... RETURNING.
+        """
+        return await self.aexecute_many(
+            db, self.remove_many_statements(ids, batch_size=batch_size)
+        )
+
 
 class OrmMode(BaseModel):
     id: Any
@@ -88,74 +453,632 @@ class OrmMode(BaseModel):
 CacheSchemaType = TypeVar("CacheSchemaType", bound=OrmMode)
 
 
+# HSET only if the hash exists, so an expired record is not recreated partially
+UPDATE_FIELDS_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+redis.call("HSET", KEYS[1], unpack(ARGV))
+return 1
+"""
+
+# Write a record (KEYS[1]) unless its cached version (KEYS[2]) is newer, and
+# then drop its missing marker (KEYS[3], if given). Returns whether it wrote.
+# ARGV: version, expire in seconds (0 for none), "hash" or "string", then the
+# encoded record, or its field/value pairs for a hash
+VERSIONED_WRITE_SCRIPT = """
+local cached = tonumber(redis.call("GET", KEYS[2]))
+if cached and cached > tonumber(ARGV[1]) then
+    return 0
+end
+if KEYS[3] then
+    redis.call("DEL", KEYS[3])
+end
+redis.call("DEL", KEYS[1])
+if ARGV[3] == "hash" then
+    redis.call("HSET", KEYS[1], unpack(ARGV, 4))
+else
+    redis.call("SET", KEYS[1], ARGV[4])
+end
+redis.call("SET", KEYS[2], ARGV[1])
+local expire = tonumber(ARGV[2])
+if expire > 0 then
+    redis.call("EXPIRE", KEYS[1], expire)
+    redis.call("EXPIRE", KEYS[2], expire)
+end
+return 1
+"""
+
+# The index scripts also GET and DEL the keys remembered in the index hash,
+# which they cannot declare in KEYS without reading the hash first. That is only
+# sound because every key of an indexed table shares the hash tag of
+# `index_shard_key`, so lives on its node (a standalone Redis or one node of a
+# `RedisRing`), and the scripts refuse any remembered key of a field outside
+# "{<tablename>}:<field>:", ARGV[2] being "{<tablename>}:", before changing
+# anything.
+INDEX_KEY_CHECK = """
+local function check_index_key(field, key)
+    local prefix = ARGV[2] .. field .. ":"
+    if string.sub(key, 1, #prefix) ~= prefix then
+        return redis.error_reply("not an index key of " .. prefix .. ": " .. key)
+    end
+end
+"""
+
+# Point the index keys of a record (KEYS[3..]) at its id (ARGV[1]) and drop the
+# keys it was indexed under before, remembered in its index hash (KEYS[1]).
+# ARGV[3] is the expire in seconds (0 for none), ARGV[5..] the indexed fields.
+# Given a version (ARGV[4], else ""), only if the record's version key (KEYS[2])
+# holds it, i.e. the versioned write just before was not refused.
+INDEX_SCRIPT = (
+    INDEX_KEY_CHECK
+    + """
+local id = ARGV[1]
+local expire = tonumber(ARGV[3])
+if ARGV[4] ~= "" and redis.call("GET", KEYS[2]) ~= ARGV[4] then
+    return 0
+end
+local previous = {}
+for i = 5, #ARGV do
+    previous[i] = redis.call("HGET", KEYS[1], ARGV[i])
+    if previous[i] then
+        local refused = check_index_key(ARGV[i], previous[i])
+        if refused then
+            return refused
+        end
+    end
+end
+for i = 5, #ARGV do
+    local key = KEYS[i - 2]
+    if previous[i] and previous[i] ~= key and redis.call("GET", previous[i]) == id then
+        redis.call("DEL", previous[i])
+    end
+    if expire > 0 then
+        redis.call("SET", key, id, "EX", expire)
+    else
+        redis.call("SET", key, id)
+    end
+    redis.call("HSET", KEYS[1], ARGV[i], key)
+end
+if expire > 0 then
+    redis.call("EXPIRE", KEYS[1], expire)
+else
+    redis.call("PERSIST", KEYS[1])
+end
+return 1
+"""
+)
+
+# Drop the index keys of a record that still point at its id (ARGV[1])
+UNINDEX_SCRIPT = (
+    INDEX_KEY_CHECK
+    + """
+local entries = redis.call("HGETALL", KEYS[1])
+for i = 1, #entries, 2 do
+    local refused = check_index_key(entries[i], entries[i + 1])
+    if refused then
+        return refused
+    end
+end
+for i = 2, #entries, 2 do
+    if redis.call("GET", entries[i]) == ARGV[1] then
+        redis.call("DEL", entries[i])
+    end
+end
+redis.call("DEL", KEYS[1])
+"""
+)
+
+
+# Operations recorded in the change feed
+CHANGE_CREATE = "create"
+CHANGE_UPDATE = "update"
+CHANGE_REMOVE = "remove"
+
+# Tag of the cached query results over a whole table
+TAG_ALL = "all"
+
+
+class Change(NamedTuple):
+    entry_id: str
+    op: str
+    id: Any
+    record: Optional[BaseModel]
+
+
 class CRUDCacheBase(Generic[CacheSchemaType, CreateSchemaType, UpdateSchemaType]):
     def __init__(
         self,
         schema: Type[CacheSchemaType],
         tablename: Optional[str] = None,
-        change_limit: int = 1,
+        feed_max_len: int = 100000,
+        local_cache: Optional[LocalCache] = None,
+        codec: Optional[Codec] = None,
+        hash_storage: bool = False,
+        indexes: Sequence[str] = (),
+        missing_expire: Optional[int] = None,
+        tag_fields: Sequence[str] = (),
     ):
+        """
+        Redis-backed CRUD for cached records.
+
+        **Parameters**
+
+        * `local_cache`: optional in-process cache served before Redis; writes
+          publish invalidations that `listen` applies in every other process
+        * `codec`: how records are serialized, `JSONCodec` by default
+        * `hash_storage`: store each record as a Redis hash with one entry per
+          field, so `get_field` and `update_fields` touch single fields
+        * `indexes`: unique fields kept as `{<tablename>}:<field>:<value>` keys
+          holding the record id, updated in the same transaction as the record
+        * `feed_max_len`: approximate number of entries kept in the change feed
+        * `missing_expire`: remember ids found missing in the database for this
+          many seconds, so repeated lookups of them skip the database
+        * `tag_fields`: fields whose values tag cached query results besides
+          `TAG_ALL`, e.g. `owner_id` for the queries over one owner
+
+        The `cache` passed to the methods may be a `RedisRing`. The keys of a
+        record live on the node of its `to_key`, and the change feed and
+        invalidation channel on their own nodes. The record keys of a table
+        with indexes share the hash tag of its index keys, `{<tablename>}`, so
+        the whole table lives on one node where records and indexes are written
+        atomically; records of other tables spread over the nodes.
+        """
         self.schema = schema
         self.tablename = tablename if tablename is not None else schema.__name__.lower()
-        self.change_limit = change_limit
+        self.feed_max_len = feed_max_len
+        self.local_cache = local_cache
+        self.codec = codec if codec is not None else JSONCodec(schema)
+        self.hash_storage = hash_storage
+        self.indexes = list(indexes)
+        self.key_prefix = f"{{{self.tablename}}}" if self.indexes else self.tablename
+        self.missing_expire = missing_expire
+        self.tag_fields = list(tag_fields)
+        self.id_type = schema.__fields__["id"].type_
+        self.versioned = "version" in schema.__fields__
 
     def build(self, data: Any) -> CacheSchemaType:
         return self.schema.from_orm(data)
 
     def to_key(self, id: Union[int, str]) -> str:
-        return f"{self.tablename}:{id}"
+        return f"{self.key_prefix}:{id}"
 
-    def to_change_list_key(self, id: Union[int, str]) -> str:
-        return f"{self.to_key(id)}:changes"
+    def to_version_key(self, id: Union[int, str]) -> str:
+        return f"{self.to_key(id)}:version"
+
+    def to_missing_key(self, id: Union[int, str]) -> str:
+        return f"{self.to_key(id)}:missing"
+
+    @property
+    def index_key_prefix(self) -> str:
+        return f"{self.key_prefix}:"
+
+    def to_index_key(self, field: str, value: Any) -> str:
+        return f"{self.index_key_prefix}{field}:{value}"
+
+    def to_index_hash_key(self, id: Union[int, str]) -> str:
+        return f"{self.to_key(id)}:indexes"
+
+    @property
+    def index_shard_key(self) -> str:
+        # The index scripts update the keys of several records at once
+        return f"{self.key_prefix}:indexes"
+
+    @property
+    def invalidation_channel(self) -> str:
+        return f"{self.tablename}:invalidations"
+
+    def get_local(self, key: str) -> Optional[CacheSchemaType]:
+        if self.local_cache is None:
+            return None
+        return self.local_cache.get(key)
+
+    def set_local(self, key: str, record: CacheSchemaType) -> CacheSchemaType:
+        if self.local_cache is not None:
+            self.local_cache.set(key, record)
+        return record
+
+    def invalidate(self, commands: Commands, *, ids: List[Any]) -> None:
+        """
+        Drop `ids` from the local cache and queue the invalidation message on
+        `commands`, which also carry the write.
+        """
+        if self.local_cache is None or not ids:
+            return
+        self.local_cache.delete(self.to_key(id) for id in ids)
+        commands.on(self.invalidation_channel).publish_json(
+            self.invalidation_channel,
+            {"origin": self.local_cache.origin, "ids": [str(id) for id in ids]},
+        )
+
+    async def listen(self, cache: Cache) -> None:
+        """
+        Apply invalidations published by other processes until cancelled.
+        """
+        if self.local_cache is None:
+            return
+        cache = node_of(cache, self.invalidation_channel)
+        (channel,) = await cache.subscribe(self.invalidation_channel)
+        # Writes made before the subscription could not be seen here
+        self.local_cache.clear()
+        try:
+            while await channel.wait_message():
+                message = await channel.get_json()
+                if message["origin"] != self.local_cache.origin:
+                    self.local_cache.delete(self.to_key(id) for id in message["ids"])
+            logger.warning(f"Lost the {self.invalidation_channel} subscription")
+        finally:
+            self.local_cache.clear()
+            if not cache.closed:
+                await cache.unsubscribe(self.invalidation_channel)
+
+    def transaction(self, cache: Cache) -> Commands:
+        # Rewriting a hash or a record with its indexes takes several commands
+        # that readers must not split
+        return Commands(cache, transaction=bool(self.hash_storage or self.indexes))
+
+    def write(
+        self, commands: Commands, *, obj_in: CacheSchemaType, expire: Optional[int]
+    ) -> Optional[asyncio.Future]:
+        """
+        Queue the write of `obj_in` with its indexes on `commands`. For
+        versioned records, return the future of whether it was written, as it
+        is refused if a newer version is cached.
+        """
+        record_key = self.to_key(obj_in.id)
+        pipeline = commands.on(record_key)
+        written = None
+        if self.versioned:
+            # Compare-and-set, so a slow writer never replaces a newer version
+            if self.hash_storage:
+                payload = [
+                    item
+                    for field in self.codec.encode_fields(obj_in).items()
+                    for item in field
+                ]
+            else:
+                payload = [self.codec.encode(obj_in)]
+            keys = [record_key, self.to_version_key(obj_in.id)]
+            if self.missing_expire:
+                keys.append(self.to_missing_key(obj_in.id))
+            written = pipeline.eval(
+                VERSIONED_WRITE_SCRIPT,
+                keys=keys,
+                args=[
+                    obj_in.version,
+                    expire or 0,
+                    "hash" if self.hash_storage else "string",
+                    *payload,
+                ],
+            )
+        elif self.hash_storage:
+            pipeline.delete(record_key)
+            pipeline.hmset_dict(record_key, self.codec.encode_fields(obj_in))
+            if expire:
+                pipeline.expire(record_key, expire)
+        else:
+            pipeline.set(record_key, self.codec.encode(obj_in), expire=expire)
+        if self.missing_expire and not self.versioned:
+            pipeline.delete(self.to_missing_key(obj_in.id))
+        self.index(commands, obj_in=obj_in, expire=expire)
+        return written
+
+    def index(
+        self, commands: Commands, *, obj_in: CacheSchemaType, expire: Optional[int]
+    ) -> None:
+        fields = [field for field in self.indexes if getattr(obj_in, field) is not None]
+        if not fields:
+            return
+        # Shares the node of the record, see `key_prefix`
+        commands.on(self.index_shard_key).eval(
+            INDEX_SCRIPT,
+            keys=[
+                self.to_index_hash_key(obj_in.id),
+                self.to_version_key(obj_in.id),
+                *(self.to_index_key(field, getattr(obj_in, field)) for field in fields),
+            ],
+            args=[
+                str(obj_in.id),
+                self.index_key_prefix,
+                expire or 0,
+                obj_in.version if self.versioned else "",
+                *fields,
+            ],
+        )
+
+    def unindex(self, commands: Commands, *, ids: List[Any]) -> None:
+        if not self.indexes:
+            return
+        pipeline = commands.on(self.index_shard_key)
+        for id in ids:
+            pipeline.eval(
+                UNINDEX_SCRIPT,
+                keys=[self.to_index_hash_key(id)],
+                args=[str(id), self.index_key_prefix],
+            )
+
+    def decode(self, result: Any) -> Optional[CacheSchemaType]:
+        if not result:
+            return None
+        if self.hash_storage:
+            return self.codec.decode_fields(result)
+        return self.codec.decode(result)
+
+    async def add_missing(self, cache: Cache, *, id: Any) -> None:
+        """
+        Remember that `id` does not exist, until `missing_expire` or a write.
+        """
+        if self.missing_expire:
+            await node_of(cache, self.to_key(id)).set(
+                self.to_missing_key(id), 1, expire=self.missing_expire
+            )
 
-    async def exists(self, cache: Redis, *, id: Any) -> bool:
-        return await cache.exists(self.to_key(id))
+    async def is_missing(self, cache: Cache, *, id: Any) -> bool:
+        if not self.missing_expire:
+            return False
+        node = node_of(cache, self.to_key(id))
+        return bool(await node.exists(self.to_missing_key(id)))
+
+    async def get_version(self, cache: Cache, *, id: Any) -> Optional[int]:
+        """
+        Return the version of the cached record, without reading nor decoding
+        the record itself.
+        """
+        if not self.versioned:
+            raise ValueError(f"{self.tablename} records are not versioned")
+        key = self.to_key(id)
+        record = self.get_local(key)
+        if record is not None:
+            return record.version  # type: ignore
+        version = await node_of(cache, key).get(self.to_version_key(id))
+        return int(version) if version is not None else None
+
+    async def exists(self, cache: Cache, *, id: Any) -> bool:
+        key = self.to_key(id)
+        return await node_of(cache, key).exists(key)
+
+    async def exists_many(self, cache: Cache, *, ids: List[Any]) -> List[bool]:
+        commands = Commands(cache)
+        found = [commands.on(key).exists(key) for key in map(self.to_key, ids)]
+        await commands.execute()
+        return [bool(future.result()) for future in found]
 
     async def add(
-        self, cache: Redis, *, obj_in: CacheSchemaType, expire: Optional[int] = None,
+        self,
+        cache: Cache,
+        *,
+        obj_in: CacheSchemaType,
+        expire: Optional[int] = None,
+        change: Optional[str] = None,
     ) -> CacheSchemaType:
-        record_key = self.to_key(obj_in.id)
-        await cache.set(record_key, obj_in.json(), expire=expire)
-        return obj_in
+        (record,) = await self.add_many(
+            cache, objs_in=[obj_in], expire=expire, change=change
+        )
+        return record
 
     async def add_dict(
-        self, cache: Redis, *, obj_in: Dict[str, Any], expire: Optional[int] = None,
+        self, cache: Cache, *, obj_in: Dict[str, Any], expire: Optional[int] = None,
     ) -> CacheSchemaType:
         record = self.schema(**obj_in)
         return await self.add(cache, obj_in=record, expire=expire)
 
-    async def add_changes(
-        self, cache: Redis, *, obj: CacheSchemaType
-    ) -> CacheSchemaType:
-        change_list_key = self.to_change_list_key(obj.id)
-        await cache.lpush(change_list_key, obj.json())
-        await cache.ltrim(change_list_key, 0, self.change_limit - 1)
-        return obj
+    async def add_many(
+        self,
+        cache: Cache,
+        *,
+        objs_in: List[CacheSchemaType],
+        expire: Union[None, int, Sequence[Optional[int]]] = None,
+        change: Optional[str] = None,
+    ) -> List[CacheSchemaType]:
+        """
+        Cache `objs_in` in one pipeline, all with `expire` or each with its own
+        when `expire` is a sequence.
 
-    async def get(self, cache: Redis, *, id: Any) -> Optional[CacheSchemaType]:
-        result = await cache.get(self.to_key(id), encoding="utf-8")
-        return self.schema.parse_raw(result) if result is not None else None
+        Versioned records older than the cached ones are neither written, nor
+        kept locally, nor published as `change`, which takes a second round
+        trip once the writes are known.
+        """
+        if expire is None or isinstance(expire, int):
+            expire = [expire] * len(objs_in)
+        commands = self.transaction(cache)
+        writes = [
+            self.write(commands, obj_in=obj_in, expire=object_expire)
+            for obj_in, object_expire in zip(objs_in, expire)
+        ]
+        self.invalidate(commands, ids=[obj_in.id for obj_in in objs_in])
+        if change is not None and not self.versioned:
+            for obj_in in objs_in:
+                self.publish_change(commands, op=change, id=obj_in.id, obj=obj_in)
+        await commands.execute()
+        written = [
+            obj_in
+            for obj_in, write in zip(objs_in, writes)
+            if write is None or write.result()
+        ]
+        if change is not None and self.versioned and written:
+            commands = Commands(cache)
+            for obj_in in written:
+                self.publish_change(commands, op=change, id=obj_in.id, obj=obj_in)
+            await commands.execute()
+        for obj_in in written:
+            self.set_local(self.to_key(obj_in.id), obj_in)
+        return objs_in
 
-    async def get_changes(
-        self, cache: Redis, *, id: Any, limit: int = 1000
-    ) -> List[CacheSchemaType]:
-        change_list_key = self.to_change_list_key(id)
-        json_list = await cache.lrange(change_list_key, 0, limit - 1, encoding="utf-8")
-        return [self.schema.parse_raw(record) for record in json_list]
+    async def get(self, cache: Cache, *, id: Any) -> Optional[CacheSchemaType]:
+        key = self.to_key(id)
+        record = self.get_local(key)
+        if record is not None:
+            return record
+        node = node_of(cache, key)
+        if self.hash_storage:
+            record = self.decode(await node.hgetall(key))
+        else:
+            record = self.decode(await node.get(key))
+        if record is None:
+            return None
+        return self.set_local(key, record)
+
+    async def get_with_ttl(
+        self, cache: Cache, *, id: Any, renew: Optional[int] = None
+    ) -> Tuple[Optional[CacheSchemaType], int]:
+        """
+        Return the record and its remaining time to live in milliseconds (-1 if
+        it does not expire), in one round trip. With `renew`, first reset the
+        time to live to that many seconds.
+
+        Records served by the local cache come back with a time to live of -1.
+        """
+        key = self.to_key(id)
+        record = self.get_local(key)
+        if record is not None:
+            return record, -1
+        pipeline = node_of(cache, key).pipeline()
+        if self.hash_storage:
+            pipeline.hgetall(key)
+        else:
+            pipeline.get(key)
+        if renew:
+            pipeline.expire(key, renew)
+            if self.versioned:
+                pipeline.expire(self.to_version_key(id), renew)
+        pipeline.pttl(key)
+        result, *_, ttl = await pipeline.execute()
+        record = self.decode(result)
+        if record is None:
+            return None, ttl
+        return self.set_local(key, record), ttl
+
+    async def get_id_by_index(
+        self, cache: Cache, *, field: str, value: Any
+    ) -> Optional[Any]:
+        """
+        Return the id the `field` index maps `value` to, if any.
+
+        The record may have changed since, callers check the field on it.
+        """
+        id = await node_of(cache, self.index_shard_key).get(
+            self.to_index_key(field, value), encoding="utf-8"
+        )
+        return self.id_type(id) if id is not None else None
+
+    async def get_field(self, cache: Cache, *, id: Any, field: str) -> Any:
+        """
+        Read one field, without fetching the whole record when stored as a hash.
+        """
+        if not self.hash_storage:
+            record = await self.get(cache, id=id)
+            return getattr(record, field) if record is not None else None
+        key = self.to_key(id)
+        record = self.get_local(key)
+        if record is not None:
+            return getattr(record, field)
+        data = await node_of(cache, key).hmget(key, field, VERSION_FIELD)
+        if data[1] != str(self.codec.version).encode() or data[0] is None:
+            return None
+        return self.codec.decode_value(data[0])
+
+    async def update_fields(
+        self, cache: Cache, *, id: Any, obj_in: Dict[str, Any]
+    ) -> bool:
+        """
+        Overwrite some fields of a record stored as a hash, in place.
+
+        Returns `False`, changing nothing, when the record is not cached: the
+        hash must not be recreated with only these fields. Versioned records
+        and indexed fields change through `update` instead, which keeps their
+        version, indexes and change feed; neither are query tags bumped here.
+        """
+        if not self.hash_storage:
+            raise ValueError(f"{self.tablename} records are not stored as hashes")
+        if self.versioned:
+            raise ValueError(f"{self.tablename} records are versioned")
+        indexed = set(obj_in) & set(self.indexes)
+        if indexed:
+            raise ValueError(f"Indexed fields: {', '.join(sorted(indexed))}")
+        if not obj_in:
+            return await self.exists(cache, id=id)
+        fields = self.codec.encode_fields(obj_in)
+        fields.pop(VERSION_FIELD)
+        commands = Commands(cache)
+        updated = commands.on(self.to_key(id)).eval(
+            UPDATE_FIELDS_SCRIPT,
+            keys=[self.to_key(id)],
+            args=[item for field in fields.items() for item in field],
+        )
+        self.invalidate(commands, ids=[id])
+        await commands.execute()
+        return bool(updated.result())
+
+    async def get_many(
+        self, cache: Cache, *, ids: List[Any]
+    ) -> List[Optional[CacheSchemaType]]:
+        """
+        Fetch records with one MGET per node (pipelined HGETALLs for hashes),
+        returning `None` in place of each miss.
+        """
+        if not ids:
+            return []
+        keys = [self.to_key(id) for id in ids]
+        records = [self.get_local(key) for key in keys]
+        missing = [index for index, record in enumerate(records) if record is None]
+        if missing:
+            missing_keys = [keys[index] for index in missing]
+            commands = Commands(cache)
+            if self.hash_storage:
+                found = [commands.on(key).hgetall(key) for key in missing_keys]
+                await commands.execute()
+                results = [future.result() for future in found]
+            else:
+                batches = [
+                    (pipeline.mget(*(missing_keys[i] for i in positions)), positions)
+                    for pipeline, positions in commands.split(missing_keys)
+                ]
+                await commands.execute()
+                results = [None] * len(missing_keys)
+                for batch, positions in batches:
+                    for position, result in zip(positions, batch.result()):
+                        results[position] = result
+            for index, result in zip(missing, results):
+                record = self.decode(result)
+                if record is not None:
+                    records[index] = self.set_local(keys[index], record)
+        return records
 
     async def add_model(
-        self, cache: Redis, *, obj_in: Any, expire: Optional[int] = None,
+        self,
+        cache: Cache,
+        *,
+        obj_in: Any,
+        expire: Optional[int] = None,
+        change: Optional[str] = None,
     ) -> CacheSchemaType:
-        return await self.add(cache, obj_in=self.build(obj_in), expire=expire)
+        return await self.add(
+            cache, obj_in=self.build(obj_in), expire=expire, change=change
+        )
+
+    async def add_many_models(
+        self,
+        cache: Cache,
+        *,
+        objs_in: List[Any],
+        expire: Union[None, int, Sequence[Optional[int]]] = None,
+        change: Optional[str] = None,
+    ) -> List[CacheSchemaType]:
+        return await self.add_many(
+            cache,
+            objs_in=[self.build(obj_in) for obj_in in objs_in],
+            expire=expire,
+            change=change,
+        )
 
     async def create(
-        self, cache: Redis, *, obj_in: CreateSchemaType, expire: Optional[int] = None,
+        self, cache: Cache, *, obj_in: CreateSchemaType, expire: Optional[int] = None,
     ) -> CacheSchemaType:
         return await self.add_dict(cache, obj_in=obj_in.dict(), expire=expire)
 
     async def update(
         self,
-        cache: Redis,
+        cache: Cache,
         *,
         cache_obj: CacheSchemaType,
         obj_in: Union[UpdateSchemaType, Dict[str, Any]],
@@ -168,22 +1091,226 @@ class CRUDCacheBase(Generic[CacheSchemaType, CreateSchemaType, UpdateSchemaType]
             data.update(obj_in.dict(exclude_unset=True))
         return await self.add_dict(cache, obj_in=data, expire=expire)
 
-    async def remove(self, cache: Redis, *, id: Any) -> Optional[CacheSchemaType]:
+    async def remove(
+        self, cache: Cache, *, id: Any, change: Optional[str] = None
+    ) -> Optional[CacheSchemaType]:
         record = await self.get(cache=cache, id=id)
-        if record is not None:
-            await cache.delete(self.to_key(id))
-            return record
-        else:
+        if record is None and not self.indexes and change is None:
             return None
+        commands = self.transaction(cache)
+        commands.on(self.to_key(id)).delete(self.to_key(id), self.to_version_key(id))
+        # Indexes may outlive an expired record
+        self.unindex(commands, ids=[id])
+        self.invalidate(commands, ids=[id])
+        if change is not None:
+            self.publish_change(commands, op=change, id=id)
+        await commands.execute()
+        return record
+
+    async def remove_many(
+        self, cache: Cache, *, ids: List[Any], change: Optional[str] = None
+    ) -> None:
+        if ids:
+            commands = self.transaction(cache)
+            keys = [self.to_key(id) for id in ids]
+            for pipeline, positions in commands.split(keys):
+                pipeline.delete(
+                    *(keys[position] for position in positions),
+                    *(self.to_version_key(ids[position]) for position in positions),
+                )
+            self.unindex(commands, ids=ids)
+            self.invalidate(commands, ids=ids)
+            if change is not None:
+                for id in ids:
+                    self.publish_change(commands, op=change, id=id)
+            await commands.execute()
 
     @property
-    def lock_name(self):
-        return f"lock:table:{self.tablename}"
+    def feed_key(self) -> str:
+        return f"{self.tablename}:feed"
+
+    def publish_change(
+        self,
+        commands: Commands,
+        *,
+        op: str,
+        id: Any,
+        obj: Optional[CacheSchemaType] = None,
+    ) -> None:
+        """
+        Queue a change feed entry on `commands`, next to the write it records.
+        """
+        fields = {"op": op, "id": str(id)}
+        if obj is not None:
+            fields["record"] = self.codec.encode(obj)
+        commands.on(self.feed_key).xadd(
+            self.feed_key, fields, max_len=self.feed_max_len
+        )
+
+    def parse_change(self, entry_id: bytes, fields: Dict[bytes, bytes]) -> Change:
+        data = fields.get(b"record")
+        return Change(
+            entry_id=entry_id.decode(),
+            op=fields[b"op"].decode(),
+            id=self.id_type(fields[b"id"].decode()),
+            record=self.codec.decode(data) if data else None,
+        )
+
+    async def read_changes(
+        self, cache: Cache, *, after: str = "0", count: int = 100
+    ) -> List[Change]:
+        """
+        Replay up to `count` changes following the entry `after`, oldest first.
+
+        Pass the `entry_id` of the last change back as `after` to continue.
+        """
+        entries = await node_of(cache, self.feed_key).xrange(
+            self.feed_key, start=after, count=count + 1
+        )
+        changes = [
+            self.parse_change(entry_id, fields)
+            for entry_id, fields in entries
+            if entry_id.decode() != after
+        ]
+        return changes[:count]
+
+    async def create_consumer_group(
+        self, cache: Cache, *, group: str, after: str = "$"
+    ) -> None:
+        """
+        Create `group`, reading the changes following `after` (new ones by
+        default), unless it exists.
+        """
+        try:
+            await node_of(cache, self.feed_key).xgroup_create(
+                self.feed_key, group, latest_id=after, mkstream=True
+            )
+        except ReplyError as e:
+            if not str(e).startswith("BUSYGROUP"):
+                raise
+
+    async def read_group_changes(
+        self,
+        cache: Cache,
+        *,
+        group: str,
+        consumer: str,
+        count: int = 100,
+        block: Optional[int] = None,
+        pending: bool = False,
+    ) -> List[Change]:
+        """
+        Read a batch of changes for `consumer` of `group`, to `ack` once handled.
+
+        With `block`, wait up to that many milliseconds for changes, holding a
+        connection meanwhile. With `pending`, read again the changes delivered
+        to `consumer` but not acknowledged, e.g. after a crash.
+        """
+        entries = await node_of(cache, self.feed_key).xread_group(
+            group,
+            consumer,
+            [self.feed_key],
+            timeout=block,
+            count=count,
+            latest_ids=["0" if pending else ">"],
+        )
+        return [
+            self.parse_change(entry_id, fields)
+            for _, entry_id, fields in entries
+            if fields
+        ]
+
+    async def ack_changes(
+        self, cache: Cache, *, group: str, changes: List[Change]
+    ) -> None:
+        if changes:
+            await node_of(cache, self.feed_key).xack(
+                self.feed_key, group, *(change.entry_id for change in changes)
+            )
+
+    def to_tag_key(self, tag: str) -> str:
+        return f"{self.tablename}:tag:{tag}"
+
+    def tags_of(self, obj: Any) -> List[str]:
+        return [
+            TAG_ALL,
+            *(f"{field}:{getattr(obj, field)}" for field in self.tag_fields),
+        ]
+
+    async def bump_tags(self, cache: Cache, *, objs: Iterable[Any]) -> None:
+        """
+        Increment the generation of every tag of `objs`, which makes the query
+        results cached under the previous generations unreachable.
+        """
+        commands = Commands(cache)
+        for tag in {tag for obj in objs for tag in self.tags_of(obj)}:
+            key = self.to_tag_key(tag)
+            commands.on(key).incr(key)
+        await commands.execute()
+
+    async def to_query_key(
+        self, cache: Cache, *, name: str, params: Dict[str, Any], tags: Sequence[str]
+    ) -> str:
+        """
+        Key the results of query `name` with `params` under the current
+        generation of its `tags`. Read it before running the query, so that
+        results stored under it after a concurrent write are never read.
+        """
+        commands = Commands(cache)
+        generations = [
+            commands.on(self.to_tag_key(tag)).get(self.to_tag_key(tag)) for tag in tags
+        ]
+        await commands.execute()
+        digest = hashlib.sha1(
+            json.dumps(
+                [
+                    params,
+                    {
+                        tag: int(generation.result() or 0)
+                        for tag, generation in zip(tags, generations)
+                    },
+                ],
+                sort_keys=True,
+                default=str,
+            ).encode()
+        ).hexdigest()
+        return f"{self.tablename}:query:{name}:{digest}"
+
+    async def get_query(
+        self, cache: Cache, *, key: str
+    ) -> Optional[Tuple[List[Any], Optional[str]]]:
+        """
+        Return the ids and next cursor cached under `key`, if any.
+        """
+        data = await node_of(cache, key).get(key)
+        if data is None:
+            return None
+        result = json.loads(data)
+        return [self.id_type(id) for id in result["ids"]], result["next"]
+
+    async def set_query(
+        self,
+        cache: Cache,
+        *,
+        key: str,
+        ids: List[Any],
+        next_cursor: Optional[str] = None,
+        expire: Optional[int] = None,
+    ) -> None:
+        await node_of(cache, key).set(
+            key, json.dumps({"ids": ids, "next": next_cursor}), expire=expire
+        )
+
+    def lock_name(self, id: Any) -> str:
+        return f"lock:{self.to_key(id)}:update"
 
     async def lock(
-        self, lock_manager: Aioredlock, lock_timeout: Optional[int] = None
+        self, lock_manager: Aioredlock, *, id: Any, lock_timeout: Optional[int] = None
     ) -> Lock:
-        return await lock_manager.lock(self.lock_name, lock_timeout)
+        """
+        Take the lease on updating one record, leaving the others free.
+        """
+        return await lock_manager.lock(self.lock_name(id), lock_timeout)
 
 
 class CRUDDBCacheBase(
@@ -194,70 +1321,524 @@ class CRUDDBCacheBase(
         crud_db: CRUDBase,
         crud_cache: CRUDCacheBase,
         expire: Optional[int] = None,
+        coalesce: bool = True,
+        lease_timeout: Optional[float] = None,
+        expire_jitter: float = 0.0,
+        refresh_ahead: float = 0.0,
+        sliding_expire: bool = False,
+        session_factory: Optional[Callable[[], AsyncSession]] = None,
+        query_expire: Optional[int] = None,
     ):
+        """
+        CRUD that reads through the cache and writes through to the database.
+
+        **Parameters**
+
+        * `coalesce`: concurrent misses for the same id in this process wait
+          for a single load instead of each querying the database
+        * `lease_timeout`: when set and `get` is given a lock manager, a miss
+          takes a Redis lease of this many seconds first, so only one process
+          loads the record and the others pick it up from the cache
+        * `expire_jitter`: shorten each expire by a random fraction up to this,
+          so records cached together do not expire together
+        * `refresh_ahead`: XFetch beta; reads reload a record in the background
+          with a probability rising as it nears expiry, relative to how long
+          loads take. 0 disables it, it needs `session_factory`
+        * `sliding_expire`: reset the expire of a record whenever it is read
+        * `session_factory`: opens the sessions of background reloads and of
+          coalesced loads, which must outlive the request that started them
+        * `query_expire`: cache the ids of list query results for this many
+          seconds, invalidated by writes through tag generations. Writes that
+          bypass this class, like the sync `CRUDBase` methods, bump no tags
+          and only show once the results expire. None disables it
+        """
         self.crud_db = crud_db
         self.crud_cache = crud_cache
         self.expire = expire
+        self.coalesce = coalesce
+        self.lease_timeout = lease_timeout
+        self.expire_jitter = expire_jitter
+        self.refresh_ahead = refresh_ahead if session_factory is not None else 0.0
+        self.sliding_expire = sliding_expire
+        self.session_factory = session_factory
+        self.query_expire = query_expire
+        self.loading: Dict[str, asyncio.Future] = {}
+        self.refreshing: Dict[str, asyncio.Future] = {}
+        # Moving average of the seconds a load from the database takes
+        self.load_time = 0.01
+
+    def jittered(self, expire: Optional[int]) -> Optional[int]:
+        if not expire or not self.expire_jitter:
+            return expire
+        return max(1, round(expire * (1 - self.expire_jitter * random.random())))
+
+    def should_refresh(self, ttl: int) -> bool:
+        """
+        Decide whether a read `ttl` milliseconds before expiry reloads early.
+        """
+        if not self.refresh_ahead or ttl < 0:
+            return False
+        # 1 - random() is in (0, 1], so the logarithm is defined
+        gap = -self.load_time * self.refresh_ahead * math.log(1 - random.random())
+        return gap * 1000 >= ttl
+
+    def refresh(self, cache: Cache, *, id: Any) -> None:
+        """
+        Reload a record in the background, once at a time per record.
+        """
+        key = self.crud_cache.to_key(id)
+        if key in self.refreshing or key in self.loading:
+            return
+        future = asyncio.ensure_future(self.reload(cache, id=id))
+        self.refreshing[key] = future
+        future.add_done_callback(lambda _: self.refreshing.pop(key, None))
+
+    async def reload(self, cache: Cache, *, id: Any) -> None:
+        try:
+            async with self.session_factory() as db:
+                await self.load_from_db(db, cache, id=id)
+        except Exception:
+            logger.exception(f"Refreshing {self.crud_cache.to_key(id)} failed")
 
     async def get(
-        self, db: Session, cache: Redis, *, id: Any
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        id: Any,
+        lock_manager: Optional[Aioredlock] = None,
+    ) -> Optional[CacheSchemaType]:
+        if self.refresh_ahead or self.sliding_expire:
+            renew = self.jittered(self.expire) if self.sliding_expire else None
+            result, ttl = await self.crud_cache.get_with_ttl(cache, id=id, renew=renew)
+            if result is not None and self.should_refresh(ttl):
+                self.refresh(cache, id=id)
+        else:
+            result = await self.crud_cache.get(cache=cache, id=id)
+        if result is not None:
+            return result
+        if not self.coalesce:
+            return await self.load(db, cache, id=id, lock_manager=lock_manager)
+        key = self.crud_cache.to_key(id)
+        future = self.loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(
+                self.shared_load(db, cache, id=id, lock_manager=lock_manager)
+            )
+            self.loading[key] = future
+            future.add_done_callback(lambda _: self.loading.pop(key, None))
+        # A cancelled waiter must not cancel the load the others are waiting on
+        return await asyncio.shield(future)
+
+    async def shared_load(
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        id: Any,
+        lock_manager: Optional[Aioredlock] = None,
     ) -> Optional[CacheSchemaType]:
-        result = await self.crud_cache.get(cache=cache, id=id)
-        if result is None:
-            search_result = self.crud_db.get(db, id)
-            if search_result is not None:
-                result = await self.crud_cache.add_model(cache, obj_in=search_result)
-        return result
+        """
+        Load a missed record for every request waiting on it, in a session of
+        its own: the request that started the load may end first and close `db`.
+        """
+        if self.session_factory is None:
+            return await self.load(db, cache, id=id, lock_manager=lock_manager)
+        async with self.session_factory() as own_db:
+            return await self.load(own_db, cache, id=id, lock_manager=lock_manager)
 
     async def load(
-        self, db: Session, cache: Redis, *, limit: Optional[int] = 1000
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        id: Any,
+        lock_manager: Optional[Aioredlock] = None,
+    ) -> Optional[CacheSchemaType]:
+        """
+        Load a missed record from the database into the cache.
+        """
+        if await self.crud_cache.is_missing(cache, id=id):
+            return None
+        if lock_manager is None or self.lease_timeout is None:
+            return await self.load_from_db(db, cache, id=id)
+        try:
+            lease = await lock_manager.lock(
+                f"lock:{self.crud_cache.to_key(id)}", self.lease_timeout
+            )
+        except LockError:
+            # The holder did not finish within the lock retries, stop waiting
+            return await self.load_from_db(db, cache, id=id)
+        try:
+            # The previous holder has most likely cached it already
+            result = await self.crud_cache.get(cache=cache, id=id)
+            if result is None and not await self.crud_cache.is_missing(cache, id=id):
+                result = await self.load_from_db(db, cache, id=id)
+            return result
+        finally:
+            await lock_manager.unlock(lease)
+
+    async def load_from_db(
+        self, db: AsyncSession, cache: Cache, *, id: Any
+    ) -> Optional[CacheSchemaType]:
+        start = time.perf_counter()
+        db_obj = await self.crud_db.aget(db, id)
+        self.load_time = 0.8 * self.load_time + 0.2 * (time.perf_counter() - start)
+        if db_obj is None:
+            await self.crud_cache.add_missing(cache, id=id)
+            return None
+        return await self.cache_model(cache, db_obj=db_obj)
+
+    async def get_by_index(
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        field: str,
+        value: Any,
+        lock_manager: Optional[Aioredlock] = None,
+    ) -> Optional[CacheSchemaType]:
+        """
+        Find a record through a cached index, or `None` when the index misses
+        or went stale so the caller falls back to the database.
+        """
+        id = await self.crud_cache.get_id_by_index(cache, field=field, value=value)
+        if id is None:
+            return None
+        record = await self.get(db, cache, id=id, lock_manager=lock_manager)
+        if record is None or getattr(record, field) != value:
+            return None
+        return record
+
+    async def get_many(
+        self, db: AsyncSession, cache: Cache, *, ids: List[Any]
     ) -> List[CacheSchemaType]:
-        records = self.crud_db.get_multi(db, limit=limit)
-        coros = []
-        for record in records:
-            exists = await self.crud_cache.exists(cache=cache, id=record.id)
-            if not exists:
-                coros.append(self.crud_cache.add_model(cache, obj_in=record))
-        return await asyncio.gather(*coros)
+        """
+        Fetch the records of `ids` in order, skipping the ones that do not exist.
+
+        Costs one MGET, then at most one SELECT for the misses and one pipelined
+        SET to cache them.
+        """
+        records = await self.crud_cache.get_many(cache, ids=ids)
+        missing_ids = [id for id, record in zip(ids, records) if record is None]
+        if missing_ids:
+            models = await self.crud_db.aget_many(db, ids=missing_ids)
+            loaded = {
+                record.id: record
+                for record in await self.cache_models(cache, db_objs=models)
+            }
+            records = [
+                record if record is not None else loaded.get(id)
+                for id, record in zip(ids, records)
+            ]
+        return [record for record in records if record is not None]
+
+    async def get_query(
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        name: str,
+        params: Dict[str, Any],
+        query: Callable[[], Awaitable[Tuple[List[ModelType], Optional[str]]]],
+        tags: Sequence[str] = (TAG_ALL,),
+    ) -> Tuple[List[CacheSchemaType], Optional[str]]:
+        """
+        Return the records and next cursor of `query`, a list query named
+        `name` run with `params`, from the query result cache when possible.
+
+        A hit costs the tag and result reads then `get_many`; records written
+        since are read fresh, records removed since are skipped.
+        """
+        if not self.query_expire:
+            models, next_cursor = await query()
+            return [self.crud_cache.build(model) for model in models], next_cursor
+        key = await self.crud_cache.to_query_key(
+            cache, name=name, params=params, tags=tags
+        )
+        result = await self.crud_cache.get_query(cache, key=key)
+        if result is not None:
+            ids, next_cursor = result
+            return await self.get_many(db, cache, ids=ids), next_cursor
+        models, next_cursor = await query()
+        records = await self.cache_models(cache, db_objs=models)
+        await self.crud_cache.set_query(
+            cache,
+            key=key,
+            ids=[record.id for record in records],
+            next_cursor=next_cursor,
+            expire=self.query_expire,
+        )
+        return records, next_cursor
+
+    async def get_multi(
+        self, db: AsyncSession, cache: Cache, *, skip: int = 0, limit: int = 100
+    ) -> List[CacheSchemaType]:
+        async def query() -> Tuple[List[ModelType], Optional[str]]:
+            return await self.crud_db.aget_multi(db, skip=skip, limit=limit), None
+
+        records, _ = await self.get_query(
+            db, cache, name="multi", params={"skip": skip, "limit": limit}, query=query,
+        )
+        return records
+
+    async def get_multi_keyset(
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[CacheSchemaType], Optional[str]]:
+        return await self.get_query(
+            db,
+            cache,
+            name="multi_keyset",
+            params={"cursor": cursor, "limit": limit},
+            query=lambda: self.crud_db.aget_multi_keyset(
+                db, cursor=cursor, limit=limit
+            ),
+        )
+
+    async def bump_queries(self, cache: Cache, *, objs: Iterable[Any]) -> None:
+        if self.query_expire:
+            await self.crud_cache.bump_tags(cache, objs=objs)
+
+    async def warm(
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        chunk_size: int = 1000,
+        concurrency: int = 4,
+        expire: Optional[int] = None,
+    ) -> int:
+        """
+        Cache every record that is not cached yet and return how many were added.
+
+        Rows are streamed from a server-side cursor in chunks of `chunk_size` as
+        plain rows, so they never pile up in the session. Each chunk is checked
+        with one pipelined EXISTS and its misses are written with one pipelined
+        SET, with at most `concurrency` chunks in flight.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks: List[asyncio.Future] = []
+        scanned = warmed = 0
+        next_report = chunk_size * 10
+
+        async def warm_chunk(rows: List[Any]) -> None:
+            nonlocal warmed
+            try:
+                exists = await self.crud_cache.exists_many(
+                    cache, ids=[row.id for row in rows]
+                )
+                missing = [row for row, found in zip(rows, exists) if not found]
+                if missing:
+                    await self.cache_models(cache, db_objs=missing, expire=expire)
+                    warmed += len(missing)
+            finally:
+                semaphore.release()
+
+        try:
+            result = await db.stream(
+                select(*self.crud_db.table.columns)
+                .order_by(self.crud_db.table.c.id)
+                .execution_options(yield_per=chunk_size)
+            )
+            async for rows in result.partitions(chunk_size):
+                await semaphore.acquire()
+                tasks.append(asyncio.ensure_future(warm_chunk(rows)))
+                scanned += len(rows)
+                logger.debug(f"Cache warm-up of {self.crud_cache.tablename}: {scanned}")
+                if scanned >= next_report:
+                    next_report += chunk_size * 10
+                    logger.info(
+                        f"Cache warm-up of {self.crud_cache.tablename}: "
+                        f"{scanned} records scanned"
+                    )
+            # The first failed chunk fails the warm-up
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(
+            f"Cache warm-up of {self.crud_cache.tablename} finished: "
+            f"{scanned} records scanned, {warmed} cached"
+        )
+        return warmed
 
     async def cache_model(
-        self, cache: Redis, *, db_obj: ModelType, expire: Optional[int] = None
+        self,
+        cache: Cache,
+        *,
+        db_obj: ModelType,
+        expire: Optional[int] = None,
+        change: Optional[str] = None,
     ) -> CacheSchemaType:
-        object_expire = expire or self.expire
-        return await self.crud_cache.add_model(
-            cache, obj_in=db_obj, expire=object_expire
+        object_expire = self.jittered(expire or self.expire)
+        record = await self.crud_cache.add_model(
+            cache, obj_in=db_obj, expire=object_expire, change=change
         )
+        if change is not None:
+            await self.bump_queries(cache, objs=[record])
+        return record
 
     async def create(
         self,
-        db: Session,
-        cache: Redis,
+        db: AsyncSession,
+        cache: Cache,
         *,
         obj_in: CreateSchemaType,
         expire: Optional[int] = None,
     ) -> CacheSchemaType:
-        model = self.crud_db.create(db, obj_in=obj_in)
-        return await self.cache_model(cache, db_obj=model, expire=expire)
+        model = await self.crud_db.acreate(db, obj_in=obj_in)
+        return await self.cache_model(
+            cache, db_obj=model, expire=expire, change=CHANGE_CREATE
+        )
 
     async def update(
         self,
-        db: Session,
-        cache: Redis,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        cache_obj: CacheSchemaType,
+        obj_in: Union[UpdateSchemaType, Dict[str, Any]],
+        expire: Optional[int] = None,
+        version: Optional[int] = None,
+        lock_manager: Optional[Aioredlock] = None,
+    ) -> CacheSchemaType:
+        """
+        Update the record `cache_obj` was read from.
+
+        Versioned records are only updated if still at `version`, by default
+        the version of `cache_obj`, otherwise `StaleDataError` is raised: a lost
+        update is detected instead of prevented by locking. With `lock_manager`,
+        updates of the same record also wait for each other on a per-record
+        lease, and `LockError` is raised if it cannot be taken.
+        """
+        if lock_manager is None:
+            return await self.update_record(
+                db,
+                cache,
+                cache_obj=cache_obj,
+                obj_in=obj_in,
+                expire=expire,
+                version=version,
+            )
+        lock = await self.lock(lock_manager, id=cache_obj.id)
+        try:
+            return await self.update_record(
+                db,
+                cache,
+                cache_obj=cache_obj,
+                obj_in=obj_in,
+                expire=expire,
+                version=version,
+            )
+        finally:
+            await lock_manager.unlock(lock)
+
+    async def update_record(
+        self,
+        db: AsyncSession,
+        cache: Cache,
         *,
         cache_obj: CacheSchemaType,
         obj_in: Union[UpdateSchemaType, Dict[str, Any]],
         expire: Optional[int] = None,
+        version: Optional[int] = None,
     ) -> CacheSchemaType:
-        db_obj = self.crud_db.get(db, cache_obj.id)
-        model = self.crud_db.update(db, db_obj=db_obj, obj_in=obj_in)
-        return await self.cache_model(cache, db_obj=model, expire=expire)
+        db_obj = await self.crud_db.aget(db, cache_obj.id)
+        if db_obj is None:
+            raise StaleDataError(f"{cache_obj.id} was removed")
+        if version is None and self.crud_db.versioned:
+            version = cache_obj.version
+        model = await self.crud_db.aupdate(
+            db, db_obj=db_obj, obj_in=obj_in, version=version
+        )
+        record = await self.cache_model(
+            cache, db_obj=model, expire=expire, change=CHANGE_UPDATE
+        )
+        if self.crud_cache.tags_of(cache_obj) != self.crud_cache.tags_of(record):
+            # Queries the record no longer matches change too
+            await self.bump_queries(cache, objs=[cache_obj])
+        return record
 
-    async def remove(self, db: Session, cache: Redis, *, id: Any) -> CacheSchemaType:
-        model = self.crud_db.remove(db, id=id)
-        cache_obj = await self.crud_cache.remove(cache, id=id)
+    async def remove(
+        self, db: AsyncSession, cache: Cache, *, id: Any
+    ) -> Optional[CacheSchemaType]:
+        """
+        Delete the record and return it, or `None` if it was already gone.
+        """
+        model = await self.crud_db.aremove(db, id=id)
+        if model is None:
+            # Removed by a concurrent request, whose copy may be cached again
+            await self.crud_cache.remove(cache, id=id)
+            return None
+        cache_obj = await self.crud_cache.remove(cache, id=id, change=CHANGE_REMOVE)
+        await self.bump_queries(cache, objs=[model])
         return cache_obj or self.crud_cache.build(model)
 
+    async def cache_models(
+        self,
+        cache: Cache,
+        *,
+        db_objs: List[ModelType],
+        expire: Optional[int] = None,
+        change: Optional[str] = None,
+    ) -> List[CacheSchemaType]:
+        object_expire = expire or self.expire
+        records = await self.crud_cache.add_many_models(
+            cache,
+            objs_in=db_objs,
+            expire=[self.jittered(object_expire) for _ in db_objs],
+            change=change,
+        )
+        if change is not None and records:
+            await self.bump_queries(cache, objs=records)
+        return records
+
+    async def create_many(
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        objs_in: List[CreateSchemaType],
+        expire: Optional[int] = None,
+    ) -> List[CacheSchemaType]:
+        models = await self.crud_db.acreate_many(db, objs_in=objs_in)
+        return await self.cache_models(
+            cache, db_objs=models, expire=expire, change=CHANGE_CREATE
+        )
+
+    async def update_many(
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        objs_in: Dict[Any, Union[UpdateSchemaType, Dict[str, Any]]],
+        expire: Optional[int] = None,
+    ) -> List[CacheSchemaType]:
+        models = await self.crud_db.aupdate_many(db, objs_in=objs_in)
+        return await self.cache_models(
+            cache, db_objs=models, expire=expire, change=CHANGE_UPDATE
+        )
+
+    async def remove_many(
+        self, db: AsyncSession, cache: Cache, *, ids: List[Any]
+    ) -> List[CacheSchemaType]:
+        models = await self.crud_db.aremove_many(db, ids=ids)
+        await self.crud_cache.remove_many(
+            cache, ids=[model.id for model in models], change=CHANGE_REMOVE
+        )
+        if models:
+            await self.bump_queries(cache, objs=models)
+        return [self.crud_cache.build(model) for model in models]
+
     async def lock(
-        self, lock_manager: Aioredlock, lock_timeout: Optional[int] = None
+        self, lock_manager: Aioredlock, *, id: Any, lock_timeout: Optional[int] = None
     ) -> Lock:
-        return await self.crud_cache.lock(lock_manager, lock_timeout)
+        return await self.crud_cache.lock(
+            lock_manager, id=id, lock_timeout=lock_timeout
+        )
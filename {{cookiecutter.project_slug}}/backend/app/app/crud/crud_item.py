@@ -1,11 +1,56 @@
-from typing import List
+import asyncio
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
 
 from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.crud.base import CRUDBase
+from app.core.config import settings
+from app.crud.base import (
+    CHANGE_CREATE,
+    CRUDBase,
+    CRUDCacheBase,
+    CRUDDBCacheBase,
+    decode_cursor,
+    encode_cursor,
+)
+from app.crud.codecs import codecs
+from app.db.cache import Cache, Commands, node_of
+from app.db.session import AsyncSessionLocal
 from app.models.item import Item
-from app.schemas.item import ItemCreate, ItemUpdate
+from app.schemas.item import ItemCreate, ItemInDB, ItemUpdate
+
+# Add ids to a cached owner list (KEYS[1]) only if it is cached: a partial list
+# would pass for the complete one. Either way bump the owner's generation
+# (KEYS[2]), so that a list rebuilt from before the write is not published.
+ADD_OWNER_IDS_SCRIPT = """
+redis.call("INCR", KEYS[2])
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    for _, id in ipairs(ARGV) do
+        redis.call("ZADD", KEYS[1], id, id)
+    end
+end
+"""
+
+# Replace an owner list (KEYS[1]) by the ids ARGV[3..], unless the owner's
+# generation (KEYS[2]) moved past ARGV[1] since they were read. ARGV[2] is the
+# expire in seconds (0 for none).
+SET_OWNER_IDS_SCRIPT = """
+if tonumber(redis.call("GET", KEYS[2]) or 0) ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call("DEL", KEYS[1])
+redis.call("ZADD", KEYS[1], 0, 0)
+for i = 3, #ARGV do
+    redis.call("ZADD", KEYS[1], ARGV[i], ARGV[i])
+end
+if tonumber(ARGV[2]) > 0 then
+    redis.call("EXPIRE", KEYS[1], ARGV[2])
+end
+return 1
+"""
 
 
 class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
@@ -30,5 +75,244 @@ class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
             .all()
         )
 
+    async def acreate_with_owner(
+        self, db: AsyncSession, *, obj_in: ItemCreate, owner_id: int
+    ) -> Item:
+        obj_in_data = jsonable_encoder(obj_in)
+        return await self.acreate_dict(
+            db, create_data={**obj_in_data, "owner_id": owner_id}
+        )
+
+    async def aget_multi_by_owner(
+        self, db: AsyncSession, *, owner_id: int, skip: int = 0, limit: int = 100
+    ) -> List[Item]:
+        result = await db.execute(
+            select(self.model)
+            .where(Item.owner_id == owner_id)
+            .offset(skip)
+            .limit(limit)
+        )
+        return result.scalars().all()
+
+    async def aget_multi_by_owner_keyset(
+        self,
+        db: AsyncSession,
+        *,
+        owner_id: int,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[Item], Optional[str]]:
+        return await self.aget_keyset_page(
+            db,
+            select(self.model).where(Item.owner_id == owner_id),
+            columns=[Item.owner_id, Item.id],
+            cursor=cursor,
+            limit=limit,
+        )
+
+    async def aget_ids_by_owner(self, db: AsyncSession, *, owner_id: int) -> List[int]:
+        result = await db.execute(
+            select(Item.id).where(Item.owner_id == owner_id).order_by(Item.id)
+        )
+        return result.scalars().all()
+
+
+class CRUDCacheItem(CRUDCacheBase[ItemInDB, ItemCreate, ItemUpdate]):
+    """
+    Items plus, per owner, the sorted set of their ids. A cached owner set is
+    always complete: it holds a member scored 0 so that it exists even when
+    empty, and writes only add to sets that already exist.
+
+    Every write also bumps the owner's generation, kept on the node of the
+    owner set, and a set rebuilt from the database is only published if the
+    generation did not move since before the database was read.
+    """
+
+    def to_owner_key(self, owner_id: int) -> str:
+        return f"{self.tablename}:owner:{owner_id}"
+
+    def to_owner_generation_key(self, owner_id: int) -> str:
+        return f"{self.to_owner_key(owner_id)}:generation"
+
+    def write(
+        self, commands: Commands, *, obj_in: ItemInDB, expire: Optional[int]
+    ) -> Optional[asyncio.Future]:
+        written = super().write(commands, obj_in=obj_in, expire=expire)
+        owner_key = self.to_owner_key(obj_in.owner_id)
+        commands.on(owner_key).eval(
+            ADD_OWNER_IDS_SCRIPT,
+            keys=[owner_key, self.to_owner_generation_key(obj_in.owner_id)],
+            args=[obj_in.id],
+        )
+        return written
+
+    async def get_owner_ids(
+        self,
+        cache: Cache,
+        *,
+        owner_id: int,
+        after: int = 0,
+        skip: int = 0,
+        limit: int = 100,
+    ) -> Optional[List[int]]:
+        """
+        Return up to `limit` ids of the owner's items above `after`, past the
+        first `skip`, or `None` if the owner's ids are not cached.
+        """
+        key = self.to_owner_key(owner_id)
+        node = node_of(cache, key)
+        pipeline = node.pipeline()
+        pipeline.exists(key)
+        pipeline.zrangebyscore(
+            key, min=after, exclude=node.ZSET_EXCLUDE_MIN, offset=skip, count=limit,
+        )
+        exists, ids = await pipeline.execute()
+        return [int(id) for id in ids] if exists else None
+
+    async def get_owner_generation(self, cache: Cache, *, owner_id: int) -> int:
+        """
+        Return the owner's generation, to read before rebuilding its ids.
+        """
+        key = self.to_owner_key(owner_id)
+        generation = await node_of(cache, key).get(
+            self.to_owner_generation_key(owner_id)
+        )
+        return int(generation or 0)
+
+    async def set_owner_ids(
+        self,
+        cache: Cache,
+        *,
+        owner_id: int,
+        ids: List[int],
+        generation: int,
+        expire: Optional[int] = None,
+    ) -> bool:
+        """
+        Cache all ids of the owner's items, read at `generation`, and return
+        whether they were, i.e. no write of the owner's items came in between.
+        """
+        key = self.to_owner_key(owner_id)
+        published = await node_of(cache, key).eval(
+            SET_OWNER_IDS_SCRIPT,
+            keys=[key, self.to_owner_generation_key(owner_id)],
+            args=[generation, expire or 0, *ids],
+        )
+        return bool(published)
+
+    async def remove_owner_ids(
+        self, cache: Cache, *, owner_ids: Dict[int, List[int]]
+    ) -> None:
+        commands = Commands(cache)
+        for owner_id, ids in owner_ids.items():
+            key = self.to_owner_key(owner_id)
+            pipeline = commands.on(key)
+            pipeline.incr(self.to_owner_generation_key(owner_id))
+            pipeline.zrem(key, *ids)
+        await commands.execute()
+
+
+class CRUDDBCacheItem(CRUDDBCacheBase[Item, ItemInDB, ItemCreate, ItemUpdate]):
+    async def create_with_owner(
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        obj_in: ItemCreate,
+        owner_id: int,
+        expire: Optional[int] = None,
+    ) -> ItemInDB:
+        model = await self.crud_db.acreate_with_owner(
+            db, obj_in=obj_in, owner_id=owner_id
+        )
+        return await self.cache_model(
+            cache, db_obj=model, expire=expire, change=CHANGE_CREATE
+        )
+
+    async def get_multi_by_owner(
+        self,
+        db: AsyncSession,
+        cache: Cache,
+        *,
+        owner_id: int,
+        skip: int = 0,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[ItemInDB], Optional[str]]:
+        """
+        Return a page of the owner's items by id and the cursor of the next one.
+
+        Cursors are those of `CRUDItem.aget_multi_by_owner_keyset`. The ids come
+        from the cached owner set, rebuilt from the (owner_id, id) index on a miss.
+        """
+        after = 0
+        if cursor is not None:
+            cursor_owner_id, after = decode_cursor(cursor, (int, int))
+            if cursor_owner_id != owner_id:
+                raise ValueError("Cursor of another owner")
+        ids = await self.crud_cache.get_owner_ids(
+            cache, owner_id=owner_id, after=after, skip=skip, limit=limit
+        )
+        if ids is None:
+            generation = await self.crud_cache.get_owner_generation(
+                cache, owner_id=owner_id
+            )
+            all_ids = await self.crud_db.aget_ids_by_owner(db, owner_id=owner_id)
+            await self.crud_cache.set_owner_ids(
+                cache,
+                owner_id=owner_id,
+                ids=all_ids,
+                generation=generation,
+                expire=self.expire,
+            )
+            ids = [id for id in all_ids if id > after][skip:][:limit]
+        items = await self.get_many(db, cache, ids=ids)
+        next_cursor = None
+        if items and len(ids) == limit:
+            next_cursor = encode_cursor([owner_id, items[-1].id])
+        return items, next_cursor
+
+    async def remove(
+        self, db: AsyncSession, cache: Cache, *, id: Any
+    ) -> Optional[ItemInDB]:
+        item = await super().remove(db, cache, id=id)
+        if item is None:
+            return None
+        await self.crud_cache.remove_owner_ids(
+            cache, owner_ids={item.owner_id: [item.id]}
+        )
+        return item
+
+    async def remove_many(
+        self, db: AsyncSession, cache: Cache, *, ids: List[Any]
+    ) -> List[ItemInDB]:
+        items = await super().remove_many(db, cache, ids=ids)
+        owner_ids: Dict[int, List[int]] = defaultdict(list)
+        for item in items:
+            owner_ids[item.owner_id].append(item.id)
+        if owner_ids:
+            await self.crud_cache.remove_owner_ids(cache, owner_ids=owner_ids)
+        return items
+
 
 item = CRUDItem(Item)
+item_cache = CRUDCacheItem(
+    ItemInDB,
+    Item.__tablename__,
+    codec=codecs[settings.CACHE_CODEC](
+        ItemInDB, compress_threshold=settings.CACHE_COMPRESS_THRESHOLD
+    ),
+    missing_expire=settings.CACHE_MISSING_EXPIRE,
+    feed_max_len=settings.CACHE_FEED_MAX_LEN,
+    tag_fields=["owner_id"],
+)
+item_cachedb = CRUDDBCacheItem(
+    item,
+    item_cache,
+    expire=3600,
+    expire_jitter=settings.CACHE_EXPIRE_JITTER,
+    refresh_ahead=settings.CACHE_REFRESH_AHEAD,
+    sliding_expire=settings.CACHE_SLIDING_EXPIRE,
+    session_factory=AsyncSessionLocal,
+    query_expire=settings.CACHE_QUERY_EXPIRE,
+)
@@ -1,10 +1,22 @@
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
-import aioredis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.core.security import get_password_hash, verify_password
+from app.core.config import settings
+from app.core.security import (
+    aget_password_hash,
+    aget_password_hashes,
+    averify_password,
+    get_password_hash,
+    verify_password,
+)
 from app.crud.base import CRUDBase, CRUDCacheBase, CRUDDBCacheBase
+from app.crud.codecs import codecs
+from app.crud.local_cache import LocalCache
+from app.db.cache import Cache
+from app.db.session import AsyncSessionLocal
 from app.models.user import User
 from app.schemas.user import UserCreate, UserInDB, UserUpdate
 
@@ -43,6 +55,96 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
             return None
         return user
 
+    async def aget_by_email(self, db: AsyncSession, *, email: str) -> Optional[User]:
+        result = await db.execute(select(User).where(User.email == email))
+        return result.scalars().first()
+
+    async def aget_by_username(
+        self, db: AsyncSession, *, username: str
+    ) -> Optional[User]:
+        result = await db.execute(select(User).where(User.username == username))
+        return result.scalars().first()
+
+    async def acreate(self, db: AsyncSession, *, obj_in: UserCreate) -> User:
+        obj_in_data = obj_in.dict(exclude={"password"})
+        obj_in_data["hashed_password"] = await aget_password_hash(obj_in.password)
+        return await self.acreate_dict(db, create_data=obj_in_data)
+
+    async def aget_multi_by_email(
+        self, db: AsyncSession, *, emails: List[str]
+    ) -> List[User]:
+        result = await db.execute(select(User).where(User.email.in_(emails)))
+        return result.scalars().all()
+
+    async def acreate_many(
+        self, db: AsyncSession, *, objs_in: List[UserCreate], batch_size: int = 1000
+    ) -> List[User]:
+        hashed_passwords = await aget_password_hashes(
+            [obj_in.password for obj_in in objs_in]
+        )
+        create_data = []
+        for obj_in, hashed_password in zip(objs_in, hashed_passwords):
+            obj_in_data = obj_in.dict(exclude={"password"})
+            obj_in_data["hashed_password"] = hashed_password
+            create_data.append(obj_in_data)
+        return await self.acreate_many_dict(
+            db, create_data=create_data, batch_size=batch_size
+        )
+
+    async def aupdate(
+        self,
+        db: AsyncSession,
+        *,
+        db_obj: User,
+        obj_in: Union[UserUpdate, Dict[str, Any]],
+        version: Optional[int] = None,
+    ) -> User:
+        if isinstance(obj_in, dict):
+            update_data = obj_in
+        else:
+            update_data = obj_in.dict(exclude_unset=True)
+        if "password" in update_data:
+            update_data = dict(update_data)
+            update_data["hashed_password"] = await aget_password_hash(
+                update_data.pop("password")
+            )
+        return await self.aupdate_dict(
+            db, db_obj=db_obj, update_data=update_data, version=version
+        )
+
+    async def aupdate_many(
+        self,
+        db: AsyncSession,
+        *,
+        objs_in: Dict[Any, Union[UserUpdate, Dict[str, Any]]],
+        batch_size: int = 1000,
+    ) -> List[User]:
+        update_data = {}
+        for id, obj_in in objs_in.items():
+            if isinstance(obj_in, dict):
+                update_data[id] = dict(obj_in)
+            else:
+                update_data[id] = obj_in.dict(exclude_unset=True)
+        ids = [id for id, data in update_data.items() if "password" in data]
+        hashed_passwords = await aget_password_hashes(
+            [update_data[id].pop("password") for id in ids]
+        )
+        for id, hashed_password in zip(ids, hashed_passwords):
+            update_data[id]["hashed_password"] = hashed_password
+        return await self.aupdate_many_dict(
+            db, update_data=update_data, batch_size=batch_size
+        )
+
+    async def aauthenticate(
+        self, db: AsyncSession, *, username: str, password: str
+    ) -> Optional[User]:
+        user = await self.aget_by_username(db, username=username)
+        if user is None:
+            return None
+        if not await averify_password(password, user.hashed_password):
+            return None
+        return user
+
 
 class CRUDCacheUser(CRUDCacheBase[UserInDB, UserCreate, UserUpdate]):
     pass
@@ -50,32 +152,63 @@ class CRUDCacheUser(CRUDCacheBase[UserInDB, UserCreate, UserUpdate]):
 
 class CRUDDBCacheUser(CRUDDBCacheBase[User, UserInDB, UserCreate, UserUpdate]):
     async def get_by_username(
-        self, db: Session, cache: aioredis.Redis, *, username: str
+        self, db: AsyncSession, cache: Cache, *, username: str
     ) -> Optional[UserInDB]:
-        user = self.crud_db.get_by_username(db, username=username)
-        if user is None:
+        user = await self.get_by_index(db, cache, field="username", value=username)
+        if user is not None:
+            return user
+        db_user = await self.crud_db.aget_by_username(db, username=username)
+        if db_user is None:
             return None
-        return await self.crud_cache.get(cache, id=user.id)
+        return await self.cache_model(cache, db_obj=db_user)
 
     async def get_by_email(
-        self, db: Session, cache: aioredis.Redis, *, email: str
+        self, db: AsyncSession, cache: Cache, *, email: str
     ) -> Optional[UserInDB]:
-        user = self.crud_db.get_by_email(db, email=email)
-        if user is None:
+        user = await self.get_by_index(db, cache, field="email", value=email)
+        if user is not None:
+            return user
+        db_user = await self.crud_db.aget_by_email(db, email=email)
+        if db_user is None:
             return None
-        return await self.crud_cache.get(cache, id=user.id)
+        return await self.cache_model(cache, db_obj=db_user)
 
     async def authenticate(
-        self, db: Session, cache: aioredis.Redis, *, username: str, password: str
+        self, db: AsyncSession, cache: Cache, *, username: str, password: str
     ) -> Optional[UserInDB]:
         user = await self.get_by_username(db, cache, username=username)
         if user is None:
             return None
-        if not verify_password(password, user.hashed_password):
+        if not await averify_password(password, user.hashed_password):
             return None
         return user
 
 
 user = CRUDUser(User)
-user_cache = CRUDCacheUser(UserInDB, User.__tablename__)
-user_cachedb = CRUDDBCacheUser(user, user_cache, expire=3600)
+user_cache = CRUDCacheUser(
+    UserInDB,
+    User.__tablename__,
+    local_cache=LocalCache(
+        maxsize=settings.CACHE_LOCAL_MAXSIZE, ttl=settings.CACHE_LOCAL_TTL
+    )
+    if settings.CACHE_LOCAL_ENABLED
+    else None,
+    codec=codecs[settings.CACHE_CODEC](
+        UserInDB, compress_threshold=settings.CACHE_COMPRESS_THRESHOLD
+    ),
+    hash_storage=settings.CACHE_HASH_STORAGE,
+    indexes=["username", "email"],
+    missing_expire=settings.CACHE_MISSING_EXPIRE,
+    feed_max_len=settings.CACHE_FEED_MAX_LEN,
+)
+user_cachedb = CRUDDBCacheUser(
+    user,
+    user_cache,
+    expire=3600,
+    lease_timeout=settings.CACHE_LOAD_LEASE_TIMEOUT,
+    expire_jitter=settings.CACHE_EXPIRE_JITTER,
+    refresh_ahead=settings.CACHE_REFRESH_AHEAD,
+    sliding_expire=settings.CACHE_SLIDING_EXPIRE,
+    session_factory=AsyncSessionLocal,
+    query_expire=settings.CACHE_QUERY_EXPIRE,
+)
@@ -0,0 +1,65 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+from uuid import uuid4
+
+
+class LocalCache:
+    """
+    Per-process LRU cache whose entries also expire after `ttl` seconds.
+
+    The TTL bounds how stale an entry can get if an invalidation message is
+    missed, `maxsize` bounds memory. `origin` identifies this process so it can
+    ignore the invalidations it published itself.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.origin = uuid4().hex
+        self.records: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.records.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.records[key]
+            self.misses += 1
+            return None
+        self.records.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store `value` for `ttl` seconds, capped by the cache TTL.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self.records[key] = (time.monotonic() + ttl, value)
+        self.records.move_to_end(key)
+        while len(self.records) > self.maxsize:
+            self.records.popitem(last=False)
+
+    def delete(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            if self.records.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        self.records.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "size": len(self.records),
+        }
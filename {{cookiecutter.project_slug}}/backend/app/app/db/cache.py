@@ -0,0 +1,129 @@
+import asyncio
+import bisect
+import hashlib
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
+
+import aioredis
+from aioredis import Redis
+from aioredis.commands import Pipeline
+
+from app.core.config import settings
+
+
+def ring_hash(value: str) -> int:
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def hash_tag(key: str) -> str:
+    _, brace, rest = key.partition("{")
+    tag, brace, _ = rest.partition("}") if brace else ("", "", "")
+    return tag if brace and tag else key
+
+
+class RedisRing:
+    """
+    Redis nodes sharing a key space by consistent hashing.
+
+    Each node owns `replicas` points of the ring, placed by hashing its name,
+    and a key belongs to the node of the first point at or after the hash of
+    the key. Adding or removing a node only moves the keys of its points.
+
+    As in Redis Cluster, only the hash tag of a key is hashed when it has one,
+    the part between its first "{" and the next "}", so keys sharing a tag
+    share a node.
+    """
+
+    def __init__(self, nodes: Dict[str, Redis], replicas: int = 100):
+        if not nodes:
+            raise ValueError("A ring needs at least one node")
+        self.nodes = nodes
+        points = sorted(
+            (ring_hash(f"{name}#{replica}"), name)
+            for name in nodes
+            for replica in range(replicas)
+        )
+        self.points = [point for point, _ in points]
+        self.names = [name for _, name in points]
+
+    def name(self, key: str) -> str:
+        index = bisect.bisect(self.points, ring_hash(hash_tag(key))) % len(self.points)
+        return self.names[index]
+
+    def node(self, key: str) -> Redis:
+        return self.nodes[self.name(key)]
+
+    def close(self) -> None:
+        for node in self.nodes.values():
+            node.close()
+
+    async def wait_closed(self) -> None:
+        await asyncio.gather(*(node.wait_closed() for node in self.nodes.values()))
+
+
+# What the cache CRUD classes talk to: one Redis, or a ring of them
+Cache = Union[Redis, RedisRing]
+
+
+def node_of(cache: Cache, key: str) -> Redis:
+    """
+    Return the Redis holding `key`.
+    """
+    if isinstance(cache, RedisRing):
+        return cache.node(key)
+    return cache
+
+
+class Commands:
+    """
+    Queue commands for the nodes of `cache`, one pipeline (or MULTI/EXEC
+    transaction) per node, and execute them concurrently.
+
+    Commands of one node keep their order and, in a transaction, run together;
+    nothing orders or groups commands across nodes. Queued commands return
+    futures, as on a pipeline.
+    """
+
+    def __init__(self, cache: Cache, *, transaction: bool = False):
+        self.cache = cache
+        self.transaction = transaction
+        self.pipelines: Dict[int, Pipeline] = {}
+
+    def on(self, key: str) -> Pipeline:
+        """
+        Return the pipeline of the node holding `key`.
+        """
+        node = node_of(self.cache, key)
+        pipeline = self.pipelines.get(id(node))
+        if pipeline is None:
+            pipeline = node.multi_exec() if self.transaction else node.pipeline()
+            self.pipelines[id(node)] = pipeline
+        return pipeline
+
+    def split(self, keys: Sequence[str]) -> Iterator[Tuple[Pipeline, List[int]]]:
+        """
+        Group `keys` by node, yielding each pipeline with the positions in
+        `keys` of the keys its node holds.
+        """
+        positions: Dict[int, List[int]] = {}
+        for position, key in enumerate(keys):
+            pipeline = self.on(key)
+            positions.setdefault(id(pipeline), []).append(position)
+        for pipeline in list(self.pipelines.values()):
+            if id(pipeline) in positions:
+                yield pipeline, positions[id(pipeline)]
+
+    async def execute(self) -> None:
+        await asyncio.gather(
+            *(pipeline.execute() for pipeline in self.pipelines.values())
+        )
+
+
+async def create_ring(
+    nodes: Sequence[str], replicas: int = settings.CACHE_RING_REPLICAS
+) -> RedisRing:
+    """
+    Connect to the Redis `nodes`, given as DSNs, as a ring.
+    """
+    pools = await asyncio.gather(*(aioredis.create_redis_pool(dsn) for dsn in nodes))
+    return RedisRing(dict(zip(nodes, pools)), replicas=replicas)
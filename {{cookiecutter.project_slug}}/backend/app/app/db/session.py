@@ -1,7 +1,81 @@
+from typing import Any, Callable, Optional
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Result
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.query import FromStatement
 
 from app.core.config import settings
 
 engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(
+    settings.ASYNC_SQLALCHEMY_DATABASE_URI, pool_pre_ping=True
+)
+# Objects must stay readable after commit without an implicit (blocking) refresh
+AsyncSessionLocal = sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+def is_read(statement: Any) -> bool:
+    if isinstance(statement, FromStatement):
+        # ORM objects loaded from an INSERT/UPDATE/DELETE ... RETURNING
+        statement = statement.element
+    return bool(getattr(statement, "is_select", False))
+
+
+class LazySession:
+    """
+    Stand-in for an AsyncSession that opens it on first use, for requests that
+    may never reach the database.
+
+    The connection is checked out by the first query, as usual, but returned
+    to the pool as soon as a read outside of a write has run: its results are
+    buffered, and the transaction is committed rather than left open until the
+    end of the request. Writes keep the transaction, and the connection, until
+    they commit or roll back. `stream` leaves it open until `close`.
+    """
+
+    def __init__(self, factory: Callable[[], AsyncSession] = AsyncSessionLocal):
+        self.factory = factory
+        self.session: Optional[AsyncSession] = None
+        self.writing = False
+
+    def open(self) -> AsyncSession:
+        if self.session is None:
+            self.session = self.factory()
+        return self.session
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.open(), name)
+
+    async def execute(self, statement: Any, *args: Any, **kwargs: Any) -> Result:
+        session = self.open()
+        result = await session.execute(statement, *args, **kwargs)
+        if not is_read(statement):
+            self.writing = True
+        elif not (self.writing or session.new or session.dirty or session.deleted):
+            # Nothing to keep: objects stay loaded (expire_on_commit=False)
+            await session.commit()
+        return result
+
+    async def commit(self) -> None:
+        await self.open().commit()
+        self.writing = False
+
+    async def rollback(self) -> None:
+        await self.open().rollback()
+        self.writing = False
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.writing = False
@@ -38,9 +38,14 @@ def check_db() -> None:
 )
 async def check_cache() -> None:
     try:
-        # Try to create pool to check if Redis is awake
-        cache = await aioredis.create_redis_pool(settings.APP_REDIS_DSN)
-        await cache.get("")
+        # Try to create pools to check if Redis and the cache nodes are awake
+        for dsn in [settings.APP_REDIS_DSN, *settings.CACHE_REDIS_NODES]:
+            cache = await aioredis.create_redis_pool(dsn)
+            try:
+                await cache.get("")
+            finally:
+                cache.close()
+                await cache.wait_closed()
     except Exception:
         logger.exception("Init failed")
         raise
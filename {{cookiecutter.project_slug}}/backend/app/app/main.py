@@ -1,15 +1,28 @@
+import asyncio
+
 import aioredis
 import aioredlock
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
 
 from app import crud
+from app.api import deps
 from app.api.api_v1.api import api_router
+from app.api.responses import ORJSONResponse
 from app.core.config import settings
-from app.db.session import SessionLocal
+from app.core.log import logger
+from app.core.metrics import MetricsMiddleware, TimedRedis, render, sample_forever
+from app.core.pool import PoolBusy
+from app.core.security import password_pool
+from app.db.cache import create_ring
+from app.db.session import AsyncSessionLocal, async_engine
 
 app = FastAPI(
-    title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    title=settings.PROJECT_NAME,
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    default_response_class=ORJSONResponse,
 )
 
 # Set all CORS enabled origins
@@ -20,22 +33,94 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag"],
     )
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 
+if settings.METRICS_ENABLED:
+
+    @app.get(
+        "/metrics",
+        include_in_schema=False,
+        dependencies=[
+            Depends(
+                deps.check_metrics_token
+                if settings.METRICS_TOKEN
+                else deps.get_current_active_superuser
+            )
+        ],
+    )
+    def read_metrics() -> Response:
+        content, media_type = render()
+        return Response(content, media_type=media_type)
+
+
+@app.exception_handler(PoolBusy)
+async def pool_busy_handler(request: Request, exc: PoolBusy) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+async def warm_cache() -> None:
+    try:
+        async with AsyncSessionLocal() as db:
+            await crud.user_cachedb.warm(
+                db,
+                app.state.cache,
+                chunk_size=settings.CACHE_WARMUP_CHUNK_SIZE,
+                concurrency=settings.CACHE_WARMUP_CONCURRENCY,
+            )
+    except Exception:
+        logger.exception("Cache warm-up failed")
+
+
 @app.on_event("startup")
 async def on_startup() -> None:
-    app.state.redis = await aioredis.create_redis_pool(settings.APP_REDIS_DSN)
+    password_pool.start()
+    app.state.redis = await aioredis.create_redis_pool(
+        settings.APP_REDIS_DSN, commands_factory=TimedRedis
+    )
     app.state.lock = aioredlock.Aioredlock([app.state.redis])
-    db = SessionLocal()
-    await crud.user_cachedb.load(db, app.state.redis)
-    db.close()
+    app.state.cache = app.state.redis
+    if settings.CACHE_REDIS_NODES:
+        app.state.cache = await create_ring(settings.CACHE_REDIS_NODES)
+    app.state.cache_warmup = None
+    app.state.metrics_sampler = None
+    if settings.METRICS_ENABLED:
+        app.state.metrics_sampler = asyncio.ensure_future(
+            sample_forever(app.state.redis, settings.METRICS_SAMPLE_INTERVAL)
+        )
+    app.state.cache_listener = asyncio.ensure_future(
+        crud.user_cache.listen(app.state.cache)
+    )
+    if settings.CACHE_WARMUP_ENABLED:
+        if settings.CACHE_WARMUP_IN_BACKGROUND:
+            app.state.cache_warmup = asyncio.ensure_future(warm_cache())
+        else:
+            await warm_cache()
 
 
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
+    if app.state.cache_warmup is not None:
+        app.state.cache_warmup.cancel()
+    if app.state.metrics_sampler is not None:
+        app.state.metrics_sampler.cancel()
+    app.state.cache_listener.cancel()
+    await asyncio.gather(app.state.cache_listener, return_exceptions=True)
     await app.state.lock.destroy()
+    if app.state.cache is not app.state.redis:
+        app.state.cache.close()
+        await app.state.cache.wait_closed()
     app.state.redis.close()
     await app.state.redis.wait_closed()
+    await async_engine.dispose()
+    password_pool.shutdown()
@@ -1,6 +1,6 @@
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 
 from app.db.base_class import Base
@@ -15,3 +15,10 @@ class Item(Base):
     description = Column(String, index=True)
     owner_id = Column(Integer, ForeignKey("user.id"))
     owner = relationship("User", back_populates="items")
+    version = Column(Integer, nullable=False, server_default="1")
+
+    # Incremented by every update, which fails if it changed since the read
+    __mapper_args__ = {"version_id_col": version}
+
+    # Keyset pagination of an owner's items seeks on (owner_id, id)
+    __table_args__ = (Index("ix_item_owner_id_id", "owner_id", "id"),)
@@ -18,3 +18,7 @@ class User(Base):
     is_active = Column(Boolean())
     is_superuser = Column(Boolean())
     items = relationship("Item", back_populates="owner")
+    version = Column(Integer, nullable=False, server_default="1")
+
+    # Incremented by every update, which fails if it changed since the read
+    __mapper_args__ = {"version_id_col": version}
@@ -1,8 +1,13 @@
+import asyncio
+
 import aioredis
+import aioredlock
 import socketio
 
+from app import crud
 from app.core.config import settings
 from app.core.log import logger
+from app.db.cache import create_ring
 from app.pusher.namespaces import root_namespace, user_namespace
 
 mgr = socketio.AsyncRedisManager(settings.PUSHER_REDIS_DSN)
@@ -13,10 +18,18 @@ sio.register_namespace(user_namespace)
 
 
 async def on_startup():
-    sio.cache = await aioredis.create_redis_pool(settings.PUSHER_REDIS_DSN)
+    if settings.CACHE_REDIS_NODES:
+        sio.cache = await create_ring(settings.CACHE_REDIS_NODES)
+    else:
+        sio.cache = await aioredis.create_redis_pool(settings.PUSHER_REDIS_DSN)
+    sio.lock = aioredlock.Aioredlock([settings.APP_REDIS_DSN])
+    sio.cache_listener = asyncio.ensure_future(crud.user_cache.listen(sio.cache))
 
 
 async def on_shutdown():
+    sio.cache_listener.cancel()
+    await asyncio.gather(sio.cache_listener, return_exceptions=True)
+    await sio.lock.destroy()
     sio.cache.close()
     await sio.cache.wait_closed()
 
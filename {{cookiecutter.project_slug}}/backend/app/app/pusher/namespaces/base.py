@@ -6,7 +6,7 @@ from socketio.exceptions import ConnectionRefusedError
 
 from app import schemas
 from app.api import deps
-from app.db.session import SessionLocal
+from app.db.session import AsyncSessionLocal
 
 
 class AuthenticatedNamespace(socketio.AsyncNamespace):
@@ -17,10 +17,10 @@ class AuthenticatedNamespace(socketio.AsyncNamespace):
         token = environ.get("HTTP_AUTHORIZATION")
         if token is None:
             raise ConnectionRefusedError("Not authenticated")
-        db = SessionLocal()
-        try:
-            return await deps.get_current_user(db, self.server.cache, token)
-        except HTTPException as e:
-            raise ConnectionRefusedError(e.detail)
-        finally:
-            db.close()
+        async with AsyncSessionLocal() as db:
+            try:
+                return await deps.get_current_user(
+                    db=db, cache=self.server.cache, lock=self.server.lock, token=token
+                )
+            except HTTPException as e:
+                raise ConnectionRefusedError(e.detail)
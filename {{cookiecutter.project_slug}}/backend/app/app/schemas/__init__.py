@@ -1,10 +1,19 @@
-from .item import Item, ItemCreate, ItemInDB, ItemUpdate
+from .batch import BatchRequest, BatchResponse
+from .item import (
+    Item,
+    ItemBatchCreate,
+    ItemBatchUpdate,
+    ItemCreate,
+    ItemInDB,
+    ItemUpdate,
+)
 from .msg import Msg
 from .token import Token, TokenPayload
 from .user import (
     UnprivilegedUserCreate,
     UnprivilegedUserUpdate,
     User,
+    UserBatchUpdate,
     UserCreate,
     UserInDB,
     UserUpdate,
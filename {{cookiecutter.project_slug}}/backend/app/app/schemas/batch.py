@@ -0,0 +1,18 @@
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+
+# API call of a batch, with a path relative to the API root
+class BatchRequest(BaseModel):
+    method: str = "GET"
+    path: str
+    headers: Dict[str, str] = {}
+    body: Optional[Any] = None
+
+
+# Answer to an API call of a batch
+class BatchResponse(BaseModel):
+    status: int
+    headers: Dict[str, str]
+    body: Optional[Any] = None
@@ -14,16 +14,27 @@ class ItemCreate(ItemBase):
     title: str
 
 
+# Properties to receive on batch item creation
+class ItemBatchCreate(ItemCreate):
+    owner_id: int
+
+
 # Properties to receive on item update
 class ItemUpdate(ItemBase):
     pass
 
 
+# Properties to receive on batch item update
+class ItemBatchUpdate(ItemUpdate):
+    id: int
+
+
 # Properties shared by models stored in DB
 class ItemInDBBase(ItemBase):
     id: int
     title: str
     owner_id: int
+    version: int
 
     class Config:
         orm_mode = True
@@ -64,8 +64,14 @@ class UserUpdate(UserBase):
         return v
 
 
+# Properties to receive via API on batch update
+class UserBatchUpdate(UserUpdate):
+    id: int
+
+
 class UserInDBBase(UserBase):
     id: int
+    version: int
 
     class Config:
         orm_mode = True
@@ -0,0 +1,105 @@
+import asyncio
+from typing import Dict
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.api.api_v1.endpoints import batch
+from app.core.config import settings
+from app.models.user import User
+from app.tests.utils.item import create_random_item
+
+
+def test_batch_answers_calls_in_order(
+    client: TestClient,
+    normal_user_token_headers: Dict[str, str],
+    normal_user: User,
+    db: Session,
+) -> None:
+    item = create_random_item(db, owner_id=normal_user.id)
+    calls = [
+        {"path": "/user"},
+        {"path": f"/items/{item.id}"},
+        {"path": "/items/?limit=1"},
+        {"method": "PUT", "path": f"/items/{item.id}", "body": {"title": "Batched"}},
+        {"path": "/admin/users/"},
+        {"path": "/no-such-path"},
+    ]
+    response = client.post(
+        f"{settings.API_V1_STR}/batch", headers=normal_user_token_headers, json=calls
+    )
+    assert response.status_code == 200
+    user, read, listed, updated, admin, missing = response.json()
+    assert user["status"] == 200
+    assert user["body"]["email"] == normal_user.email
+    assert read["status"] == 200
+    assert read["body"]["id"] == item.id
+    assert read["headers"]["etag"]
+    assert listed["status"] == 200
+    assert len(listed["body"]) == 1
+    assert updated["status"] == 200
+    assert updated["body"]["title"] == "Batched"
+    assert admin["status"] == 400
+    assert missing["status"] == 404
+
+
+def test_batch_limits(
+    client: TestClient, normal_user_token_headers: Dict[str, str]
+) -> None:
+    url = f"{settings.API_V1_STR}/batch"
+    calls = [{"path": "/user"}] * (settings.BATCH_MAX_REQUESTS + 1)
+    response = client.post(url, headers=normal_user_token_headers, json=calls)
+    assert response.status_code == 413
+    response = client.post(
+        url, headers=normal_user_token_headers, json=[{"path": "/batch"}]
+    )
+    assert response.status_code == 400
+    response = client.post(url, json=[{"path": "/user"}])
+    assert response.status_code == 401
+
+
+def test_batch_timeout_cancels_reads_only(
+    client: TestClient,
+    normal_user_token_headers: Dict[str, str],
+    normal_user: User,
+    db: Session,
+    monkeypatch,
+) -> None:
+    item = create_random_item(db, owner_id=normal_user.id)
+    get_multi_by_owner = crud.item_cachedb.get_multi_by_owner
+    update = crud.item_cachedb.update
+    reads = []
+
+    async def slow_read(*args, **kwargs):
+        reads.append(asyncio.current_task())
+        await asyncio.sleep(0.5)
+        return await get_multi_by_owner(*args, **kwargs)
+
+    async def slow_update(*args, **kwargs):
+        await asyncio.sleep(0.2)
+        return await update(*args, **kwargs)
+
+    monkeypatch.setattr(crud.item_cachedb, "get_multi_by_owner", slow_read)
+    monkeypatch.setattr(crud.item_cachedb, "update", slow_update)
+    monkeypatch.setattr(settings, "BATCH_TIMEOUT", 0.05)
+    url = f"{settings.API_V1_STR}/batch"
+    calls = [
+        {"path": "/items/"},
+        {"method": "PUT", "path": f"/items/{item.id}", "body": {"title": "Late"}},
+    ]
+    response = client.post(url, headers=normal_user_token_headers, json=calls)
+    read, write = response.json()
+    assert read == {"status": 504, "headers": {}, "body": {"detail": "Timed out"}}
+    assert reads[0].cancelled()
+    assert write["status"] == 504
+    assert "may still complete" in write["body"]["detail"]
+    assert len(batch.unfinished) == 1
+
+    # The write completes while the loop serves the next batch
+    monkeypatch.setattr(settings, "BATCH_TIMEOUT", 1.0)
+    response = client.post(url, headers=normal_user_token_headers, json=calls[:1])
+    assert response.json()[0]["status"] == 200
+    assert not batch.unfinished
+    db.refresh(item)
+    assert item.title == "Late"
@@ -1,11 +1,14 @@
 from typing import Dict
 
+import aioredlock
 import pytest
 from fastapi.testclient import TestClient
 from requests.exceptions import HTTPError
 from sqlalchemy.orm import Session
 
+from app import crud
 from app.core.config import settings
+from app.crud.base import encode_cursor
 from app.models.item import Item
 from app.models.user import User
 from app.tests.utils.item import create_random_item
@@ -105,3 +108,117 @@ def test_retrieve_items_by_owner(
     for item in all_items:
         assert "id" in item
         assert item["owner_id"] == normal_user.id
+
+
+def test_read_items_of_specific_user_with_cursor_by_superuser(
+    client: TestClient,
+    superuser_token_headers: Dict[str, str],
+    new_user: User,
+    db: Session,
+) -> None:
+    items = [create_random_item(db, owner_id=new_user.id) for _ in range(3)]
+    response = client.get(
+        f"{settings.API_V1_STR}/admin/items/",
+        headers=superuser_token_headers,
+        params={"owner_id": new_user.id, "limit": 2},
+    )
+    response.raise_for_status()
+    first_page = response.json()
+    assert [item["id"] for item in first_page] == [items[0].id, items[1].id]
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get(
+        f"{settings.API_V1_STR}/admin/items/",
+        headers=superuser_token_headers,
+        params={"owner_id": new_user.id, "limit": 2, "cursor": cursor},
+    )
+    response.raise_for_status()
+    second_page = response.json()
+    assert [item["id"] for item in second_page] == [items[2].id]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_read_items_with_invalid_cursor(
+    client: TestClient, normal_user_token_headers: Dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=normal_user_token_headers,
+        params={"cursor": "invalid"},
+    )
+    assert response.status_code == 400
+
+
+def test_read_items_with_cursor_of_wrong_types(
+    client: TestClient, superuser_token_headers: Dict[str, str]
+) -> None:
+    for cursor in (["x"], [True], [1.5]):
+        response = client.get(
+            f"{settings.API_V1_STR}/admin/items/",
+            headers=superuser_token_headers,
+            params={"cursor": encode_cursor(cursor)},
+        )
+        assert response.status_code == 400
+
+
+def test_item_etags(
+    client: TestClient, superuser_token_headers: Dict[str, str], new_item: Item
+) -> None:
+    url = f"{settings.API_V1_STR}/admin/items/{new_item.id}"
+    response = client.get(url, headers=superuser_token_headers)
+    etag = response.headers["ETag"]
+    response = client.get(
+        url, headers={**superuser_token_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    data = {"title": "Updated"}
+    response = client.put(
+        url, headers={**superuser_token_headers, "If-Match": etag}, json=data
+    )
+    assert response.status_code == 200
+    new_etag = response.headers["ETag"]
+    assert new_etag != etag
+    response = client.put(
+        url, headers={**superuser_token_headers, "If-Match": etag}, json=data
+    )
+    assert response.status_code == 412
+    response = client.put(
+        url, headers={**superuser_token_headers, "If-Match": etag}, json={}
+    )
+    assert response.status_code == 412
+    response = client.get(
+        url, headers={**superuser_token_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] == new_etag
+    assert response.json()["title"] == data["title"]
+
+
+def test_update_item_while_locked(
+    client: TestClient,
+    superuser_token_headers: Dict[str, str],
+    new_item: Item,
+    monkeypatch,
+) -> None:
+    async def locked(*args, **kwargs):
+        raise aioredlock.LockError("Taken")
+
+    monkeypatch.setattr(crud.item_cachedb, "lock", locked)
+    response = client.put(
+        f"{settings.API_V1_STR}/admin/items/{new_item.id}",
+        headers=superuser_token_headers,
+        json={"title": "Updated"},
+    )
+    assert response.status_code == 503
+
+
+def test_create_items_in_batch_with_unknown_owner(
+    client: TestClient, superuser_token_headers: Dict[str, str]
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/admin/items/batch",
+        headers=superuser_token_headers,
+        json=[{"title": "Orphan", "owner_id": -1}],
+    )
+    assert response.status_code == 400
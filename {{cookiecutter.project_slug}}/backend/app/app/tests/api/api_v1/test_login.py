@@ -1,10 +1,16 @@
+from datetime import timedelta
 from typing import Dict
 
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 
 from app import crud, models, utils
+from app.api import deps
+from app.core import security
 from app.core.config import settings
+from app.core.security import password_pool
 from app.tests.utils.utils import random_lower_string
 
 
@@ -20,6 +26,51 @@ def test_get_access_token(client: TestClient) -> None:
     assert tokens["access_token"]
 
 
+def test_login_rejected_when_password_pool_is_busy(
+    client: TestClient, superuser_token_headers: Dict[str, str], monkeypatch
+) -> None:
+    login_data = {
+        "username": settings.FIRST_SUPERUSER_USERNAME,
+        "password": settings.FIRST_SUPERUSER_PASSWORD,
+    }
+    monkeypatch.setattr(password_pool, "max_pending", 0)
+    response = client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    monkeypatch.undo()
+
+    response = client.get(
+        f"{settings.API_V1_STR}/utils/password-pool-stats/",
+        headers=superuser_token_headers,
+    )
+    stats = response.json()
+    assert stats["rejected"] >= 1
+    assert stats["calls"] >= 1
+    assert stats["run_seconds"] > 0
+
+
+def test_verified_tokens_are_cached_until_they_expire(monkeypatch) -> None:
+    decoded = []
+    decode = deps.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decoded.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(deps.jwt, "decode", counting_decode)
+    deps.token_cache.clear()
+    token = security.create_access_token(1)
+    assert deps.decode_token(token).sub == 1
+    assert deps.decode_token(token).sub == 1
+    assert decoded == [token]
+
+    expired_token = security.create_access_token(1, timedelta(seconds=-1))
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            deps.decode_token(expired_token)
+    assert decoded == [token, expired_token, expired_token]
+
+
 def test_use_access_token(
     client: TestClient, superuser_token_headers: Dict[str, str]
 ) -> None:
@@ -5,8 +5,10 @@ from fastapi.testclient import TestClient
 from requests.exceptions import HTTPError
 from sqlalchemy.orm import Session
 
-from app import crud
+from app import crud, schemas
+from app.api.responses import model_response
 from app.core.config import settings
+from app.core.security import password_pool
 from app.models.user import User
 from app.tests.utils.utils import random_email, random_lower_string
 
@@ -37,6 +39,32 @@ def test_get_user_by_normal_user(
     assert current_user["email"] == settings.EMAIL_TEST_USER
 
 
+def test_get_user_answers_only_public_fields(
+    client: TestClient, normal_user_token_headers: Dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/user", headers=normal_user_token_headers
+    )
+    assert list(response.json()) == list(schemas.User.__fields__)
+    with pytest.raises(TypeError):
+        model_response(schemas.User(**response.json()), schemas.UserInDB)
+
+
+def test_get_user_not_modified(
+    client: TestClient, normal_user_token_headers: Dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/user", headers=normal_user_token_headers
+    )
+    etag = response.headers["ETag"]
+    response = client.get(
+        f"{settings.API_V1_STR}/user",
+        headers={**normal_user_token_headers, "If-None-Match": f"W/{etag}"},
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+
 def test_create_new_user_by_superuser(
     client: TestClient, superuser_token_headers: Dict[str, str], db: Session
 ) -> None:
@@ -186,3 +214,143 @@ def test_retrieve_users(
         assert "email" in user
         assert "password" not in user
         assert "hashed_password" not in user
+
+
+def test_retrieve_users_with_cursor(
+    client: TestClient, superuser_token_headers: Dict[str, str], new_user: User
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/admin/users/",
+        headers=superuser_token_headers,
+        params={"limit": 1},
+    )
+    response.raise_for_status()
+    first_page = response.json()
+    assert len(first_page) == 1
+    response = client.get(
+        f"{settings.API_V1_STR}/admin/users/",
+        headers=superuser_token_headers,
+        params={"limit": 1, "cursor": response.headers["X-Next-Cursor"]},
+    )
+    response.raise_for_status()
+    second_page = response.json()
+    assert len(second_page) == 1
+    assert second_page[0]["id"] > first_page[0]["id"]
+
+
+def test_create_update_delete_users_in_batch(
+    client: TestClient, superuser_token_headers: Dict[str, str], db: Session
+) -> None:
+    data = [
+        {
+            "username": random_lower_string(),
+            "email": random_email(),
+            "password": random_lower_string(),
+        }
+        for _ in range(2)
+    ]
+    response = client.post(
+        f"{settings.API_V1_STR}/admin/users/batch",
+        headers=superuser_token_headers,
+        json=data,
+    )
+    response.raise_for_status()
+    created_users = response.json()
+    assert sorted(user["email"] for user in created_users) == sorted(
+        user["email"] for user in data
+    )
+    full_name = random_lower_string()
+    response = client.put(
+        f"{settings.API_V1_STR}/admin/users/batch",
+        headers=superuser_token_headers,
+        json=[{"id": user["id"], "full_name": full_name} for user in created_users],
+    )
+    response.raise_for_status()
+    assert all(user["full_name"] == full_name for user in response.json())
+    for created_user in created_users:
+        response = client.get(
+            f"{settings.API_V1_STR}/admin/users/{created_user['id']}",
+            headers=superuser_token_headers,
+        )
+        assert response.json()["full_name"] == full_name
+    response = client.delete(
+        f"{settings.API_V1_STR}/admin/users/batch",
+        headers=superuser_token_headers,
+        params={"ids": [user["id"] for user in created_users]},
+    )
+    response.raise_for_status()
+    for created_user in created_users:
+        assert crud.user.get(db, id=created_user["id"]) is None
+        response = client.get(
+            f"{settings.API_V1_STR}/admin/users/{created_user['id']}",
+            headers=superuser_token_headers,
+        )
+        assert response.status_code == 404
+
+
+def test_create_users_in_batch_with_duplicate_username(
+    client: TestClient, superuser_token_headers: Dict[str, str], normal_user: User
+) -> None:
+    data = [
+        {
+            "username": normal_user.username,
+            "email": random_email(),
+            "password": random_lower_string(),
+        }
+    ]
+    response = client.post(
+        f"{settings.API_V1_STR}/admin/users/batch",
+        headers=superuser_token_headers,
+        json=data,
+    )
+    assert response.status_code == 400
+
+
+def test_create_users_in_batch_within_limits(
+    client: TestClient, superuser_token_headers: Dict[str, str], monkeypatch
+) -> None:
+    data = [
+        {
+            "username": random_lower_string(),
+            "email": random_email(),
+            "password": random_lower_string(),
+        }
+        for _ in range(2)
+    ]
+    monkeypatch.setattr(settings, "BATCH_MAX_RECORDS", 1)
+    response = client.post(
+        f"{settings.API_V1_STR}/admin/users/batch",
+        headers=superuser_token_headers,
+        json=data,
+    )
+    assert response.status_code == 413
+    monkeypatch.undo()
+    # Every password to hash counts against the pool
+    monkeypatch.setattr(password_pool, "max_pending", 1)
+    response = client.post(
+        f"{settings.API_V1_STR}/admin/users/batch",
+        headers=superuser_token_headers,
+        json=data,
+    )
+    assert response.status_code == 503
+
+
+def test_retrieve_users_by_ids(
+    client: TestClient,
+    superuser_token_headers: Dict[str, str],
+    new_user: User,
+    superuser: User,
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/admin/users/",
+        headers=superuser_token_headers,
+        params={"ids": [new_user.id, superuser.id]},
+    )
+    response.raise_for_status()
+    assert [user["id"] for user in response.json()] == [new_user.id, superuser.id]
+    response = client.get(
+        f"{settings.API_V1_STR}/admin/users/",
+        headers=superuser_token_headers,
+        params={"ids": [new_user.id] * (settings.BATCH_MAX_RECORDS + 1)},
+    )
+    assert response.status_code == 413
@@ -0,0 +1,39 @@
+from typing import Dict
+
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+
+def test_metrics_count_requests_by_route(
+    client: TestClient,
+    normal_user_token_headers: Dict[str, str],
+    superuser_token_headers: Dict[str, str],
+) -> None:
+    client.get(f"{settings.API_V1_STR}/user", headers=normal_user_token_headers)
+    client.get(f"{settings.API_V1_STR}/items/0", headers=normal_user_token_headers)
+    client.get("/no-such-path")
+    response = client.get("/metrics", headers=superuser_token_headers)
+    assert response.status_code == 200
+    metrics = response.text
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/api/v1/user"}'
+        in metrics
+    )
+    assert (
+        'http_requests_total{method="GET",route="/api/v1/items/{id}",status="404"}'
+        in metrics
+    )
+    assert 'route="unmatched",status="404"' in metrics
+    assert "http_requests_in_flight 1.0" in metrics
+    assert 'db_pool_connections{engine="async",state="checked_out"}' in metrics
+    assert 'redis_pool_connections{state="open"}' in metrics
+    assert 'redis_command_duration_seconds_count{command="EXISTS"}' in metrics
+
+
+def test_metrics_need_a_superuser(
+    client: TestClient, normal_user_token_headers: Dict[str, str]
+) -> None:
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers=normal_user_token_headers)
+    assert response.status_code == 400
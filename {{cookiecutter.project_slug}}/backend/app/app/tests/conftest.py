@@ -4,11 +4,12 @@ from typing import Dict, Generator
 import aioredis
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app import crud
 from app.core.config import settings
-from app.db.session import SessionLocal
+from app.db.session import AsyncSessionLocal, SessionLocal
 from app.main import app
 from app.models.item import Item
 from app.models.user import User
@@ -31,6 +32,12 @@ def db() -> Generator:
     db.close()
 
 
+@pytest.fixture(scope="session")
+async def async_db() -> AsyncSession:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 @pytest.fixture(scope="session")
 async def redis() -> aioredis.Redis:
     cache = await aioredis.create_redis_pool(settings.APP_REDIS_DSN)
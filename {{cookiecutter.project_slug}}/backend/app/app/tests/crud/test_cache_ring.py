@@ -0,0 +1,101 @@
+from typing import AsyncGenerator
+
+import aioredis
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.core.config import settings
+from app.db.cache import RedisRing, create_ring, hash_tag
+from app.tests.utils.user import create_random_user
+
+# Databases of the test Redis standing in for separate nodes
+RING_DATABASES = [13, 14, 15]
+
+
+@pytest.fixture(scope="module")
+async def ring() -> AsyncGenerator:
+    server = str(settings.APP_REDIS_DSN).rsplit("/", 1)[0]
+    ring = await create_ring([f"{server}/{db}" for db in RING_DATABASES])
+    yield ring
+    ring.close()
+    await ring.wait_closed()
+
+
+def test_ring_moves_few_keys_when_a_node_is_added() -> None:
+    nodes = {name: None for name in ("a", "b", "c")}
+    ring = RedisRing(nodes)  # type: ignore
+    keys = [f"user:{id}" for id in range(3000)]
+    names = [ring.name(key) for key in keys]
+    assert all(names.count(name) > 500 for name in nodes)
+
+    grown_ring = RedisRing({**nodes, "d": None})  # type: ignore
+    moved = [
+        grown_ring.name(key)
+        for key, name in zip(keys, names)
+        if grown_ring.name(key) != name
+    ]
+    assert set(moved) == {"d"}
+    assert 300 < len(moved) < 1200
+
+
+def test_ring_places_keys_by_hash_tag() -> None:
+    ring = RedisRing({name: None for name in ("a", "b", "c")})  # type: ignore
+    assert len({ring.name(f"user:{id}") for id in range(100)}) == 3
+    assert len({ring.name(f"{{user}}:{id}") for id in range(100)}) == 1
+    assert ring.name("{user}:1") == ring.name("user")
+    # Empty tags don't count
+    assert hash_tag("{}:1") == "{}:1"
+    assert hash_tag("a{b}c{d}") == "b"
+
+
+@pytest.mark.asyncio
+async def test_cache_records_sharded_over_ring(
+    ring: RedisRing, async_db: AsyncSession, db: Session
+) -> None:
+    users = [create_random_user(db) for _ in range(12)]
+    ids = [user.id for user in users]
+    await crud.user_cache.add_many_models(ring, objs_in=users)
+
+    holders = set()
+    for user in users:
+        key = crud.user_cache.to_key(user.id)
+        for name, node in ring.nodes.items():
+            if await node.exists(key):
+                holders.add(name)
+                assert node is ring.node(key)
+    # Users have indexes, so they live with them on one node
+    assert holders == {ring.name(crud.user_cache.index_shard_key)}
+
+    records = await crud.user_cache.get_many(ring, ids=ids)
+    assert [record.id for record in records] == ids
+    assert await crud.user_cache.exists_many(ring, ids=ids) == [True] * len(ids)
+    assert (
+        await crud.user_cache.get_id_by_index(ring, field="email", value=users[0].email)
+        == users[0].id
+    )
+
+    await crud.user_cache.remove_many(ring, ids=ids)
+    assert await crud.user_cache.get_many(ring, ids=ids) == [None] * len(ids)
+    assert (
+        await crud.user_cache.get_id_by_index(ring, field="email", value=users[0].email)
+        is None
+    )
+
+    user = await crud.user_cachedb.get(async_db, ring, id=users[0].id)
+    assert user.email == users[0].email
+    node = ring.node(crud.user_cache.to_key(user.id))
+    assert await node.exists(crud.user_cache.to_key(user.id))
+
+
+@pytest.mark.asyncio
+async def test_cache_ring_keeps_missing_markers_with_records(
+    ring: RedisRing, redis: aioredis.Redis, db: Session
+) -> None:
+    user = create_random_user(db)
+    await crud.user_cache.add_missing(ring, id=user.id)
+    assert await crud.user_cache.is_missing(ring, id=user.id)
+    await crud.user_cache.add_model(ring, obj_in=user)
+    assert not await crud.user_cache.is_missing(ring, id=user.id)
+    assert not await redis.exists(crud.user_cache.to_key(user.id))
@@ -0,0 +1,120 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+import aioredis
+import pytest
+from pydantic import BaseModel
+
+from app.crud.base import CRUDCacheBase
+from app.crud.codecs import COMPRESSED, JSONCodec, PackedCodec
+from app.crud.crud_user import CRUDCacheUser
+from app.models import User
+from app.schemas.user import UserInDB
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+def random_record() -> UserInDB:
+    return UserInDB(
+        id=1,
+        version=1,
+        username=random_lower_string(),
+        email=random_email(),
+        hashed_password=random_lower_string(),
+    )
+
+
+@pytest.mark.parametrize("codec_class", [JSONCodec, PackedCodec])
+def test_codec_round_trip(codec_class) -> None:
+    codec = codec_class(UserInDB)
+    record = random_record()
+    assert codec.decode(codec.encode(record)) == record
+    fields = {key.encode(): value for key, value in codec.encode_fields(record).items()}
+    assert codec.decode_fields(fields) == record
+
+
+@pytest.mark.parametrize("codec_class", [JSONCodec, PackedCodec])
+def test_codec_compresses_large_values(codec_class) -> None:
+    codec = codec_class(UserInDB, compress_threshold=400)
+    record = random_record()
+    assert not codec.encode(record).startswith(COMPRESSED)
+    record.full_name = "Lorem ipsum dolor sit amet " * 20
+    data = codec.encode(record)
+    assert data.startswith(COMPRESSED)
+    assert len(data) < len(codec_class(UserInDB).encode(record))
+    assert codec.decode(data) == record
+    # Values written before compression was enabled
+    assert codec.decode(codec_class(UserInDB).encode(record)) == record
+    fields = {key.encode(): value for key, value in codec.encode_fields(record).items()}
+    assert fields[b"full_name"].startswith(COMPRESSED)
+    assert codec.decode_fields(fields) == record
+
+
+def test_packed_codec_ignores_other_schema_versions() -> None:
+    class OtherUser(UserInDB):
+        nickname: str = ""
+
+    record = random_record()
+    data = PackedCodec(OtherUser).encode(OtherUser(**record.dict()))
+    assert PackedCodec(UserInDB).decode(data) is None
+    assert len(PackedCodec(UserInDB).encode(record)) < len(record.json())
+
+
+@pytest.mark.parametrize(
+    "codec_class,other_codec_class",
+    [(JSONCodec, PackedCodec), (PackedCodec, JSONCodec)],
+)
+def test_codec_reads_values_of_the_other_codec_as_misses(
+    codec_class, other_codec_class
+) -> None:
+    codec = codec_class(UserInDB)
+    assert codec.decode(other_codec_class(UserInDB).encode(random_record())) is None
+    assert codec.decode(b"42") is None
+
+
+def test_packed_codec_encodes_unknown_types() -> None:
+    class Record(BaseModel):
+        id: int
+        created: datetime
+        price: Decimal
+
+    record = Record(id=1, created=datetime.utcnow(), price=Decimal("9.99"))
+    assert PackedCodec(Record).decode(PackedCodec(Record).encode(record)) == record
+
+
+class Note(BaseModel):
+    id: int
+    title: str
+    text: Optional[str] = None
+
+
+@pytest.mark.asyncio
+async def test_hash_storage_fields(redis: aioredis.Redis) -> None:
+    note_cache = CRUDCacheBase(
+        Note, "note", codec=PackedCodec(Note), hash_storage=True, indexes=["title"]
+    )
+    record = Note(id=1, title=random_lower_string())
+    await note_cache.add(redis, obj_in=record, expire=60)
+    assert await note_cache.get(redis, id=record.id) == record
+    assert await note_cache.get_field(redis, id=record.id, field="title") == (
+        record.title
+    )
+    text = random_lower_string()
+    assert await note_cache.update_fields(redis, id=record.id, obj_in={"text": text})
+    cached_record = await note_cache.get(redis, id=record.id)
+    assert cached_record.text == text
+    assert cached_record.title == record.title
+    with pytest.raises(ValueError):
+        await note_cache.update_fields(redis, id=record.id, obj_in={"title": text})
+    await note_cache.remove(redis, id=record.id)
+    assert not await note_cache.update_fields(
+        redis, id=record.id, obj_in={"text": text}
+    )
+    assert not await note_cache.exists(redis, id=record.id)
+
+    # Versioned records would change without a new version
+    user_cache = CRUDCacheUser(
+        UserInDB, f"{User.__tablename__}:packed", hash_storage=True
+    )
+    with pytest.raises(ValueError):
+        await user_cache.update_fields(redis, id=1, obj_in={"full_name": text})
@@ -1,9 +1,15 @@
+import aioredis
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app import crud
+from app.crud.base import TAG_ALL
+from app.crud.crud_item import CRUDDBCacheItem
+from app.db.session import AsyncSessionLocal
 from app.models.item import Item
 from app.models.user import User
-from app.schemas.item import ItemCreate, ItemUpdate
+from app.schemas.item import ItemBatchCreate, ItemCreate, ItemInDB, ItemUpdate
 from app.tests.utils.user import create_random_user
 from app.tests.utils.utils import random_lower_string
 
@@ -50,3 +56,205 @@ def test_delete_item(db: Session) -> None:
     assert item2.title == title
     assert item2.description == description
     assert item2.owner_id == user.id
+
+
+@pytest.mark.asyncio
+async def test_create_update_remove_many_items(
+    async_db: AsyncSession, new_user: User
+) -> None:
+    items_in = [
+        ItemBatchCreate(title=random_lower_string(), owner_id=new_user.id)
+        for _ in range(3)
+    ]
+    items = await crud.item.acreate_many(async_db, objs_in=items_in)
+    assert [item.title for item in items] == [item_in.title for item_in in items_in]
+    assert all(item.owner_id == new_user.id for item in items)
+    description = random_lower_string()
+    updated_items = await crud.item.aupdate_many(
+        async_db,
+        objs_in={item.id: ItemUpdate(description=description) for item in items},
+    )
+    assert sorted(item.id for item in updated_items) == sorted(
+        item.id for item in items
+    )
+    assert all(item.description == description for item in updated_items)
+    removed_items = await crud.item.aremove_many(
+        async_db, ids=[item.id for item in items]
+    )
+    assert len(removed_items) == 3
+    assert await crud.item.aget_multi_by_owner(async_db, owner_id=new_user.id) == []
+
+
+@pytest.mark.asyncio
+async def test_cachedb_owner_items_follow_writes(
+    async_db: AsyncSession, redis: aioredis.Redis, new_user: User
+) -> None:
+    first = await crud.item_cachedb.create_with_owner(
+        async_db,
+        redis,
+        obj_in=ItemCreate(title=random_lower_string()),
+        owner_id=new_user.id,
+    )
+    items, _ = await crud.item_cachedb.get_multi_by_owner(
+        async_db, redis, owner_id=new_user.id
+    )
+    assert [item.id for item in items] == [first.id]
+    second = await crud.item_cachedb.create_with_owner(
+        async_db,
+        redis,
+        obj_in=ItemCreate(title=random_lower_string()),
+        owner_id=new_user.id,
+    )
+    assert await crud.item_cache.get_owner_ids(redis, owner_id=new_user.id) == [
+        first.id,
+        second.id,
+    ]
+    items, next_cursor = await crud.item_cachedb.get_multi_by_owner(
+        async_db, redis, owner_id=new_user.id, limit=1
+    )
+    assert [item.id for item in items] == [first.id]
+    items, _ = await crud.item_cachedb.get_multi_by_owner(
+        async_db, redis, owner_id=new_user.id, cursor=next_cursor
+    )
+    assert [item.id for item in items] == [second.id]
+    await crud.item_cachedb.remove(async_db, redis, id=first.id)
+    items, _ = await crud.item_cachedb.get_multi_by_owner(
+        async_db, redis, owner_id=new_user.id
+    )
+    assert [item.id for item in items] == [second.id]
+    assert await crud.item_cache.get(redis, id=first.id) is None
+    # A second delete, e.g. of a concurrent request, finds nothing
+    assert await crud.item_cachedb.remove(async_db, redis, id=first.id) is None
+
+
+@pytest.mark.asyncio
+async def test_cachedb_owner_items_rebuild_yields_to_concurrent_writes(
+    async_db: AsyncSession, redis: aioredis.Redis, new_user: User, monkeypatch
+) -> None:
+    aget_ids_by_owner = crud.item.aget_ids_by_owner
+    created = []
+
+    async def create_during_rebuild(*args, **kwargs):
+        ids = await aget_ids_by_owner(*args, **kwargs)
+        # Another request creates an item before the rebuilt ids are published
+        async with AsyncSessionLocal() as db:
+            created.append(
+                await crud.item_cachedb.create_with_owner(
+                    db,
+                    redis,
+                    obj_in=ItemCreate(title=random_lower_string()),
+                    owner_id=new_user.id,
+                )
+            )
+        return ids
+
+    await redis.delete(crud.item_cache.to_owner_key(new_user.id))
+    monkeypatch.setattr(crud.item, "aget_ids_by_owner", create_during_rebuild)
+    items, _ = await crud.item_cachedb.get_multi_by_owner(
+        async_db, redis, owner_id=new_user.id
+    )
+    assert items == []
+    assert await crud.item_cache.get_owner_ids(redis, owner_id=new_user.id) is None
+    monkeypatch.setattr(crud.item, "aget_ids_by_owner", aget_ids_by_owner)
+    items, _ = await crud.item_cachedb.get_multi_by_owner(
+        async_db, redis, owner_id=new_user.id
+    )
+    assert [item.id for item in items] == [created[0].id]
+
+
+@pytest.mark.asyncio
+async def test_cachedb_query_results_follow_tagged_writes(
+    async_db: AsyncSession, redis: aioredis.Redis, db: Session, new_user: User
+) -> None:
+    item_cache = crud.item_cache
+    item_cachedb = CRUDDBCacheItem(crud.item, item_cache, expire=60, query_expire=60)
+    other_user = create_random_user(db)
+    queries = []
+
+    async def query():
+        queries.append(new_user.id)
+        items = await crud.item.aget_multi_by_owner(async_db, owner_id=new_user.id)
+        return items, None
+
+    async def owner_item_ids():
+        items, _ = await item_cachedb.get_query(
+            async_db,
+            redis,
+            name="by_owner",
+            params={"owner_id": new_user.id},
+            tags=[f"owner_id:{new_user.id}"],
+            query=query,
+        )
+        return [item.id for item in items]
+
+    async def create_item(owner_id: int) -> ItemInDB:
+        return await item_cachedb.create_with_owner(
+            async_db,
+            redis,
+            obj_in=ItemCreate(title=random_lower_string()),
+            owner_id=owner_id,
+        )
+
+    first = await create_item(new_user.id)
+    assert await owner_item_ids() == [first.id]
+    assert await owner_item_ids() == [first.id]
+    assert len(queries) == 1
+
+    generation = int(await redis.get(item_cache.to_tag_key(TAG_ALL)))
+    await create_item(other_user.id)
+    assert int(await redis.get(item_cache.to_tag_key(TAG_ALL))) == generation + 1
+    assert await owner_item_ids() == [first.id]
+    assert len(queries) == 1
+
+    second = await create_item(new_user.id)
+    assert await owner_item_ids() == [first.id, second.id]
+    await item_cachedb.remove(async_db, redis, id=first.id)
+    assert await owner_item_ids() == [second.id]
+    assert len(queries) == 3
+
+
+@pytest.mark.asyncio
+async def test_cachedb_writes_publish_to_change_feed(
+    async_db: AsyncSession, redis: aioredis.Redis, new_user: User
+) -> None:
+    group = random_lower_string()
+    await crud.item_cache.create_consumer_group(redis, group=group)
+    item = await crud.item_cachedb.create_with_owner(
+        async_db,
+        redis,
+        obj_in=ItemCreate(title=random_lower_string()),
+        owner_id=new_user.id,
+    )
+    description = random_lower_string()
+    await crud.item_cachedb.update(
+        async_db, redis, cache_obj=item, obj_in={"description": description}
+    )
+    await crud.item_cachedb.remove(async_db, redis, id=item.id)
+
+    changes = await crud.item_cache.read_group_changes(
+        redis, group=group, consumer="test"
+    )
+    assert [(change.op, change.id) for change in changes] == [
+        ("create", item.id),
+        ("update", item.id),
+        ("remove", item.id),
+    ]
+    assert changes[1].record.description == description
+    assert changes[2].record is None
+    assert (
+        await crud.item_cache.read_group_changes(
+            redis, group=group, consumer="test", pending=True
+        )
+        == changes
+    )
+    await crud.item_cache.ack_changes(redis, group=group, changes=changes)
+    assert (
+        await crud.item_cache.read_group_changes(
+            redis, group=group, consumer="test", pending=True
+        )
+        == []
+    )
+    replayed = await crud.item_cache.read_changes(
+        redis, after=changes[0].entry_id, count=2
+    )
+    assert replayed == changes[1:]
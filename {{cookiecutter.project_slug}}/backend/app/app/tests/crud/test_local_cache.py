@@ -0,0 +1,23 @@
+import time
+
+from app.crud.local_cache import LocalCache
+
+
+def test_local_cache_evicts_least_recently_used() -> None:
+    cache = LocalCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"hits": 3, "misses": 1, "invalidations": 0, "size": 2}
+
+
+def test_local_cache_expires_entries() -> None:
+    cache = LocalCache(ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
@@ -1,18 +1,31 @@
+import asyncio
+
 import aioredis
+import aioredlock
 import pytest
 from fastapi.encoders import jsonable_encoder
 from pydantic import ValidationError
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 
 from app import crud
+from app.core.config import settings
 from app.core.security import verify_password
+from app.crud.base import CHANGE_UPDATE
+from app.crud.crud_user import CRUDCacheUser, CRUDDBCacheUser
+from app.crud.local_cache import LocalCache
+from app.db.session import AsyncSessionLocal, LazySession, async_engine
 from app.models import User
 from app.schemas.user import (
     UnprivilegedUserCreate,
     UnprivilegedUserUpdate,
     UserCreate,
+    UserInDB,
     UserUpdate,
 )
+from app.tests.utils.user import create_random_user
 from app.tests.utils.utils import random_email, random_lower_string
 
 
@@ -98,12 +111,14 @@ def test_update_user(db: Session, new_user: User) -> None:
 
 
 @pytest.mark.asyncio
-async def test_cachedb_create_user(db: Session, redis: aioredis.Redis):
+async def test_cachedb_create_user(
+    async_db: AsyncSession, db: Session, redis: aioredis.Redis
+):
     username = random_lower_string()
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(username=username, email=email, password=password)
-    user = await crud.user_cachedb.create(db, redis, obj_in=user_in)
+    user = await crud.user_cachedb.create(async_db, redis, obj_in=user_in)
     db_user = crud.user.get(db, id=user.id)
     assert user.username == db_user.username == username
     assert user.email == db_user.email == email
@@ -112,8 +127,10 @@ async def test_cachedb_create_user(db: Session, redis: aioredis.Redis):
 
 
 @pytest.mark.asyncio
-async def test_cachedb_get_user(db: Session, redis: aioredis.Redis, new_user: User):
-    user = await crud.user_cachedb.get(db, redis, id=new_user.id)
+async def test_cachedb_get_user(
+    async_db: AsyncSession, redis: aioredis.Redis, new_user: User
+):
+    user = await crud.user_cachedb.get(async_db, redis, id=new_user.id)
     assert user
     assert user.username == new_user.username
     assert user.email == new_user.email
@@ -121,13 +138,18 @@ async def test_cachedb_get_user(db: Session, redis: aioredis.Redis, new_user: Us
 
 
 @pytest.mark.asyncio
-async def test_cachedb_update_user(db: Session, redis: aioredis.Redis, new_user: User):
-    user = await crud.user_cachedb.get(db, redis, id=new_user.id)
+async def test_cachedb_update_user(
+    async_db: AsyncSession, db: Session, redis: aioredis.Redis, new_user: User
+):
+    user = await crud.user_cachedb.get(async_db, redis, id=new_user.id)
     new_password = random_lower_string()
     user_in_update = UserUpdate(password=new_password)
-    await crud.user_cachedb.update(db, redis, cache_obj=user, obj_in=user_in_update)
-    user = await crud.user_cachedb.get(db, redis, id=new_user.id)
+    await crud.user_cachedb.update(
+        async_db, redis, cache_obj=user, obj_in=user_in_update
+    )
+    user = await crud.user_cachedb.get(async_db, redis, id=new_user.id)
     db_user = crud.user.get(db, id=new_user.id)
+    db.refresh(db_user)
     assert user
     assert user.username == new_user.username
     assert user.email == new_user.email
@@ -149,3 +171,402 @@ def test_update_user_password_to_empty_is_not_allowed():
         UserUpdate(password=None)
     with pytest.raises(ValidationError):
         UnprivilegedUserUpdate(password=None)
+
+
+@pytest.mark.asyncio
+async def test_cachedb_get_many_users(
+    async_db: AsyncSession, redis: aioredis.Redis, db: Session
+):
+    cached_user = create_random_user(db)
+    uncached_user = create_random_user(db)
+    await crud.user_cachedb.get(async_db, redis, id=cached_user.id)
+    await crud.user_cache.remove(redis, id=uncached_user.id)
+    missing_id = uncached_user.id + 1000000
+    users = await crud.user_cachedb.get_many(
+        async_db, redis, ids=[uncached_user.id, missing_id, cached_user.id]
+    )
+    assert [user.id for user in users] == [uncached_user.id, cached_user.id]
+    assert await crud.user_cache.exists(redis, id=uncached_user.id)
+
+
+@pytest.mark.asyncio
+async def test_cachedb_warm_users(
+    async_db: AsyncSession, redis: aioredis.Redis, db: Session
+):
+    users = [create_random_user(db) for _ in range(3)]
+    for user in users:
+        await crud.user_cache.remove(redis, id=user.id)
+    warmed = await crud.user_cachedb.warm(async_db, redis, chunk_size=2)
+    assert warmed >= len(users)
+    for user in users:
+        cached_user = await crud.user_cache.get(redis, id=user.id)
+        assert cached_user
+        assert cached_user.email == user.email
+        assert await redis.ttl(crud.user_cache.to_key(user.id)) > 0
+        await redis.expire(crud.user_cache.to_key(user.id), 10 ** 6)
+    # Records cached by earlier tests may expire meanwhile, so only check that
+    # these ones are not written again
+    await crud.user_cachedb.warm(async_db, redis, chunk_size=2)
+    for user in users:
+        assert await redis.ttl(crud.user_cache.to_key(user.id)) > 10 ** 6 - 60
+
+
+@pytest.mark.asyncio
+async def test_cachedb_warm_fails_with_its_chunks(
+    async_db: AsyncSession, redis: aioredis.Redis, monkeypatch
+):
+    async def failing_exists_many(*args, **kwargs):
+        raise ConnectionError("Redis went away")
+
+    monkeypatch.setattr(crud.user_cache, "exists_many", failing_exists_many)
+    with pytest.raises(ConnectionError):
+        await crud.user_cachedb.warm(async_db, redis, chunk_size=2)
+
+
+@pytest.mark.asyncio
+async def test_local_cache_invalidated_across_workers(
+    redis: aioredis.Redis, new_user: User
+):
+    writer = CRUDCacheUser(UserInDB, User.__tablename__, local_cache=LocalCache())
+    reader = CRUDCacheUser(UserInDB, User.__tablename__, local_cache=LocalCache())
+    subscriber = await aioredis.create_redis_pool(settings.APP_REDIS_DSN)
+    listener = asyncio.ensure_future(reader.listen(subscriber))
+    try:
+        await asyncio.sleep(0.1)
+        await writer.add_model(redis, obj_in=new_user)
+        await asyncio.sleep(0.1)
+        user = await reader.get(redis, id=new_user.id)
+        assert await reader.get(redis, id=new_user.id) is user
+        assert reader.local_cache.stats()["hits"] == 1
+        new_username = random_lower_string()
+        await writer.update(redis, cache_obj=user, obj_in={"username": new_username})
+        await asyncio.sleep(0.1)
+        user = await reader.get(redis, id=new_user.id)
+        assert user.username == new_username
+        assert reader.local_cache.stats()["invalidations"] == 1
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        subscriber.close()
+        await subscriber.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_cachedb_coalesces_concurrent_misses(
+    async_db: AsyncSession, redis: aioredis.Redis, new_user: User, monkeypatch
+):
+    loads = []
+    aget = crud.user.aget
+
+    async def counting_aget(*args, **kwargs):
+        loads.append(args)
+        return await aget(*args, **kwargs)
+
+    monkeypatch.setattr(crud.user, "aget", counting_aget)
+    await crud.user_cache.remove(redis, id=new_user.id)
+    users = await asyncio.gather(
+        *(crud.user_cachedb.get(async_db, redis, id=new_user.id) for _ in range(5))
+    )
+    assert [user.id for user in users] == [new_user.id] * 5
+    assert len(loads) == 1
+
+
+@pytest.mark.asyncio
+async def test_cachedb_coalesced_load_outlives_first_request(
+    async_db: AsyncSession, redis: aioredis.Redis, new_user: User, monkeypatch
+):
+    sessions = []
+    aget = crud.user.aget
+
+    async def slow_aget(db, *args, **kwargs):
+        sessions.append(db)
+        await asyncio.sleep(0.05)
+        return await aget(db, *args, **kwargs)
+
+    monkeypatch.setattr(crud.user, "aget", slow_aget)
+    await crud.user_cache.remove(redis, id=new_user.id)
+    first = asyncio.ensure_future(
+        crud.user_cachedb.get(async_db, redis, id=new_user.id)
+    )
+    second = asyncio.ensure_future(
+        crud.user_cachedb.get(async_db, redis, id=new_user.id)
+    )
+    await asyncio.sleep(0.01)
+    # The first request goes away, its dependencies will close its session
+    first.cancel()
+    user = await second
+    assert user.id == new_user.id
+    assert len(sessions) == 1 and sessions[0] is not async_db
+
+
+@pytest.mark.asyncio
+async def test_cachedb_lease_shares_load_across_workers(
+    async_db: AsyncSession, redis: aioredis.Redis, new_user: User, monkeypatch
+):
+    loads = []
+    aget = crud.user.aget
+
+    async def slow_aget(*args, **kwargs):
+        loads.append(args)
+        await asyncio.sleep(0.05)
+        return await aget(*args, **kwargs)
+
+    monkeypatch.setattr(crud.user, "aget", slow_aget)
+    workers = [
+        CRUDDBCacheUser(crud.user, crud.user_cache, expire=60, lease_timeout=5)
+        for _ in range(2)
+    ]
+    lock_manager = aioredlock.Aioredlock([redis])
+    await crud.user_cache.remove(redis, id=new_user.id)
+    users = await asyncio.gather(
+        *(
+            worker.get(async_db, redis, id=new_user.id, lock_manager=lock_manager)
+            for worker in workers
+        )
+    )
+    assert [user.id for user in users] == [new_user.id] * 2
+    assert len(loads) == 1
+
+
+@pytest.mark.asyncio
+async def test_cachedb_lookups_served_from_indexes(
+    async_db: AsyncSession, redis: aioredis.Redis, monkeypatch
+):
+    user_in = UserCreate(
+        username=random_lower_string(),
+        email=random_email(),
+        password=random_lower_string(),
+    )
+    user = await crud.user_cachedb.create(async_db, redis, obj_in=user_in)
+    lookups = []
+
+    async def counting_lookup(*args, **kwargs):
+        lookups.append(kwargs)
+        return None
+
+    monkeypatch.setattr(crud.user, "aget_by_username", counting_lookup)
+    monkeypatch.setattr(crud.user, "aget_by_email", counting_lookup)
+    cached_user = await crud.user_cachedb.get_by_username(
+        async_db, redis, username=user_in.username
+    )
+    assert cached_user.id == user.id
+    cached_user = await crud.user_cachedb.get_by_email(
+        async_db, redis, email=user_in.email
+    )
+    assert cached_user.id == user.id
+    assert lookups == []
+
+    new_username = random_lower_string()
+    await crud.user_cachedb.update(
+        async_db, redis, cache_obj=user, obj_in={"username": new_username}
+    )
+    assert not await redis.exists(
+        crud.user_cache.to_index_key("username", user_in.username)
+    )
+    renamed_user = await crud.user_cachedb.get_by_username(
+        async_db, redis, username=new_username
+    )
+    assert renamed_user.id == user.id
+    assert lookups == []
+
+    await crud.user_cachedb.remove(async_db, redis, id=user.id)
+    assert not await redis.exists(
+        crud.user_cache.to_index_key("username", new_username),
+        crud.user_cache.to_index_key("email", user_in.email),
+        crud.user_cache.to_index_hash_key(user.id),
+    )
+
+
+@pytest.mark.asyncio
+async def test_cache_unindex_refuses_keys_outside_the_indexes(redis: aioredis.Redis):
+    user = await crud.user_cache.create(
+        redis,
+        obj_in=UserInDB(
+            id=-7,
+            version=1,
+            username=random_lower_string(),
+            email=random_email(),
+            hashed_password=random_lower_string(),
+        ),
+    )
+    # An entry naming another record's key, holding the id the scripts compare
+    other_key = crud.user_cache.to_key(-8)
+    await redis.set(other_key, str(user.id))
+    hash_key = crud.user_cache.to_index_hash_key(user.id)
+    await redis.hset(hash_key, "username", other_key)
+    with pytest.raises(aioredis.errors.MultiExecError):
+        await crud.user_cache.remove(redis, id=user.id)
+    assert await redis.exists(other_key, hash_key) == 2
+    await redis.delete(other_key, hash_key)
+
+
+@pytest.mark.asyncio
+async def test_cachedb_remembers_missing_users(
+    async_db: AsyncSession, redis: aioredis.Redis, new_user: User, monkeypatch
+):
+    missing_id = new_user.id + 1000000
+    await redis.delete(crud.user_cache.to_missing_key(missing_id))
+    assert await crud.user_cachedb.get(async_db, redis, id=missing_id) is None
+    assert await crud.user_cache.is_missing(redis, id=missing_id)
+    loads = []
+
+    async def counting_aget(*args, **kwargs):
+        loads.append(args)
+        return None
+
+    monkeypatch.setattr(crud.user, "aget", counting_aget)
+    assert await crud.user_cachedb.get(async_db, redis, id=missing_id) is None
+    assert loads == []
+
+    await crud.user_cache.add_missing(redis, id=new_user.id)
+    await crud.user_cache.add_model(redis, obj_in=new_user)
+    assert not await crud.user_cache.is_missing(redis, id=new_user.id)
+
+
+@pytest.mark.asyncio
+async def test_cachedb_jitters_expire(redis: aioredis.Redis, db: Session):
+    users = [create_random_user(db) for _ in range(5)]
+    user_cachedb = CRUDDBCacheUser(
+        crud.user, crud.user_cache, expire=1000, expire_jitter=0.5
+    )
+    await user_cachedb.cache_models(redis, db_objs=users)
+    ttls = {await redis.ttl(crud.user_cache.to_key(user.id)) for user in users}
+    assert all(500 <= ttl <= 1000 for ttl in ttls)
+    assert len(ttls) > 1
+
+
+@pytest.mark.asyncio
+async def test_cachedb_refreshes_ahead_of_expiry(
+    async_db: AsyncSession, redis: aioredis.Redis, db: Session, new_user: User
+):
+    user_cachedb = CRUDDBCacheUser(
+        crud.user,
+        crud.user_cache,
+        expire=1000,
+        refresh_ahead=1e9,
+        session_factory=AsyncSessionLocal,
+    )
+    await user_cachedb.cache_model(redis, db_obj=new_user, expire=10)
+    full_name = random_lower_string()
+    crud.user.update(db, db_obj=new_user, obj_in={"full_name": full_name})
+    user = await user_cachedb.get(async_db, redis, id=new_user.id)
+    assert user.full_name != full_name
+    await asyncio.gather(*user_cachedb.refreshing.values())
+    user = await crud.user_cache.get(redis, id=new_user.id)
+    assert user.full_name == full_name
+    assert await redis.ttl(crud.user_cache.to_key(new_user.id)) > 10
+
+
+@pytest.mark.asyncio
+async def test_cachedb_sliding_expire(
+    async_db: AsyncSession, redis: aioredis.Redis, new_user: User
+):
+    user_cachedb = CRUDDBCacheUser(
+        crud.user, crud.user_cache, expire=1000, sliding_expire=True
+    )
+    await user_cachedb.cache_model(redis, db_obj=new_user, expire=10)
+    assert await user_cachedb.get(async_db, redis, id=new_user.id)
+    assert await redis.ttl(crud.user_cache.to_key(new_user.id)) > 10
+
+
+@pytest.mark.asyncio
+async def test_cachedb_detects_concurrent_updates(
+    async_db: AsyncSession, redis: aioredis.Redis, new_user: User
+):
+    user = await crud.user_cachedb.cache_model(redis, db_obj=new_user)
+    updated_user = await crud.user_cachedb.update(
+        async_db, redis, cache_obj=user, obj_in={"full_name": random_lower_string()}
+    )
+    assert updated_user.version == user.version + 1
+    with pytest.raises(StaleDataError):
+        # By default the update applies to the version it was read at
+        await crud.user_cachedb.update(
+            async_db, redis, cache_obj=user, obj_in={"full_name": "Stale"}
+        )
+    with pytest.raises(StaleDataError):
+        await crud.user_cachedb.update(
+            async_db,
+            redis,
+            cache_obj=user,
+            obj_in={"full_name": random_lower_string()},
+            version=user.version,
+        )
+    # A slow writer holding the older version leaves the newer one cached
+    await crud.user_cache.add(redis, obj_in=user)
+    cached_user = await crud.user_cache.get(redis, id=user.id)
+    assert cached_user.version == updated_user.version
+
+
+@pytest.mark.asyncio
+async def test_cache_refused_writes_have_no_side_effects(
+    redis: aioredis.Redis, new_user: User
+):
+    user_cache = CRUDCacheUser(
+        UserInDB, User.__tablename__, indexes=["username"], local_cache=LocalCache()
+    )
+    user = await user_cache.add_model(redis, obj_in=new_user)
+    newer_user = await user_cache.add(
+        redis,
+        obj_in=user.copy(
+            update={"username": random_lower_string(), "version": user.version + 1}
+        ),
+    )
+    user_cache.local_cache.clear()
+    feed = await redis.xrevrange(user_cache.feed_key, count=1)
+    last_change = feed[0][0].decode() if feed else "0"
+
+    # A slow writer of the older version
+    await user_cache.add(redis, obj_in=user, change=CHANGE_UPDATE)
+    assert user_cache.local_cache.get(user_cache.to_key(user.id)) is None
+    assert await user_cache.read_changes(redis, after=last_change) == []
+    assert (
+        await user_cache.get_id_by_index(redis, field="username", value=user.username)
+        is None
+    )
+    assert (
+        await user_cache.get_id_by_index(
+            redis, field="username", value=newer_user.username
+        )
+        == user.id
+    )
+    await user_cache.remove(redis, id=user.id)
+
+
+@pytest.mark.asyncio
+async def test_cache_locks_records_independently(redis: aioredis.Redis, db: Session):
+    users = [create_random_user(db) for _ in range(2)]
+    lock_manager = aioredlock.Aioredlock([redis])
+    lock = await crud.user_cache.lock(lock_manager, id=users[0].id)
+    try:
+        other_lock = await crud.user_cache.lock(lock_manager, id=users[1].id)
+        await lock_manager.unlock(other_lock)
+        assert await lock_manager.is_locked(crud.user_cache.lock_name(users[0].id))
+    finally:
+        await lock_manager.unlock(lock)
+
+
+@pytest.mark.asyncio
+async def test_lazy_session_holds_connections_only_for_writes(
+    redis: aioredis.Redis, new_user: User
+):
+    checked_out = async_engine.pool.checkedout()
+    db = LazySession()
+    assert db.session is None
+    user = await crud.user_cachedb.get(db, redis, id=new_user.id)
+    assert user.email == new_user.email
+    assert async_engine.pool.checkedout() == checked_out
+
+    db_obj = await crud.user.aget(db, id=new_user.id)
+    assert db_obj.email == new_user.email
+    assert async_engine.pool.checkedout() == checked_out
+
+    full_name = random_lower_string()
+    statement = update(User).where(User.id == new_user.id).values(full_name=full_name)
+    await db.execute(statement)
+    await db.execute(select(User).where(User.id == new_user.id))
+    assert async_engine.pool.checkedout() == checked_out + 1
+    await db.rollback()
+    assert async_engine.pool.checkedout() == checked_out
+    db_obj = await crud.user.aget(db, id=new_user.id)
+    assert db_obj.full_name != full_name
+    await db.close()
@@ -0,0 +1,12 @@
+import os
+
+# Settings of the base image, see tiangolo/uvicorn-gunicorn-docker
+exec(open("/gunicorn_conf.py").read())
+
+
+def child_exit(server, worker):  # type: ignore
+    # Drop the live gauges of exited workers from the aggregated metrics
+    if os.environ.get("prometheus_multiproc_dir"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,5 +1,11 @@
 #! /usr/bin/env bash
 
+# Start the metrics of the workers from scratch
+if [ -n "$prometheus_multiproc_dir" ]; then
+    rm -rf "$prometheus_multiproc_dir"
+    mkdir -p "$prometheus_multiproc_dir"
+fi
+
 # Let the DB start
 python /app/app/backend_pre_start.py
 